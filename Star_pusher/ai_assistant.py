@@ -1,7 +1,15 @@
 import numpy as np 
 from stable_baselines3 import PPO
 import model_related
+import solver
+import bidirectional
+import policy_search
+import portfolio
+import solution_cache
+import anytime_planner
+import planner_session
 import os
+import traceback
 
 ######## convertion rules ############
     # 0: " ",
@@ -10,10 +18,28 @@ import os
     # 3: ".",
     # 4: "*",
     # 5: "@"
+    # 6: "+" (player on a goal)
 ######################################
     
 parent_dir = os.path.dirname(os.path.realpath(__file__))
 model_path = parent_dir + "/models/sokoban_final_curriculum.zip"
+# None runs the float32 policy; "dynamic" or "static" runs the int8 variant (CPU-only hosts)
+quantize_mode = None
+# Search method (solver.METHODS, "bidirectional" or "policy" for the model-guided search) and budget behind get_ai_actions
+solver_method = "astar"
+solver_max_nodes = solver.DEFAULT_MAX_NODES
+solver_time_limit = solver.DEFAULT_TIME_LIMIT
+# Race several solver configurations in parallel processes instead of one search
+use_portfolio = False
+# Answer positions that lie on an already solved plan from the SQLite store, and store new plans
+use_solution_cache = True
+solution_cache_path = solution_cache.DEFAULT_PATH
+# Stream the plan push by push (stream_ai_actions) instead of sending it whole when solved.
+# The anytime planner only runs A* without the policy: with another solver_method or
+# use_portfolio, requests go through get_ai_actions whatever use_streaming says
+use_streaming = True
+# Request id of the message telling serve that the game left the level of its ai_map
+LEAVE_LEVEL = "leave"
 
 if not os.path.exists(model_path):
     print(f"The file {model_path} does not exist.")
@@ -37,13 +63,14 @@ def convert_to_ai_map(starting_map_info, stars_pos, player_pos):
                 ai_map[i, j] = 1
             # updated player and stars position
             elif (i, j) == player_pos:
-                ai_map[i][j] = 5
+                ai_map[i][j] = 6 if (i, j) in goal_pos else 5
             elif (i, j) in stars_pos:
                 if (i, j) in goal_pos:
                     ai_map[i][j] = 4
                 else:
                     ai_map[i][j] = 2
-            elif starting_map[i][j] == ".":
+            elif (i, j) in goal_pos:
+                # goal_pos also has the goals that started under a star ("*")
                 ai_map[i, j] = 3
             else:
             # other places are just floor
@@ -55,10 +82,36 @@ def convert_to_ai_map(starting_map_info, stars_pos, player_pos):
 
 def get_ai_actions(ai_map):
 
-    # result = model_related.test_on_custom_map(model_path, ai_map, False)
-    result = "LRRD"
+    # result = model_related.test_on_custom_map(model_path, ai_map, False, quantize=quantize_mode)
+    cache = solution_cache.SolutionCache(solution_cache_path) if use_solution_cache else None
+    result = cache.lookup_map(ai_map) if cache is not None else None
+    if result is not None:
+        print(f"solution cache: hit, {len(result)} moves")
+    elif use_portfolio:
+        # with a model, the policy-guided search races too (as the int8 variant with quantize_mode)
+        configs = portfolio.DEFAULT_PORTFOLIO + [portfolio.POLICY_CONFIG] if os.path.exists(model_path) else None
+        search = portfolio.solve(ai_map, configs, solver_max_nodes, solver_time_limit,
+                                 model_path if configs else None, quantize_mode)
+        print(f"portfolio: {search.status} by {search.winner} in {search.elapsed:.2f}s")
+    elif solver_method == policy_search.METHOD:
+        search = policy_search.solve(ai_map, model_path, quantize_mode, solver_max_nodes, solver_time_limit)
+        print(f"policy search: {search.status} after {search.nodes} nodes in {search.elapsed:.2f}s")
+    else:
+        search = bidirectional.solve(ai_map, solver_method, solver_max_nodes, solver_time_limit)
+        print(f"solver: {search.status} after {search.nodes} nodes in {search.elapsed:.2f}s")
+    if result is None:
+        result = search.plan or ""
+        if cache is not None and search.solved:
+            cache.store_map(ai_map, result)
+    if cache is not None:
+        cache.close()
+    return plan_to_directions(result)
+
+
+def plan_to_directions(plan):
+    """UDLR string -> list of starpusher directions ("up", "down", "left", "right")."""
     actions = []
-    for char in result: 
+    for char in plan: 
         if char == "L":
             actions.append("left")
         elif char == "R":
@@ -68,4 +121,72 @@ def get_ai_actions(ai_map):
         elif char == "D":
             actions.append("down")
     
-    return actions
\ No newline at end of file
+    return actions
+
+
+def stream_ai_actions(ai_map, put, sessions=None):
+    """
+    Anytime version of get_ai_actions: passes anytime_planner messages to put,
+    with the moves as starpusher directions: ("prefix", [directions]),
+    ("retract", n) and finally ("done", solved). sessions is an optional
+    planner_session.SessionCache that keeps the search of each level between requests.
+    """
+    cache = solution_cache.SolutionCache(solution_cache_path) if use_solution_cache else None
+    result = cache.lookup_map(ai_map) if cache is not None else None
+    if result is not None:
+        print(f"solution cache: hit, {len(result)} moves")
+        put((anytime_planner.PREFIX, plan_to_directions(result)))
+        put((anytime_planner.DONE, True))
+    else:
+        solved = []
+
+        def forward(message):
+            kind, value = message
+            if kind == anytime_planner.PREFIX:
+                value = plan_to_directions(value)
+            elif kind == anytime_planner.DONE:
+                solved.append(value)
+            put((kind, value))
+
+        plan = anytime_planner.stream(ai_map, forward, solver_time_limit, solver_max_nodes, sessions)
+        print(f"anytime planner: {'solved' if solved[-1] else 'failed'}, {len(plan)} moves")
+        if cache is not None and solved[-1]:
+            cache.store_map(ai_map, plan)
+    if cache is not None:
+        cache.close()
+
+
+def streams():
+    """True if AI requests are answered by stream_ai_actions (see use_streaming)."""
+    return use_streaming and solver_method == anytime_planner.METHOD and not use_portfolio
+
+
+def serve(requests, results):
+    """
+    Long-lived AI worker: answers (request id, ai_map) items from the requests
+    queue until it gets a None request id. Every message put on results is
+    tagged with its request id: (request id, kind, value). Search sessions
+    are kept per level, so repeated requests on a level reuse the earlier search,
+    until a (LEAVE_LEVEL, ai_map) item says the game left that level.
+    A request that fails is answered with (request id, "done", False) and the
+    worker goes on with the next one.
+    """
+    sessions = planner_session.SessionCache()
+    while True:
+        request_id, ai_map = requests.get()
+        if request_id is None:
+            return
+        if request_id == LEAVE_LEVEL:
+            sessions.discard_map(ai_map)
+            continue
+        try:
+            if streams():
+                stream_ai_actions(ai_map, lambda message: results.put((request_id,) + message), sessions)
+            else:
+                actions = get_ai_actions(ai_map)
+                results.put((request_id, anytime_planner.PREFIX, actions))
+                results.put((request_id, anytime_planner.DONE, len(actions) > 0))
+        except Exception:
+            print(f"AI request {request_id} failed:")
+            traceback.print_exc()
+            results.put((request_id, anytime_planner.DONE, False))
@@ -0,0 +1,208 @@
+# Anytime planner: stream a plan one committed push at a time.
+#
+# The AI assistant used to wait for the complete solve before the robot made
+# its first move. AnytimePlanner.run() instead yields messages as soon as
+# they are known:
+#   (PREFIX, "UDLR...")  moves to append to what was streamed so far
+#   (RETRACT, n)         only the first n streamed moves are still valid
+#   (DONE, solved)       nothing more will come
+#
+# Each round first tries a full A* solve from the last committed state with
+# a short, growing time budget. If that finishes, the rest of the plan is
+# streamed and the stream ends. Otherwise one more push is committed: the
+# first push of the most promising path found by a small greedy probe, and
+# only if the state after it passes the full deadlock check (dead squares,
+# freeze, bipartite and corral, see deadlock). If a committed state later
+# turns out unsolvable, that push is banned and retracted and the search
+# continues from the state before it; the consumer rewinds to the snapshot
+# it kept at that point.
+#
+# Usage: python3 anytime_planner.py sokoban_cache/boxoban-levels-master/hard/000.txt --limit 10
+
+import argparse
+import heapq
+import os
+import time
+import deadlock
+import macro_moves
+import sokoban_core
+import solver
+
+METHOD = "astar"  # search of the full solves (solver.PushSolver)
+PREFIX = "prefix"
+RETRACT = "retract"
+DONE = "done"
+
+DEFAULT_FIRST_BUDGET = 0.25
+DEFAULT_PROBE_NODES = 300
+BUDGET_GROWTH = 1.5
+INF = float("inf")
+
+
+class AnytimePlanner:
+    """Streams the plan of one SokobanState; see the module comment for the message protocol."""
+    def __init__(self, level, state, time_limit=solver.DEFAULT_TIME_LIMIT, max_nodes=solver.DEFAULT_MAX_NODES,
+                 first_budget=DEFAULT_FIRST_BUDGET, probe_nodes=DEFAULT_PROBE_NODES, search=None):
+        """search: PushSolver of level to use (e.g. a planner_session.SearchSession); a new one by default."""
+        self.level = level
+        self.state = state.copy()
+        self.time_limit = time_limit
+        self.first_budget = first_budget
+        self.probe_nodes = probe_nodes
+        self.solver = search or solver.PushSolver(level, max_nodes, time_limit)
+        self.solver.max_nodes = max_nodes
+        self.deadlocks = deadlock.detector_for(level)
+        self.plan = ""  # moves streamed and not retracted
+
+    def _key(self, player, boxes):
+        return macro_moves.normalized_player(self.level, player, boxes), frozenset(boxes)
+
+    def _probe(self, state, banned):
+        """
+        First push of the path to the lowest estimate a bounded greedy search
+        reaches from state, skipping banned and deadlocked first pushes. None if there is none.
+        """
+        search = self.solver
+        boxes = frozenset(state.boxes)
+        key = self._key(state.player, boxes)
+        moves, _ = search.pushes(state.player, boxes)
+        open_list = []
+        seen = {key}
+        counter = 0
+        for move in moves:
+            push = (move.box, move.action)
+            new_boxes = move.apply(boxes)
+            if (key, push) in banned or self.deadlocks.find_deadlock(move.box, new_boxes) is not None:
+                continue
+            h = search.matching.initial(new_boxes).value
+            if h == INF:
+                continue
+            counter += 1
+            open_list.append((h, 1, counter, move.box, new_boxes, push))
+            seen.add(self._key(move.box, new_boxes))
+        heapq.heapify(open_list)
+
+        best = min(open_list, default=None)
+        expanded = 0
+        while open_list and expanded < self.probe_nodes:
+            h, g, _, player, boxes, first = heapq.heappop(open_list)
+            if (h, g) < best[:2]:
+                best = (h, g, 0, player, boxes, first)
+            if h == 0:
+                break
+            expanded += 1
+            moves, _ = search.pushes(player, boxes)
+            for move in moves:
+                new_boxes = move.apply(boxes)
+                new_key = self._key(move.box, new_boxes)
+                if new_key in seen or search.is_deadlock(move.box, new_boxes, move.box, move.dest):
+                    continue
+                seen.add(new_key)
+                new_h = search.matching.initial(new_boxes).value
+                if new_h != INF:
+                    counter += 1
+                    heapq.heappush(open_list, (new_h, g + 1, counter, move.box, new_boxes, first))
+        return None if best is None else best[5]
+
+    def run(self):
+        """Generator of (PREFIX, moves), (RETRACT, n) and (DONE, solved) messages."""
+        deadline = time.perf_counter() + self.time_limit
+        current = self.state.copy()
+        committed = []  # (state before the push, push, moves streamed for it)
+        banned = set()
+        budget = self.first_budget
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                yield DONE, False
+                return
+            if current.is_solved():
+                yield DONE, True
+                return
+
+            self.solver.time_limit = min(budget, remaining)
+            result = self.solver.solve_state(current, METHOD)
+            budget *= BUDGET_GROWTH
+            if result.solved:
+                self.plan += result.plan
+                yield PREFIX, result.plan
+                yield DONE, True
+                return
+
+            push = None if result.status == "unsolvable" else self._probe(current, banned)
+            if push is None:
+                # Dead end: take back the last committed push and never make it again
+                if not committed:
+                    yield DONE, False
+                    return
+                current, push, moves = committed.pop()
+                banned.add((self._key(current.player, current.boxes), push))
+                self.plan = self.plan[:len(self.plan) - len(moves)]
+                yield RETRACT, len(self.plan)
+                continue
+
+            moves = macro_moves.expand(self.level, current.player, current.boxes, [push])
+            committed.append((current.copy(), push, moves))
+            sokoban_core.replay(current, moves)
+            self.plan += moves
+            yield PREFIX, moves
+
+
+def stream(ai_map, put, time_limit=solver.DEFAULT_TIME_LIMIT, max_nodes=solver.DEFAULT_MAX_NODES, sessions=None):
+    """
+    Run the planner on a convert_to_ai_map grid, passing each message to put.
+    sessions: optional planner_session.SessionCache to search with. Returns the final plan.
+    """
+    if sessions is not None:
+        search, state = sessions.session_for_map(ai_map)
+        level = search.level
+    else:
+        search = None
+        level, state = sokoban_core.parse_numeric(ai_map)
+    planner = AnytimePlanner(level, state, time_limit, max_nodes, search=search)
+    for message in planner.run():
+        put(message)
+    return planner.plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare first-move latency of the anytime planner with a full solve.")
+    parser.add_argument("level_file")
+    parser.add_argument("--time-limit", type=float, default=solver.DEFAULT_TIME_LIMIT)
+    parser.add_argument("--first-budget", type=float, default=DEFAULT_FIRST_BUDGET)
+    parser.add_argument("--limit", type=int, default=None, help="only the first N levels")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.level_file):
+        raise SystemExit(f"The file {args.level_file} does not exist.")
+
+    levels = sokoban_core.read_level_file(args.level_file)[:args.limit]
+    first_moves, totals, solved = [], [], 0
+    for i, map_lines in enumerate(levels):
+        level, state = sokoban_core.parse_ascii(map_lines)
+        planner = AnytimePlanner(level, state, args.time_limit, first_budget=args.first_budget)
+        start = time.perf_counter()
+        first = None
+        retractions = 0
+        done = False
+        for kind, value in planner.run():
+            if kind == PREFIX and first is None:
+                first = time.perf_counter() - start
+            elif kind == RETRACT:
+                retractions += 1
+            elif kind == DONE:
+                done = value
+        total = time.perf_counter() - start
+        if done:
+            check = state.copy()
+            sokoban_core.replay(check, planner.plan)
+            assert check.is_solved(), f"level {i}: streamed plan does not solve the level"
+            solved += 1
+        first_moves.append(first if first is not None else total)
+        totals.append(total)
+        print(f"level {i:4d}: {'solved' if done else 'failed':7s} first move={first_moves[-1]:6.3f}s "
+              f"complete={total:6.3f}s retractions={retractions}")
+
+    print("=" * 50)
+    print(f"Solved {solved}/{len(levels)}, mean first move {sum(first_moves)/max(len(levels), 1):.3f}s, "
+          f"mean complete {sum(totals)/max(len(levels), 1):.3f}s")
@@ -0,0 +1,231 @@
+# Play Star Pusher levels without a window, as fast as the agent allows.
+#
+# Every level is played with the game's own rules (starpusher.read_map,
+# decorateMap, playMove/makeMove and isLevelFinished) by a scripted agent:
+#   ai      the AI assistant of the game: the same long-lived worker process
+#           (starpusher.start_ai_worker, ai_assistant.serve) and the same
+#           prefix/retract/done messages, but the moves are played as they
+#           arrive instead of AI_MOVES_PER_SECOND
+#   solver  an in-process solver.solve() plan for each level
+#   random  random moves, up to --max-steps
+# Levels are the ones the game would load for --difficulty (read_maps_from_file,
+# so medium and hard are 20 random maps of one file; see --seed), or every
+# level of the given --levels files or folders.
+#
+# Nothing is drawn by default. --render draws every move with drawMap/updateMap
+# on the SDL dummy video driver, to time the drawing too.
+# One line per level: status, steps, pushes, planning and play time.
+#
+# Usage: python3 batch_play.py --difficulty learning --agent ai
+#        python3 batch_play.py --levels sokoban_cache/boxoban-levels-master/hard/000.txt --agent solver --out hard.jsonl
+
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # before pygame opens a display
+import argparse
+import copy
+import json
+import queue
+import random
+import time
+from collections import Counter
+import anytime_planner
+import ai_assistant
+import batch_solve
+import solver
+import starpusher
+
+AGENTS = ("ai", "solver", "random")
+DIRECTIONS = [starpusher.UP, starpusher.DOWN, starpusher.LEFT, starpusher.RIGHT]
+DEFAULT_MAX_STEPS = 1000
+DEFAULT_TIMEOUT = 60.0
+
+
+def game_levels(difficulty, seed=None):
+    """(name, level object) for the levels the game loads for a difficulty."""
+    random.seed(seed)
+    starpusher.current_difficulty = difficulty
+    levels, names = starpusher.read_maps_from_file(starpusher.LEVEL_FOLDERS[difficulty])
+    for name, levelObj in zip(names, levels):
+        yield name, levelObj
+
+
+def file_levels(paths):
+    """(level id, level object) for every level of the level files under paths."""
+    for identifier, map_lines in batch_solve.iter_levels(paths):
+        try:
+            yield identifier, starpusher.read_map(map_lines)
+        except AssertionError as e:
+            yield identifier, e
+
+
+def ai_agent(levelObj, gameStateObj, put, timeout=DEFAULT_TIMEOUT):
+    """Asks the game's AI worker for help on this position and passes its messages to put."""
+    starpusher.start_ai_worker()
+    starpusher.ai_request_id += 1
+    request_id = starpusher.ai_request_id
+    ai_map = ai_assistant.convert_to_ai_map(levelObj, gameStateObj.stars, gameStateObj.player)
+    starpusher.ai_requests.put((request_id, ai_map))
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            message = starpusher.ai_results.get(timeout=min(max(deadline - time.perf_counter(), 0), 1.0))
+        except queue.Empty:
+            if time.perf_counter() < deadline and starpusher.ai_action_process.is_alive():
+                continue
+            put((anytime_planner.DONE, False))
+            return
+        if message[0] != request_id:
+            continue  # left over from a request that timed out
+        put(message[1:])
+        if message[1] == anytime_planner.DONE:
+            return
+
+
+def solver_agent(levelObj, gameStateObj, put, method="astar", max_nodes=solver.DEFAULT_MAX_NODES,
+                 time_limit=solver.DEFAULT_TIME_LIMIT):
+    ai_map = ai_assistant.convert_to_ai_map(levelObj, gameStateObj.stars, gameStateObj.player)
+    search = solver.solve(ai_map, method, max_nodes, time_limit)
+    put((anytime_planner.PREFIX, ai_assistant.plan_to_directions(search.plan or "")))
+    put((anytime_planner.DONE, search.solved))
+
+
+def random_agent(levelObj, gameStateObj, put, max_steps=DEFAULT_MAX_STEPS, rng=random):
+    put((anytime_planner.PREFIX, [rng.choice(DIRECTIONS) for _ in range(max_steps)]))
+    put((anytime_planner.DONE, False))
+
+
+class Renderer:
+    """Draws the played moves the way runLevel does, on whatever display SDL has."""
+    def __init__(self):
+        starpusher.initGame()
+        self.mapSurf = self.background = None
+
+    def start(self, mapObj, gameStateObj, ai_mode):
+        self.ai_mode = ai_mode
+        self.background = starpusher.drawMapBackground(mapObj)
+        self.mapSurf = starpusher.drawMap(mapObj, gameStateObj, gameStateObj.goals, ai_mode, self.background)
+        self.mapSurfRect = self.mapSurf.get_rect()
+        self.mapSurfRect.center = (2 * starpusher.HALF_WINWIDTH // 3, starpusher.HALF_WINHEIGHT)
+        starpusher.DISPLAYSURF.fill(starpusher.BGCOLOR)
+        starpusher.DISPLAYSURF.blit(self.mapSurf, self.mapSurfRect)
+        starpusher.pygame.display.update()
+
+    def update(self, spaces, gameStateObj):
+        rects = starpusher.updateMap(self.mapSurf, self.background, spaces, gameStateObj, gameStateObj.goals,
+                                     self.ai_mode)
+        dirtyRects = []
+        for tileRect in rects:
+            screenRect = tileRect.move(self.mapSurfRect.topleft)
+            starpusher.DISPLAYSURF.blit(self.mapSurf, screenRect, tileRect)
+            dirtyRects.append(screenRect)
+        starpusher.pygame.display.update(dirtyRects)
+
+
+def play_level(levelObj, agent, renderer=None, ai_mode=False):
+    """
+    Plays one level with agent(levelObj, gameStateObj, put). Returns a result
+    record: status ("solved" or "unsolved"), steps, pushes, blocked moves, the
+    time until the first moves arrived (plan_time) and in total. ai_mode
+    draws the player as the robot and keeps the states needed to rewind
+    retracted moves (only the planner retracts).
+    """
+    start = time.perf_counter()
+    mapObj = starpusher.decorateMap(levelObj['mapObj'], levelObj['startState']['player'])
+    gameStateObj = copy.deepcopy(levelObj['startState'])
+    if renderer is not None:
+        renderer.start(mapObj, gameStateObj, ai_mode)
+    record = {"status": "unsolved", "steps": 0, "pushes": 0, "blocked": 0, "plan_time": None}
+    # snapshots[i]: game state after the first i moves, to rewind when the planner retracts moves
+    snapshots = [copy.deepcopy(gameStateObj)] if ai_mode else None
+
+    def put(message):
+        nonlocal gameStateObj
+        kind, value = message
+        if record["plan_time"] is None:
+            record["plan_time"] = time.perf_counter() - start
+        if kind == anytime_planner.PREFIX:
+            for playerMoveTo in value:
+                if starpusher.isLevelFinished(levelObj, gameStateObj):
+                    break
+                moved, _, spaces = starpusher.playMove(mapObj, gameStateObj, playerMoveTo)
+                record["blocked"] += not moved
+                if snapshots is not None:
+                    snapshots.append(copy.deepcopy(gameStateObj))
+                if renderer is not None and spaces:
+                    renderer.update(spaces, gameStateObj)
+        elif kind == anytime_planner.RETRACT and snapshots is not None and len(snapshots) > value + 1:
+            gameStateObj = copy.deepcopy(snapshots[value])
+            del snapshots[value + 1:]
+            if renderer is not None:
+                renderer.start(mapObj, gameStateObj, ai_mode)
+
+    agent(levelObj, gameStateObj, put)
+    if starpusher.isLevelFinished(levelObj, gameStateObj):
+        record["status"] = "solved"
+    record["steps"] = gameStateObj.stepCounter
+    record["pushes"] = gameStateObj.pushCounter
+    record["time"] = time.perf_counter() - start
+    return record
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play Star Pusher levels with a scripted agent, without a window.")
+    parser.add_argument("--difficulty", choices=sorted(starpusher.LEVEL_FOLDERS), default="learning")
+    parser.add_argument("--levels", nargs="*", default=None, help="level files or folders (instead of --difficulty)")
+    parser.add_argument("--agent", choices=AGENTS, default="ai")
+    parser.add_argument("--method", choices=solver.METHODS, default="astar", help="solver agent search")
+    parser.add_argument("--max-nodes", type=int, default=solver.DEFAULT_MAX_NODES)
+    parser.add_argument("--time-limit", type=float, default=solver.DEFAULT_TIME_LIMIT, help="seconds per level")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="ai agent: seconds to wait for the worker")
+    parser.add_argument("--max-steps", type=int, default=DEFAULT_MAX_STEPS, help="random agent: moves per level")
+    parser.add_argument("--seed", type=int, default=None, help="level selection and random agent seed")
+    parser.add_argument("--limit", type=int, default=None, help="play at most this many levels")
+    parser.add_argument("--render", action="store_true", help="draw every move (SDL dummy driver by default)")
+    parser.add_argument("--out", default=None, help="write every result as a JSON line")
+    args = parser.parse_args()
+
+    if args.agent == "ai":
+        ai_assistant.solver_max_nodes = args.max_nodes
+        ai_assistant.solver_time_limit = args.time_limit
+        agent = lambda levelObj, gameStateObj, put: ai_agent(levelObj, gameStateObj, put, args.timeout)
+    elif args.agent == "solver":
+        agent = lambda levelObj, gameStateObj, put: solver_agent(levelObj, gameStateObj, put, args.method,
+                                                                 args.max_nodes, args.time_limit)
+    else:
+        rng = random.Random(args.seed)
+        agent = lambda levelObj, gameStateObj, put: random_agent(levelObj, gameStateObj, put, args.max_steps, rng)
+
+    levels = file_levels(args.levels) if args.levels else game_levels(args.difficulty, args.seed)
+    renderer = Renderer() if args.render else None
+    results = []
+    start = time.perf_counter()
+    out = open(args.out, "w") if args.out else None
+    try:
+        for name, levelObj in levels:
+            if args.limit is not None and len(results) >= args.limit:
+                break
+            if isinstance(levelObj, AssertionError):
+                record = {"status": "invalid", "steps": 0, "pushes": 0, "blocked": 0, "plan_time": None, "time": 0.0}
+            else:
+                record = play_level(levelObj, agent, renderer, args.agent == "ai")
+                starpusher.leave_ai_level(levelObj)
+            record = {"name": name, **record}
+            results.append(record)
+            plan_time = "-" if record["plan_time"] is None else f"{record['plan_time']:.3f}s"
+            print(f"{name}: {record['status']}, {record['steps']} steps, {record['pushes']} pushes, "
+                  f"{record['blocked']} blocked, first moves after {plan_time}, {record['time']:.3f}s")
+            if out is not None:
+                out.write(json.dumps(record) + "\n")
+    finally:
+        if out is not None:
+            out.close()
+        starpusher.stop_ai_worker()
+    elapsed = time.perf_counter() - start
+
+    counts = Counter(record["status"] for record in results)
+    steps = sum(record["steps"] for record in results)
+    print("=" * 50)
+    print(f"{len(results)} levels in {elapsed:.2f}s ({steps} steps, {steps / max(elapsed, 1e-9):.0f} steps/s): "
+          + ", ".join(f"{status} {counts[status]}" for status in ("solved", "unsolved", "invalid")))
+    if counts["solved"] != len(results):
+        raise SystemExit(1)
@@ -0,0 +1,189 @@
+# Solve whole Boxoban level collections in parallel.
+#
+# Levels are read lazily from files or directories (recursively, *.txt),
+# handed to a pool of worker processes in chunks and written as one JSON line
+# per level to an append-only output:
+#   {"id": "hard/000.txt:12", "split": "hard", "status": "solved", "plan": "...",
+#    "pushes": 31, "moves": 112, "nodes": 904, "time": 0.081, "worker": 1234}
+# "split" is the first directory below boxoban-levels-master (unfiltered,
+# medium or hard) and, with "nodes", serves as the difficulty label.
+#
+# The output doubles as the checkpoint: on restart every id already in it is
+# skipped, and a line cut off by an interruption is dropped first. While
+# running, levels/sec and the share of wall time each worker spent solving
+# are printed every --report seconds.
+#
+# --method policy runs the policy-guided search (policy_search) with the
+# model given by --model, as the int8 variant with --quantize.
+#
+# Usage: python3 batch_solve.py sokoban_cache/boxoban-levels-master/hard --out hard.jsonl --workers 8
+#        python3 batch_solve.py sokoban_cache/boxoban-levels-master/hard --out hard.jsonl --method policy --quantize dynamic
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+import bidirectional
+import sokoban_core
+import solver
+
+POLICY_METHOD = "policy"  # policy_search.METHOD; policy_search (torch) is only imported by the workers using it
+METHODS = solver.METHODS + (bidirectional.METHOD, POLICY_METHOD)
+parent_dir = os.path.dirname(os.path.realpath(__file__))
+BOXOBAN_ROOT = parent_dir + "/sokoban_cache/boxoban-levels-master"
+DEFAULT_MODEL_PATH = parent_dir + "/models/sokoban_final_curriculum.zip"
+
+_settings = {}
+
+
+def level_files(paths):
+    """The .txt files under paths (files are kept as given), sorted within each directory."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".txt"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def level_id(file_path, index, root=BOXOBAN_ROOT):
+    """Stable id "<path below root>:<index>" (the absolute path for files outside root)."""
+    file_path = os.path.abspath(file_path)
+    root = os.path.abspath(root)
+    if file_path.startswith(root + os.sep):
+        file_path = os.path.relpath(file_path, root)
+    return f"{file_path}:{index}"
+
+
+def iter_levels(paths, done=()):
+    """(level id, map lines) for every level not in done."""
+    for file_path in level_files(paths):
+        for index, map_lines in enumerate(sokoban_core.read_level_file(file_path)):
+            identifier = level_id(file_path, index)
+            if identifier not in done:
+                yield identifier, map_lines
+
+
+def load_checkpoint(out_path):
+    """Ids already in the output. A partial last line (interrupted write) is cut off."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        if line.strip():
+            done.add(json.loads(line)["id"])
+    return done
+
+
+def _init_worker(method, max_nodes, time_limit, model_path=DEFAULT_MODEL_PATH, quantize=None):
+    _settings.update(method=method, max_nodes=max_nodes, time_limit=time_limit)
+    if method == POLICY_METHOD:
+        import policy_search
+        _settings["evaluator"] = policy_search.evaluator_for(model_path, quantize)
+
+
+def solve_level(task):
+    """Worker: solve one level and return its output record."""
+    identifier, map_lines = task
+    level, state = sokoban_core.parse_ascii(map_lines)
+    if _settings["method"] == POLICY_METHOD:
+        import policy_search
+        search = policy_search.PolicySearch(level, _settings["evaluator"], _settings["max_nodes"],
+                                            _settings["time_limit"])
+    else:
+        search = bidirectional.BidirectionalSolver(level, _settings["max_nodes"], _settings["time_limit"])
+    result = search.solve_state(state, _settings["method"])
+    pushes = None
+    if result.solved:
+        check = state.copy()
+        pushes = sum(check.step(action)[1] for action in result.plan)
+        if not check.is_solved():
+            result = result._replace(plan=None, solved=False, status="invalid")
+            pushes = None
+    split = identifier.split("/", 1)[0] if "/" in identifier and not os.path.isabs(identifier) else None
+    return {"id": identifier, "split": split, "status": result.status, "plan": result.plan, "pushes": pushes,
+            "moves": len(result.plan) if result.plan else None, "nodes": result.nodes,
+            "time": round(result.elapsed, 4), "worker": os.getpid()}
+
+
+def run(paths, out_path, workers=None, method="astar", max_nodes=solver.DEFAULT_MAX_NODES,
+        time_limit=solver.DEFAULT_TIME_LIMIT, chunk_size=8, report=10.0, limit=None, model_path=DEFAULT_MODEL_PATH,
+        quantize=None):
+    """
+    Solve every level under paths that is not in out_path yet. Returns a summary dict.
+    model_path and quantize (None, "dynamic" or "static") are used by the policy method.
+    """
+    workers = workers or os.cpu_count()
+    done = load_checkpoint(out_path)
+    if done:
+        print(f"Resuming: {len(done)} levels already in {out_path}")
+    tasks = iter_levels(paths, done)
+    if limit is not None:
+        tasks = (task for _, task in zip(range(limit), tasks))
+
+    counts = defaultdict(int)
+    busy = defaultdict(float)  # worker pid -> seconds spent solving
+    start = last_report = time.time()
+    finished = 0
+    with open(out_path, "a") as out, multiprocessing.Pool(workers, _init_worker,
+                                                          (method, max_nodes, time_limit, model_path,
+                                                           quantize)) as pool:
+        for record in pool.imap_unordered(solve_level, tasks, chunksize=chunk_size):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            finished += 1
+            counts[record["status"]] += 1
+            busy[record["worker"]] += record["time"]
+            now = time.time()
+            if now - last_report >= report:
+                last_report = now
+                _print_progress(finished, counts, busy, workers, now - start)
+    elapsed = time.time() - start
+    _print_progress(finished, counts, busy, workers, elapsed)
+    return {"levels": finished, "statuses": dict(counts), "elapsed": elapsed,
+            "levels_per_second": finished / max(elapsed, 1e-9)}
+
+
+def _print_progress(finished, counts, busy, workers, elapsed):
+    statuses = ", ".join(f"{status} {count}" for status, count in sorted(counts.items()))
+    utilization = [busy[pid] / max(elapsed, 1e-9) for pid in sorted(busy)]
+    mean = sum(utilization) / workers
+    print(f"{finished} levels in {elapsed:.1f}s ({finished / max(elapsed, 1e-9):.2f} levels/s) [{statuses}] "
+          f"worker utilization {mean:.0%} ({' '.join(f'{u:.0%}' for u in utilization)})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve Boxoban level files in parallel with resumable JSONL output.")
+    parser.add_argument("paths", nargs="+", help="level files or directories (searched for *.txt)")
+    parser.add_argument("--out", required=True, help="JSONL output, appended to and used as the checkpoint")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--method", choices=METHODS, default="astar")
+    parser.add_argument("--max-nodes", type=int, default=solver.DEFAULT_MAX_NODES)
+    parser.add_argument("--time-limit", type=float, default=solver.DEFAULT_TIME_LIMIT)
+    parser.add_argument("--chunk-size", type=int, default=8, help="levels handed to a worker at a time")
+    parser.add_argument("--report", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--limit", type=int, default=None, help="stop after N new levels")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="PPO model of the policy method")
+    parser.add_argument("--quantize", choices=("dynamic", "static"), default=None,
+                        help="policy method: run the int8 variant of the model (CPU-only hosts)")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if not os.path.exists(path):
+            raise SystemExit(f"The path {path} does not exist.")
+    if args.method == POLICY_METHOD and not os.path.exists(args.model):
+        raise SystemExit(f"The file {args.model} does not exist.")
+    if args.quantize is not None and args.method != POLICY_METHOD:
+        raise SystemExit("--quantize only applies to --method policy")
+    run(args.paths, args.out, args.workers, args.method, args.max_nodes, args.time_limit,
+        args.chunk_size, args.report, args.limit, args.model, args.quantize)
@@ -0,0 +1,298 @@
+# Behavior-cloning dataset built from the recorded human solutions.
+#
+# Every demo file (human_demos/*.txt, sokoban_cache/human_training/*.txt) and
+# every attempt in the play logs (sokoban_cache/demo_logs, see demo_log) is
+# replayed through sokoban_core, and the (observation, action) pairs are written
+# into sharded .npy files that are opened memory-mapped at training time:
+#
+#   <out_dir>/index.json
+#   <out_dir>/obs_10x10_0000.npy      uint8 (N, 10, 10) observation codes (see obs_codec)
+#   <out_dir>/act_10x10_0000.npy      int8  (N,)   0 up, 1 down, 2 left, 3 right
+#
+# Shards are grouped by map size, so a mini-batch never mixes shapes.
+# The loader decodes each batch to the (B, 7, H, W) one-hot observation.
+#
+# Usage: python3 bc_dataset.py [--out sokoban_cache/bc_dataset] [--shard-size 65536]
+
+import argparse
+import json
+import os
+import numpy as np
+import demo_log
+import obs_codec
+import plan_optimizer
+import sokoban_core
+
+parent_dir = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_SOURCES = [os.path.join(os.path.dirname(parent_dir), "human_demos"),
+                   os.path.join(parent_dir, "sokoban_cache", "human_training"),
+                   demo_log.LOG_DIR]
+DEFAULT_OUT_DIR = os.path.join(parent_dir, "sokoban_cache", "bc_dataset")
+INDEX_FILE = "index.json"
+
+
+def demo_to_pairs(file_path, optimize=False):
+    """Replay one demo file; see actions_to_pairs."""
+    map_lines, action_string = sokoban_core.read_demo_file(file_path)
+    return actions_to_pairs(map_lines, action_string, optimize)
+
+
+def actions_to_pairs(map_lines, action_string, optimize=False):
+    """
+    Replay one demo. Returns (observation codes, actions, solved, blocked)
+    where blocked counts actions that did not move the player (they are dropped).
+    optimize first shortens the demo with plan_optimizer.
+    """
+    level, state = sokoban_core.parse_ascii(map_lines)
+    if optimize:
+        action_string = plan_optimizer.optimize(state, action_string).plan
+
+    observations = []
+    actions = []
+    blocked = 0
+    for char in action_string:
+        obs = state.code_grid()
+        moved, _ = state.step(char)
+        if not moved:
+            blocked += 1
+            continue
+        observations.append(obs)
+        actions.append(sokoban_core.ACTION_INDEX[char])
+
+    return observations, actions, state.is_solved(), blocked
+
+
+class _ShardWriter:
+    """Appends pairs of one map size into fixed-size memory-mapped shards."""
+    def __init__(self, out_dir, shape, shard_size):
+        self.out_dir = out_dir
+        self.shape = shape
+        self.shard_size = shard_size
+        self.shards = []
+        self._obs = None
+        self._act = None
+        self._count = 0
+
+    def _open_shard(self):
+        tag = f"{self.shape[0]}x{self.shape[1]}_{len(self.shards):04d}"
+        obs_file = f"obs_{tag}.npy"
+        act_file = f"act_{tag}.npy"
+        self._obs = np.lib.format.open_memmap(os.path.join(self.out_dir, obs_file), mode="w+", dtype=np.uint8,
+                                              shape=(self.shard_size,) + self.shape)
+        self._act = np.lib.format.open_memmap(os.path.join(self.out_dir, act_file), mode="w+", dtype=np.int8,
+                                              shape=(self.shard_size,))
+        self._count = 0
+        self.shards.append({"obs": obs_file, "actions": act_file, "count": 0,
+                            "shape": [sokoban_core.NUM_CHANNELS, *self.shape]})  # decoded shape
+
+    def add(self, observations, actions):
+        start = 0
+        while start < len(actions):
+            if self._obs is None or self._count == self.shard_size:
+                self._close_shard()
+                self._open_shard()
+            n = min(self.shard_size - self._count, len(actions) - start)
+            self._obs[self._count:self._count + n] = observations[start:start + n]
+            self._act[self._count:self._count + n] = actions[start:start + n]
+            self._count += n
+            start += n
+
+    def _close_shard(self):
+        if self._obs is None:
+            return
+        self._obs.flush()
+        self._act.flush()
+        self.shards[-1]["count"] = self._count
+        self._obs = None
+        self._act = None
+
+    def close(self):
+        """Flush the last shard and trim it to its real length."""
+        if self._obs is None:
+            return
+        count = self._count
+        self._close_shard()
+        if count < self.shard_size:
+            for key in ("obs", "actions"):
+                path = os.path.join(self.out_dir, self.shards[-1][key])
+                data = np.load(path, mmap_mode="r")[:count].copy()
+                np.save(path, data)
+
+
+def iter_demos(sources, require_solved=True):
+    """
+    (name, map lines, UDLR actions) for the demo files and play-log attempts in
+    the source folders. Unsolved log attempts (resets) are left out unless
+    require_solved is False; demo files are always yielded.
+    """
+    for source in sources:
+        if not os.path.isdir(source):
+            print(f"Skipping missing folder {source}")
+            continue
+        for file_name in sorted(os.listdir(source)):
+            if file_name.endswith(".txt"):
+                file_path = os.path.join(source, file_name)
+                yield (file_path,) + sokoban_core.read_demo_file(file_path)
+        for log_path in demo_log.log_files([source]):
+            attempts = demo_log.iter_demos([log_path], require_solved)
+            for i, (name, map_lines, actions, _) in enumerate(attempts):
+                yield f"{log_path}#{i} {name}", map_lines, actions
+
+
+def build_dataset(sources=None, out_dir=DEFAULT_OUT_DIR, shard_size=65536, require_solved=True, optimize=False):
+    """
+    Replay every demo in the source folders and write the sharded dataset.
+    optimize trains on the plan_optimizer version of each demo.
+    Returns the index dict (also written to <out_dir>/index.json).
+    """
+    sources = sources or DEFAULT_SOURCES
+    os.makedirs(out_dir, exist_ok=True)
+    writers = {}
+    index = {"version": 2, "encoding": "codes", "shards": [], "files": {}, "skipped": {}}
+
+    for file_path, map_lines, action_string in iter_demos(sources, require_solved):
+        try:
+            observations, actions, solved, blocked = actions_to_pairs(map_lines, action_string, optimize)
+        except ValueError as e:
+            index["skipped"][file_path] = str(e)
+            continue
+        if require_solved and not solved:
+            index["skipped"][file_path] = "demo does not solve the level"
+            continue
+        if not actions:
+            index["skipped"][file_path] = "no actions"
+            continue
+
+        shape = observations[0].shape
+        if shape not in writers:
+            writers[shape] = _ShardWriter(out_dir, shape, shard_size)
+        writers[shape].add(np.stack(observations), np.array(actions, dtype=np.int8))
+        index["files"][file_path] = {"pairs": len(actions), "blocked": blocked}
+
+    for writer in writers.values():
+        writer.close()
+        index["shards"].extend(writer.shards)
+
+    with open(os.path.join(out_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f, indent=2)
+
+    total = sum(shard["count"] for shard in index["shards"])
+    print(f"Wrote {total} pairs from {len(index['files'])} demos into {len(index['shards'])} shards in {out_dir}")
+    if index["skipped"]:
+        print(f"Skipped {len(index['skipped'])} demos (see index.json)")
+    return index
+
+
+class BCDataset:
+    """Memory-mapped view of a dataset written by build_dataset."""
+    def __init__(self, data_dir=DEFAULT_OUT_DIR):
+        with open(os.path.join(data_dir, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        if self.index.get("encoding") != "codes":
+            raise ValueError(f"{data_dir} was written by an older version, rebuild it with build_dataset()")
+        self.groups = {}  # shape -> list of (obs memmap, actions memmap)
+        for shard in self.index["shards"]:
+            obs = np.load(os.path.join(data_dir, shard["obs"]), mmap_mode="r")
+            act = np.load(os.path.join(data_dir, shard["actions"]), mmap_mode="r")
+            self.groups.setdefault(tuple(shard["shape"]), []).append((obs, act))
+
+    def __len__(self):
+        return sum(len(act) for shards in self.groups.values() for _, act in shards)
+
+
+class BCDataLoader:
+    """
+    Streams shuffled (observations, actions) mini-batches from a BCDataset.
+
+    Batches hold one map size each; rows are gathered per shard in sorted order
+    so reads stay sequential within the memory map.
+    """
+    def __init__(self, dataset, batch_size=256, shuffle=True, drop_last=False, seed=None, as_torch=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rng = np.random.default_rng(seed)
+        self.as_torch = as_torch
+
+    def _batches_for_group(self, shards):
+        # (shard id, row) for every sample of this shape
+        shard_ids = np.concatenate([np.full(len(act), i, dtype=np.int32) for i, (_, act) in enumerate(shards)])
+        rows = np.concatenate([np.arange(len(act), dtype=np.int64) for _, act in shards])
+        order = self.rng.permutation(len(rows)) if self.shuffle else np.arange(len(rows))
+
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            if self.drop_last and len(batch) < self.batch_size:
+                break
+            obs_parts = []
+            act_parts = []
+            for shard_id in np.unique(shard_ids[batch]):
+                shard_rows = np.sort(rows[batch[shard_ids[batch] == shard_id]])
+                obs, act = shards[shard_id]
+                obs_parts.append(obs[shard_rows])
+                act_parts.append(act[shard_rows])
+            yield obs_codec.decode(np.concatenate(obs_parts)), np.concatenate(act_parts)
+
+    def __iter__(self):
+        generators = [self._batches_for_group(shards) for shards in self.dataset.groups.values()]
+        while generators:
+            # Interleave map sizes so an epoch is not ordered by shape
+            generator = generators[self.rng.integers(len(generators))] if self.shuffle else generators[0]
+            try:
+                obs, act = next(generator)
+            except StopIteration:
+                generators.remove(generator)
+                continue
+            if self.as_torch:
+                import torch
+                yield torch.as_tensor(obs, dtype=torch.float32), torch.as_tensor(act, dtype=torch.int64)
+            else:
+                yield obs, act
+
+
+def pretrain_policy(model, data_dir=DEFAULT_OUT_DIR, epochs=5, batch_size=256, learning_rate=1e-4):
+    """
+    Behavior-cloning pretraining of a PPO model's policy head on the demo dataset.
+
+    Maps smaller than the policy's input are padded through ShapeBucketBatcher;
+    a size-agnostic policy (see EnhancedSokobanCNN head) takes every size as is.
+    """
+    import torch
+    import model_related
+
+    policy = model.policy
+    optimizer = torch.optim.Adam(policy.parameters(), lr=learning_rate)
+    loader = BCDataLoader(BCDataset(data_dir), batch_size=batch_size)
+    batcher = model_related.ShapeBucketBatcher.for_policy(policy)
+
+    policy.set_training_mode(True)
+    for epoch in range(epochs):
+        losses = []
+        for obs, actions in loader:
+            (_, obs), = batcher.collate(obs, single_bucket=True)
+            obs = torch.as_tensor(obs, dtype=torch.float32, device=policy.device)
+            actions = torch.as_tensor(actions, dtype=torch.int64, device=policy.device)
+            _, log_prob, _ = policy.evaluate_actions(obs, actions)
+            loss = -log_prob.mean()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+        print(f"BC epoch {epoch+1}/{epochs}: loss={np.mean(losses):.4f}")
+    policy.set_training_mode(False)
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the behavior-cloning dataset from human demos.")
+    parser.add_argument("sources", nargs="*", help="demo or play-log folders (default: human_demos, human_training "
+                                                  "and the demo_log folder)")
+    parser.add_argument("--out", default=DEFAULT_OUT_DIR)
+    parser.add_argument("--shard-size", type=int, default=65536)
+    parser.add_argument("--include-unsolved", action="store_true")
+    parser.add_argument("--optimize", action="store_true", help="shorten the demos with plan_optimizer first")
+    args = parser.parse_args()
+
+    build_dataset(args.sources or None, args.out, args.shard_size, require_solved=not args.include_unsolved,
+                  optimize=args.optimize)
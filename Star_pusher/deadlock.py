@@ -0,0 +1,258 @@
+# Deadlock detection shared by the solvers and the RL environments.
+#
+# A state is deadlocked when it can no longer be solved, whatever the player does:
+#   dead square: a box on a cell from which no goal can be reached by pushing
+#   freeze:      a box off its goal that can move on neither axis, because of
+#                walls, dead squares or other frozen boxes
+#   bipartite:   boxes cannot be matched one-to-one with goals they can reach
+#   corral:      boxes fence off an area the player cannot enter, and a small
+#                search over the fence boxes alone cannot open it or put them
+#                on goals
+#
+# Everything that only depends on walls and goals is built once per level by
+# DeadlockDetector; check_push tests one push incrementally, is_deadlocked
+# tests a whole state.
+
+import weakref
+import macro_moves
+
+OPPOSITE = macro_moves.OPPOSITE
+INF = float("inf")
+
+DEAD_SQUARE = "dead_square"
+FREEZE = "freeze"
+BIPARTITE = "bipartite"
+CORRAL = "corral"
+
+
+class DeadlockDetector:
+    """Per-level tables plus the deadlock checks. Boxes are collections of flat cells."""
+    def __init__(self, level, corral_budget=64):
+        self.level = level
+        self.goals = sorted(level.goals)
+        self.corral_budget = corral_budget
+
+        # goal_distance[g][cell]: pushes needed to bring a box from cell to goal g
+        self.goal_distance = [self._pull_distances(goal) for goal in self.goals]
+        self.min_distance = [min((dist[cell] for dist in self.goal_distance), default=0)
+                             for cell in range(level.size)]
+        self.dead = bytearray(1 if d == INF else 0 for d in self.min_distance)
+        # goal_mask[cell]: bit g is set when goal g is reachable from cell
+        self.goal_mask = [sum(1 << g for g, dist in enumerate(self.goal_distance) if dist[cell] != INF)
+                          for cell in range(level.size)]
+
+    def _pull_distances(self, goal):
+        """Backward BFS from goal: a box moves from cell to cell+d only if the player fits at cell-d."""
+        level = self.level
+        distance = [INF] * level.size
+        distance[goal] = 0
+        frontier = [goal]
+        while frontier:
+            next_frontier = []
+            for cell in frontier:
+                for action in range(4):
+                    # Box came from `prev`, pushed by a player standing behind it at `player`
+                    prev = level.neighbours[cell][OPPOSITE[action]]
+                    if not level.is_free(prev) or distance[prev] != INF:
+                        continue
+                    player = level.neighbours[prev][OPPOSITE[action]]
+                    if not level.is_free(player):
+                        continue
+                    distance[prev] = distance[cell] + 1
+                    next_frontier.append(prev)
+            frontier = next_frontier
+        return distance
+
+    def _exact_count(self, boxes):
+        # With spare boxes a box may stay anywhere, so only the matching check applies
+        return len(boxes) == len(self.goals)
+
+    # ---- freeze ----
+
+    def _blocked_on_axis(self, box, axis, boxes, walls_now):
+        """axis 0 is vertical (U/D), 1 horizontal (L/R)."""
+        level = self.level
+        first = level.neighbours[box][2 * axis]
+        second = level.neighbours[box][2 * axis + 1]
+        if not level.is_free(first) or not level.is_free(second) or first in walls_now or second in walls_now:
+            return True
+        if self.dead[first] and self.dead[second]:
+            return True
+        walls_now = walls_now | {box}
+        for n in (first, second):
+            if n in boxes and self._frozen(n, boxes, walls_now):
+                return True
+        return False
+
+    def _frozen(self, box, boxes, walls_now):
+        return (self._blocked_on_axis(box, 0, boxes, walls_now)
+                and self._blocked_on_axis(box, 1, boxes, walls_now))
+
+    def _frozen_group(self, box, boxes):
+        """Boxes frozen together with box (empty if box can still move)."""
+        if not self._frozen(box, boxes, frozenset()):
+            return set()
+        group = {box}
+        stack = [box]
+        while stack:
+            cell = stack.pop()
+            for n in self.level.neighbours[cell]:
+                if n in boxes and n not in group and self._frozen(n, boxes, frozenset()):
+                    group.add(n)
+                    stack.append(n)
+        return group
+
+    def freeze_deadlock(self, box, boxes):
+        """True if box is frozen together with some box that is not on a goal."""
+        if not self._exact_count(boxes):
+            return False
+        return any(cell not in self.level.goals for cell in self._frozen_group(box, boxes))
+
+    # ---- bipartite ----
+
+    def bipartite_deadlock(self, boxes):
+        """True if the goals cannot all be matched to distinct boxes that can reach them."""
+        boxes = list(boxes)
+        match_box = {}  # box -> goal index
+
+        def augment(g, seen):
+            for box in boxes:
+                if box in seen or self.goal_distance[g][box] == INF:
+                    continue
+                seen.add(box)
+                if box not in match_box or augment(match_box[box], seen):
+                    match_box[box] = g
+                    return True
+            return False
+
+        return not all(augment(g, set()) for g in range(len(self.goals)))
+
+    # ---- corral ----
+
+    def _corrals(self, region, boxes, near=None):
+        """
+        Connected areas of free cells the player cannot reach, with their fence boxes.
+        near restricts the search to areas touching that cell.
+        """
+        level = self.level
+        seen = bytearray(region.visited)
+        starts = range(level.size) if near is None else level.neighbours[near]
+        corrals = []
+        for start in starts:
+            if start < 0 or seen[start] or level.walls[start] or start in boxes:
+                continue
+            seen[start] = 1
+            area = [start]
+            fence = set()
+            i = 0
+            while i < len(area):
+                for n in level.neighbours[area[i]]:
+                    if n < 0 or level.walls[n]:
+                        continue
+                    if n in boxes:
+                        fence.add(n)
+                    elif not seen[n]:
+                        seen[n] = 1
+                        area.append(n)
+                i += 1
+            corrals.append((set(area), fence))
+        return corrals
+
+    def _corral_is_closed(self, player, area, fence):
+        """
+        Search pushes of the fence boxes alone (all other boxes removed, which only
+        makes the problem easier). The corral is a deadlock if no push sequence
+        lets the player into the area or puts every fence box on a goal.
+        """
+        level = self.level
+        goals = level.goals
+        start = frozenset(fence)
+        seen = {(macro_moves.normalized_player(level, player, start), start)}
+        frontier = [(player, start)]
+        nodes = 0
+        while frontier:
+            player, boxes = frontier.pop()
+            if all(box in goals for box in boxes):
+                return False
+            moves, region = macro_moves.push_successors(level, player, boxes, self.dead)
+            if any(region.visited[cell] for cell in area):
+                return False
+            nodes += 1
+            if nodes > self.corral_budget:
+                return False  # unknown: assume it can be solved
+            for move in moves:
+                new_boxes = move.apply(boxes)
+                if any(cell not in goals for cell in self._frozen_group(move.dest, new_boxes)):
+                    continue
+                key = (macro_moves.normalized_player(level, move.box, new_boxes), new_boxes)
+                if key not in seen:
+                    seen.add(key)
+                    frontier.append((move.box, new_boxes))
+        return True
+
+    def corral_deadlock(self, player, boxes, near=None, region=None):
+        """
+        True if some corral cannot be opened. near restricts the check to corrals
+        touching that box (the one just pushed); region is the player's Region
+        if the caller already has it.
+        """
+        if not self._exact_count(boxes):
+            return False
+        if region is None:
+            region = macro_moves.flood_fill(self.level, player, boxes)
+        for area, fence in self._corrals(region, boxes, near):
+            if all(box in self.level.goals for box in fence):
+                continue
+            if self._corral_is_closed(player, area, fence):
+                return True
+        return False
+
+    # ---- entry points ----
+
+    def check_push(self, player, boxes, source, dest, corral=True, region=None):
+        """
+        Incremental check after the box at source was pushed to dest
+        (the state before the push is assumed deadlock-free).
+        Returns the deadlock kind, or None.
+        """
+        exact = self._exact_count(boxes)
+        if exact and self.dead[dest]:
+            return DEAD_SQUARE
+        if self.freeze_deadlock(dest, boxes):
+            return FREEZE
+        # The matching can only break when the pushed box lost a reachable goal
+        if self.goal_mask[dest] & self.goal_mask[source] != self.goal_mask[source] and self.bipartite_deadlock(boxes):
+            return BIPARTITE
+        if corral and self.corral_deadlock(player, boxes, near=dest, region=region):
+            return CORRAL
+        return None
+
+    def find_deadlock(self, player, boxes):
+        """Full check of a state. Returns the deadlock kind, or None."""
+        boxes = frozenset(boxes)
+        exact = self._exact_count(boxes)
+        if exact and any(self.dead[box] for box in boxes):
+            return DEAD_SQUARE
+        if any(self.freeze_deadlock(box, boxes) for box in boxes):
+            return FREEZE
+        if self.bipartite_deadlock(boxes):
+            return BIPARTITE
+        if self.corral_deadlock(player, boxes):
+            return CORRAL
+        return None
+
+
+_detectors = weakref.WeakKeyDictionary()
+
+
+def detector_for(level):
+    """Shared DeadlockDetector of a sokoban_core.Level (built on first use)."""
+    detector = _detectors.get(level)
+    if detector is None:
+        detector = _detectors[level] = DeadlockDetector(level)
+    return detector
+
+
+def is_deadlocked(state):
+    """True if a sokoban_core.SokobanState can no longer be solved (as far as the checks can tell)."""
+    return detector_for(state.level).find_deadlock(state.player, state.boxes) is not None
@@ -0,0 +1,159 @@
+# Append-only binary logs of human play, one per training session.
+#
+# <session>.demo is a sequence of fixed-size records (little-endian, 12 bytes):
+#   level   uint32  session level id (see below)
+#   tick    uint32  milliseconds since the game started (pygame.time.get_ticks)
+#   kind    uint8   START (level shown or reset), MOVE or SOLVED
+#   action  uint8   0 up, 1 down, 2 left, 3 right (MOVE only)
+#   flags   uint8   MOVED | PUSHED (MOVE only; a blocked move has neither)
+#   padding uint8
+# Each record is a single os.write on an O_APPEND descriptor, so a crash can
+# at most cut the last record short, and readers drop a partial tail.
+# <session>.levels has one JSON line per level id the first time it is
+# played: {"id": 0, "name": "1_0.txt", "map": ["####", ...]}.
+#
+# iter_demos() turns logs back into (name, map lines, UDLR actions, solved)
+# attempts: an attempt runs from a START to the next START of the session;
+# blocked moves are dropped, as makeMove used to do. bc_dataset reads the log
+# folder directly, and "export" writes the solved attempts as demo files.
+#
+# Usage: python3 demo_log.py stats
+#        python3 demo_log.py export sokoban_cache/human_training
+
+import argparse
+import json
+import os
+import struct
+import time
+import numpy as np
+
+parent_dir = os.path.dirname(os.path.realpath(__file__))
+LOG_DIR = parent_dir + "/sokoban_cache/demo_logs"
+LOG_SUFFIX = ".demo"
+LEVELS_SUFFIX = ".levels"
+
+RECORD = struct.Struct("<IIBBBx")
+RECORD_DTYPE = np.dtype([("level", "<u4"), ("tick", "<u4"), ("kind", "u1"), ("action", "u1"), ("flags", "u1"),
+                         ("padding", "u1")])
+START, MOVE, SOLVED = range(3)
+MOVED, PUSHED = 1, 2
+ACTIONS = "UDLR"
+
+
+class DemoRecorder:
+    """Writer of one session's log; see the module comment for the format."""
+    def __init__(self, log_dir=LOG_DIR, session=None):
+        os.makedirs(log_dir, exist_ok=True)
+        session = session or time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        self.path = os.path.join(log_dir, session + LOG_SUFFIX)
+        self.levels_path = os.path.join(log_dir, session + LEVELS_SUFFIX)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0)
+        self.fd = os.open(self.path, flags, 0o644)
+        self.levels_fd = os.open(self.levels_path, flags, 0o644)
+        self.known_levels = set()
+        self.level = None
+
+    def start_level(self, level_id, name, map_lines, tick):
+        """A level is shown (again): its later moves belong to a new attempt."""
+        if level_id not in self.known_levels:
+            line = json.dumps({"id": level_id, "name": name, "map": ["".join(row) for row in map_lines]})
+            os.write(self.levels_fd, (line + "\n").encode())
+            self.known_levels.add(level_id)
+        self.level = level_id
+        os.write(self.fd, RECORD.pack(level_id, tick, START, 0, 0))
+
+    def move(self, action, moved, pushed, tick):
+        """action: index in "UDLR"."""
+        flags = (MOVED if moved else 0) | (PUSHED if pushed else 0)
+        os.write(self.fd, RECORD.pack(self.level, tick, MOVE, action, flags))
+
+    def solved(self, tick):
+        os.write(self.fd, RECORD.pack(self.level, tick, SOLVED, 0, 0))
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self.levels_fd)
+
+
+def read_records(path):
+    """Structured numpy array of a log's records (a partial last record is ignored)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    count = len(data) // RECORD.size
+    return np.frombuffer(data, dtype=RECORD_DTYPE, count=count)
+
+
+def read_levels(path):
+    """Level id -> (name, map lines) of a session. A partial last line is ignored."""
+    levels = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if line.endswith(b"\n"):
+                entry = json.loads(line)
+                levels[entry["id"]] = (entry["name"], entry["map"])
+    return levels
+
+
+def log_files(paths):
+    """The .demo logs under paths (files or folders)."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(LOG_SUFFIX):
+                    yield os.path.join(path, name)
+        elif path.endswith(LOG_SUFFIX):
+            yield path
+
+
+def iter_attempts(log_path):
+    """(level id, UDLR actions, solved, duration in ms) for each attempt in one log."""
+    records = read_records(log_path)
+    starts = np.flatnonzero(records["kind"] == START)
+    bounds = list(starts) + [len(records)]
+    for begin, end in zip(bounds, bounds[1:]):
+        attempt = records[begin:end]
+        solved_at = np.flatnonzero(attempt["kind"] == SOLVED)
+        if len(solved_at):
+            attempt = attempt[:solved_at[0] + 1]
+        moves = attempt[(attempt["kind"] == MOVE) & ((attempt["flags"] & MOVED) != 0)]
+        actions = "".join(ACTIONS[a] for a in moves["action"])
+        yield int(attempt["level"][0]), actions, bool(len(solved_at)), int(attempt["tick"][-1] - attempt["tick"][0])
+
+
+def iter_demos(paths, require_solved=True):
+    """(name, map lines, UDLR actions, solved) for every attempt in the logs under paths."""
+    for log_path in log_files(paths):
+        levels = read_levels(log_path[:-len(LOG_SUFFIX)] + LEVELS_SUFFIX)
+        for level_id, actions, solved, _ in iter_attempts(log_path):
+            if level_id not in levels or (require_solved and not solved):
+                continue
+            name, map_lines = levels[level_id]
+            yield name, map_lines, actions, solved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or export the human play logs.")
+    parser.add_argument("command", choices=("stats", "export"))
+    parser.add_argument("out_dir", nargs="?", help="export: folder for the demo files")
+    parser.add_argument("--logs", nargs="*", default=[LOG_DIR], help="log files or folders")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        sessions = attempts = solved = moves = 0
+        for log_path in log_files(args.logs):
+            sessions += 1
+            for _, actions, is_solved, _ in iter_attempts(log_path):
+                attempts += 1
+                solved += int(is_solved)
+                moves += len(actions)
+        print(f"{sessions} sessions, {attempts} attempts ({solved} solved), {moves} moves")
+    else:
+        if args.out_dir is None:
+            raise SystemExit("export needs an output folder")
+        import prepare_dataset
+        os.makedirs(args.out_dir, exist_ok=True)
+        count = 0
+        for name, map_lines, actions, _ in iter_demos(args.logs):
+            prepare_dataset.export_to_txt_file(os.path.join(args.out_dir, name), map_lines, actions)
+            count += 1
+        print(f"Exported {count} solved attempts to {args.out_dir}")
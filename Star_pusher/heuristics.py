@@ -0,0 +1,160 @@
+# Lower bounds on the number of pushes left, for the solvers and reward shaping.
+#
+# "matching": minimum-cost assignment of boxes to goals (Hungarian algorithm)
+#             over the wall-aware push distances of deadlock.DeadlockDetector.
+#             A push only changes one box's column of the cost matrix, so
+#             after_push repairs the previous assignment with a single
+#             augmenting path (O(n^2)) instead of solving again (O(n^3)).
+# "greedy":   every box to its nearest goal, ignoring conflicts (cheaper, looser).
+#
+# Both are admissible: they never exceed the real number of pushes.
+
+import weakref
+import deadlock
+
+HEURISTICS = ("matching", "greedy")
+INF = float("inf")
+BIG = 10 ** 6  # cost of an unreachable goal inside the assignment
+
+
+class Assignment:
+    """
+    Goal/box assignment with its dual potentials. Rows are goals, columns are
+    boxes (in the order of `boxes`); value is the total push distance, INF if
+    some goal cannot be reached.
+    """
+    __slots__ = ("boxes", "u", "v", "row_of_col", "value")
+
+    def __init__(self, boxes, u, v, row_of_col, value):
+        self.boxes = boxes
+        self.u = u
+        self.v = v
+        self.row_of_col = row_of_col
+        self.value = value
+
+
+class MatchingHeuristic:
+    """
+    Minimum-matching lower bound for one level. distances optionally replaces
+    the push distances to the goals with other per-target distance tables
+    (e.g. pull distances back to the start boxes, for backward search).
+    """
+    def __init__(self, level, distances=None):
+        if distances is None:
+            detector = deadlock.detector_for(level)
+            distances = detector.goal_distance
+        self.goals = list(range(len(distances)))
+        # cost[g][cell], with unreachable goals at BIG
+        self.cost = [[BIG if d == INF else d for d in dist] for dist in distances]
+        self.min_distance = [min((dist[cell] for dist in distances), default=0) for cell in range(level.size)]
+
+    def _augment(self, row, boxes, u, v, row_of_col):
+        """
+        Assign goal `row` with one shortest augmenting path (1-indexed
+        columns, column 0 is the virtual start, as in the classic O(n^3) form).
+        """
+        cost = self.cost
+        m = len(boxes)
+        row_of_col[0] = row
+        col = 0
+        min_slack = [INF] * (m + 1)
+        used = [False] * (m + 1)
+        way = [0] * (m + 1)
+        while True:
+            used[col] = True
+            r = row_of_col[col]
+            costs = cost[r - 1]
+            delta = INF
+            next_col = 0
+            for j in range(1, m + 1):
+                if used[j]:
+                    continue
+                slack = costs[boxes[j - 1]] - u[r] - v[j]
+                if slack < min_slack[j]:
+                    min_slack[j] = slack
+                    way[j] = col
+                if min_slack[j] < delta:
+                    delta = min_slack[j]
+                    next_col = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[row_of_col[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_slack[j] -= delta
+            col = next_col
+            if row_of_col[col] == 0:
+                break
+        while col:
+            prev = way[col]
+            row_of_col[col] = row_of_col[prev]
+            col = prev
+
+    def _value(self, boxes, row_of_col):
+        total = 0
+        for j in range(1, len(boxes) + 1):
+            r = row_of_col[j]
+            if r:
+                total += self.cost[r - 1][boxes[j - 1]]
+        return INF if total >= BIG else total
+
+    def initial(self, boxes):
+        """Solve the assignment from scratch. Returns an Assignment."""
+        boxes = list(boxes)
+        n = len(self.goals)
+        if len(boxes) < n:
+            return Assignment(boxes, None, None, None, INF)
+        u = [0] * (n + 1)
+        v = [0] * (len(boxes) + 1)
+        row_of_col = [0] * (len(boxes) + 1)
+        for row in range(1, n + 1):
+            self._augment(row, boxes, u, v, row_of_col)
+        return Assignment(boxes, u, v, row_of_col, self._value(boxes, row_of_col))
+
+    def after_push(self, assignment, source, dest):
+        """
+        Assignment after the box at source was pushed to dest. Only that box's
+        column changes: it is unassigned, its potential is lowered until every
+        edge is feasible again and its goal is re-assigned along one augmenting path.
+        """
+        if assignment.u is None or len(assignment.boxes) != len(self.goals):
+            # Spare boxes: unmatched columns must keep a zero potential, so solve again
+            return self.initial([dest if box == source else box for box in assignment.boxes])
+
+        boxes = list(assignment.boxes)
+        col = boxes.index(source) + 1
+        boxes[col - 1] = dest
+        u = list(assignment.u)
+        v = list(assignment.v)
+        row_of_col = list(assignment.row_of_col)
+
+        row = row_of_col[col]
+        row_of_col[col] = 0
+        v[col] = min(self.cost[r - 1][dest] - u[r] for r in range(1, len(self.goals) + 1))
+        if row:
+            self._augment(row, boxes, u, v, row_of_col)
+        return Assignment(boxes, u, v, row_of_col, self._value(boxes, row_of_col))
+
+    def greedy(self, boxes):
+        """Sum of the distances of every box to its nearest goal."""
+        if len(boxes) == len(self.goals):
+            return sum(self.min_distance[box] for box in boxes)
+        # More boxes than goals: every goal still needs its nearest box
+        total = sum(min(self.cost[g][box] for box in boxes) for g in range(len(self.goals)))
+        return INF if total >= BIG else total
+
+
+_heuristics = weakref.WeakKeyDictionary()
+
+
+def heuristic_for(level):
+    """Shared MatchingHeuristic of a sokoban_core.Level (built on first use)."""
+    heuristic = _heuristics.get(level)
+    if heuristic is None:
+        heuristic = _heuristics[level] = MatchingHeuristic(level)
+    return heuristic
+
+
+def matching_lower_bound(state):
+    """Minimum-matching push lower bound of a sokoban_core.SokobanState."""
+    return heuristic_for(state.level).initial(state.boxes).value
@@ -0,0 +1,139 @@
+# On-disk cache of parsed levels, and a list that parses in the background.
+#
+# load(paths) returns what store(paths, data) saved, as long as none of the
+# source files changed since: each entry records the (mtime, size) of its
+# sources and is one pickle under sokoban_cache/parsed_levels, named after a
+# hash of the source paths. Any mismatch or unreadable entry is a miss.
+#
+# Prefetcher builds the items of a list in a daemon thread, in order, after
+# building the first one right away. Indexing waits only until that item is
+# ready, so starpusher can show its first level while the rest are parsed.
+#
+# Usage: python3 level_cache.py [--clear]
+
+import argparse
+import gc
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+parent_dir = os.path.dirname(os.path.realpath(__file__))
+CACHE_DIR = parent_dir + "/sokoban_cache/parsed_levels"
+VERSION = 1
+
+
+def stamps(paths):
+    """(path, mtime_ns, size) of every source file."""
+    result = []
+    for path in paths:
+        stat = os.stat(path)
+        result.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+    return result
+
+
+def cache_file(paths, cache_dir=CACHE_DIR):
+    key = "\n".join(sorted(os.path.abspath(path) for path in paths))
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".pickle")
+
+
+def load(paths, cache_dir=CACHE_DIR):
+    """The data stored for these source files, or None if there is none or a file changed."""
+    try:
+        with open(cache_file(paths, cache_dir), "rb") as f:
+            # Unpickling creates many small objects; with torch loaded, the
+            # garbage collector passes they trigger cost far more than the load
+            gc.disable()
+            try:
+                entry = pickle.load(f)
+            finally:
+                gc.enable()
+        if entry["version"] == VERSION and entry["stamps"] == stamps(paths):
+            return entry["data"]
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        pass
+    return None
+
+
+def store(paths, data, cache_dir=CACHE_DIR):
+    """Save data (plain picklable values) for these source files."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_file(paths, cache_dir)
+    entry = {"version": VERSION, "stamps": stamps(paths), "data": data}
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)  # readers never see a partial file
+
+
+class Prefetcher:
+    """
+    Read-only list of build(source) for each source. The first item is built
+    in the constructor, the others by a background thread; on_done(items) is
+    called from that thread once all of them are built.
+    """
+    def __init__(self, sources, build, on_done=None):
+        self.sources = list(sources)
+        self.build = build
+        self.on_done = on_done
+        self.items = [None] * len(self.sources)
+        self.ready = 0  # items[:ready] are built
+        self.error = None
+        self.condition = threading.Condition()
+        if self.sources:
+            self.items[0] = build(self.sources[0])
+            self.ready = 1
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            for i in range(self.ready, len(self.sources)):
+                item = self.build(self.sources[i])
+                with self.condition:
+                    self.items[i] = item
+                    self.ready = i + 1
+                    self.condition.notify_all()
+                time.sleep(0)  # let the game thread run between items
+            if self.on_done is not None:
+                self.on_done(self.items)
+        except Exception as e:
+            with self.condition:
+                self.error = e
+                self.condition.notify_all()
+            raise
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.sources)
+        if not 0 <= index < len(self.sources):
+            raise IndexError("Prefetcher index out of range")
+        with self.condition:
+            while self.ready <= index:
+                if self.error is not None:
+                    raise self.error
+                self.condition.wait()
+        return self.items[index]
+
+    def __iter__(self):
+        for i in range(len(self.sources)):
+            yield self[i]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or clear the parsed-level cache.")
+    parser.add_argument("--clear", action="store_true", help="delete every cache entry")
+    args = parser.parse_args()
+
+    entries = sorted(os.listdir(CACHE_DIR)) if os.path.isdir(CACHE_DIR) else []
+    entries = [name for name in entries if name.endswith(".pickle")]
+    size = sum(os.path.getsize(os.path.join(CACHE_DIR, name)) for name in entries)
+    print(f"{len(entries)} entries, {size / 1024:.1f} KiB in {CACHE_DIR}")
+    if args.clear:
+        for name in entries:
+            os.remove(os.path.join(CACHE_DIR, name))
+        print("Cleared")
@@ -0,0 +1,261 @@
+# Push-level macro moves over the single-step Sokoban environments.
+#
+# The player's reachable region is computed with an iterative breadth-first
+# flood fill (no recursion, so large open rooms are fine), and only legal box
+# pushes are emitted as successors. Each successor carries the walk that
+# brings the player behind the box, so a sequence of macro moves expands back
+# into the primitive actions of either environment:
+#   Star_pusher SokobanEnv: 0 up, 1 down, 2 left, 3 right
+#   gym_sokoban SokobanEnv:  1-4 push up/down/left/right (they also walk)
+#
+# Levels and states are sokoban_core objects; from_room_state and
+# from_numeric_map convert the two environments' room_state grids.
+
+import numpy as np
+import sokoban_core
+
+OPPOSITE = [1, 0, 3, 2]  # U<->D, L<->R
+NO_PARENT = 255
+
+# gym_sokoban room_state codes
+GYM_WALL, GYM_EMPTY, GYM_TARGET, GYM_BOX_ON_TARGET, GYM_BOX, GYM_PLAYER = range(6)
+
+
+class Region:
+    """Cells reachable by the player without pushing, with BFS parents for shortest walks."""
+    __slots__ = ("level", "start", "visited", "came_from", "smallest")
+
+    def __init__(self, level, start, visited, came_from, smallest):
+        self.level = level
+        self.start = start
+        self.visited = visited
+        self.came_from = came_from  # action taken to enter each cell, NO_PARENT for the start
+        self.smallest = smallest    # normalized player cell
+
+    def __contains__(self, cell):
+        return cell >= 0 and self.visited[cell] == 1
+
+    def cells(self):
+        return [cell for cell in range(self.level.size) if self.visited[cell]]
+
+    def path_to(self, cell):
+        """Shortest UDLR walk from the start to cell, or None if cell is not reachable."""
+        if cell not in self:
+            return None
+        neighbours = self.level.neighbours
+        moves = []
+        while cell != self.start:
+            action = self.came_from[cell]
+            moves.append(sokoban_core.ACTIONS[action])
+            cell = neighbours[cell][OPPOSITE[action]]
+        return "".join(reversed(moves))
+
+
+def flood_fill(level, start, boxes):
+    """Iterative BFS from start over free cells that hold no box. Returns a Region."""
+    neighbours = level.neighbours
+    walls = level.walls
+    visited = bytearray(level.size)
+    came_from = bytearray(b"\xff" * level.size)
+    visited[start] = 1
+    queue = [start]
+    smallest = start
+    head = 0
+    while head < len(queue):
+        cell = queue[head]
+        head += 1
+        for action, n in enumerate(neighbours[cell]):
+            if n >= 0 and not visited[n] and not walls[n] and n not in boxes:
+                visited[n] = 1
+                came_from[n] = action
+                queue.append(n)
+                if n < smallest:
+                    smallest = n
+    return Region(level, start, visited, came_from, smallest)
+
+
+def normalized_player(level, player, boxes):
+    """Smallest cell of the player's region; two states with the same boxes and value are equivalent."""
+    neighbours = level.neighbours
+    walls = level.walls
+    visited = bytearray(level.size)
+    visited[player] = 1
+    stack = [player]
+    smallest = player
+    while stack:
+        cell = stack.pop()
+        for n in neighbours[cell]:
+            if n >= 0 and not visited[n] and not walls[n] and n not in boxes:
+                visited[n] = 1
+                stack.append(n)
+                if n < smallest:
+                    smallest = n
+    return smallest
+
+
+class PushMove:
+    """One box push plus the walk leading to it."""
+    __slots__ = ("box", "action", "dest", "region")
+
+    def __init__(self, box, action, dest, region):
+        self.box = box
+        self.action = action
+        self.dest = dest
+        self.region = region
+
+    @property
+    def behind(self):
+        """Cell the player pushes from."""
+        return self.region.level.neighbours[self.box][OPPOSITE[self.action]]
+
+    @property
+    def walk(self):
+        return self.region.path_to(self.behind)
+
+    def primitive_actions(self):
+        """UDLR string: the walk followed by the push."""
+        return self.walk + sokoban_core.ACTIONS[self.action]
+
+    def apply(self, boxes):
+        """New frozenset of boxes after the push (the player ends on the old box cell)."""
+        return boxes - {self.box} | {self.dest}
+
+    def __repr__(self):
+        return f"PushMove(box={self.box}, action={sokoban_core.ACTIONS[self.action]}, dest={self.dest})"
+
+
+def push_successors(level, player, boxes, dead=None):
+    """
+    All legal pushes from (player, boxes). dead is an optional bytearray of
+    cells a box must never be pushed to. Returns (list of PushMove, Region).
+    """
+    region = flood_fill(level, player, boxes)
+    visited = region.visited
+    neighbours = level.neighbours
+    walls = level.walls
+    moves = []
+    for box in boxes:
+        box_neighbours = neighbours[box]
+        for action in range(4):
+            behind = box_neighbours[OPPOSITE[action]]
+            if behind < 0 or not visited[behind]:
+                continue
+            dest = box_neighbours[action]
+            if dest < 0 or walls[dest] or dest in boxes:
+                continue
+            if dead is not None and dead[dest]:
+                continue
+            moves.append(PushMove(box, action, dest, region))
+    return moves, region
+
+
+class PullMove:
+    """One box pull (the reverse of a push): the player steps away from the box and drags it along."""
+    __slots__ = ("box", "action", "dest", "region")
+
+    def __init__(self, box, action, dest, region):
+        self.box = box        # cell of the box before the pull
+        self.action = action  # direction the box and player move
+        self.dest = dest      # cell of the box after the pull (where the player stood)
+        self.region = region
+
+    @property
+    def player_after(self):
+        return self.region.level.neighbours[self.dest][self.action]
+
+    def apply(self, boxes):
+        return boxes - {self.box} | {self.dest}
+
+    def as_push(self):
+        """The forward (box, action) push that undoes this pull."""
+        return self.dest, OPPOSITE[self.action]
+
+    def __repr__(self):
+        return f"PullMove(box={self.box}, action={sokoban_core.ACTIONS[self.action]}, dest={self.dest})"
+
+
+def pull_successors(level, player, boxes):
+    """All legal pulls from (player, boxes), for backward search. Returns (list of PullMove, Region)."""
+    region = flood_fill(level, player, boxes)
+    visited = region.visited
+    neighbours = level.neighbours
+    walls = level.walls
+    moves = []
+    for box in boxes:
+        for action in range(4):
+            # The player stands next to the box on the side of `action` and steps further that way
+            dest = neighbours[box][action]
+            if dest < 0 or not visited[dest]:
+                continue
+            step = neighbours[dest][action]
+            if step < 0 or walls[step] or step in boxes:
+                continue
+            moves.append(PullMove(box, action, dest, region))
+    return moves, region
+
+
+def expand(level, player, boxes, pushes):
+    """
+    Expand a sequence of (box, action) pushes from (player, boxes) into a UDLR string.
+    Raises ValueError if a push is not possible.
+    """
+    boxes = set(boxes)
+    plan = []
+    for box, action in pushes:
+        behind = level.neighbours[box][OPPOSITE[action]]
+        walk = flood_fill(level, player, boxes).path_to(behind)
+        dest = level.neighbours[box][action]
+        if walk is None or box not in boxes or not level.is_free(dest) or dest in boxes:
+            raise ValueError(f"Push {sokoban_core.ACTIONS[action]} of box {level.position(box)} is not possible.")
+        plan.append(walk + sokoban_core.ACTIONS[action])
+        boxes.remove(box)
+        boxes.add(dest)
+        player = box
+    return "".join(plan)
+
+
+# ---- environment adapters ----
+
+def from_room_state(room_state, room_fixed=None):
+    """
+    (Level, SokobanState) from a gym_sokoban room_state. room_fixed
+    (0 wall, 1 empty, 2 target) recovers a target hidden under the player.
+    """
+    room_state = np.asarray(room_state).astype(int)
+    height, width = room_state.shape
+    flat = room_state.reshape(-1)
+    walls = np.flatnonzero(flat == GYM_WALL).tolist()
+    boxes = np.flatnonzero((flat == GYM_BOX) | (flat == GYM_BOX_ON_TARGET)).tolist()
+    goals = set(np.flatnonzero((flat == GYM_TARGET) | (flat == GYM_BOX_ON_TARGET)).tolist())
+    if room_fixed is not None:
+        goals |= set(np.flatnonzero(np.asarray(room_fixed).reshape(-1) == 2).tolist())
+    players = np.flatnonzero(flat == GYM_PLAYER)
+    if len(players) == 0:
+        raise ValueError("room_state has no player.")
+    level = sokoban_core.Level(height, width, walls, goals)
+    return level, sokoban_core.SokobanState(level, int(players[0]), boxes)
+
+
+def from_numeric_map(num_map, goals=None):
+    """(Level, SokobanState) from a Star_pusher SokobanEnv room_state or a convert_to_ai_map grid."""
+    return sokoban_core.parse_numeric(num_map, goals)
+
+
+def to_env_actions(plan):
+    """UDLR string -> Star_pusher SokobanEnv action indices."""
+    return [sokoban_core.ACTION_INDEX[char] for char in plan]
+
+
+def to_gym_actions(plan):
+    """
+    UDLR string -> gym_sokoban action ids. Uses the push actions 1-4 throughout:
+    they walk when nothing is in the way, while the move actions never push.
+    """
+    return [sokoban_core.ACTION_INDEX[char] + 1 for char in plan]
+
+
+def gym_push_successors(env):
+    """Push successors of a live gym_sokoban env, including walks."""
+    level, state = from_room_state(env.room_state, env.room_fixed)
+    moves, _ = push_successors(level, state.player, frozenset(state.boxes))
+    return moves
@@ -0,0 +1,362 @@
+# Batched MCTS over primitive moves, guided by the PPO policy/value network.
+#
+# The tree runs on sokoban_core states (Star_pusher rules; gym_sokoban rooms
+# go through macro_moves.from_room_state and plans back through
+# macro_moves.to_gym_actions). Selection is PUCT:
+#   Q(s, a) + c_puct * P(s, a) * sqrt(N(s)) / (1 + N(s, a))
+# with P the policy's action probabilities (blocked moves removed) and Q the
+# mean backed-up value. Leaves are valued 1 when solved, -1 when deadlocked
+# (dead square or freeze, see deadlock) and tanh(V / value_scale) otherwise.
+#
+# Several threads run simulations at once. A simulation adds a virtual loss
+# to the path it selects so the others spread over different leaves, and
+# leaf evaluations from all threads are gathered into one network call by
+# BatchedEvaluator. advance() keeps the subtree of the move played, so a live
+# game reuses the previous search.
+#
+# stats() reports simulations/sec and batch occupancy (mean batch size over
+# batch_size) for tuning threads / batch_size on CPU-only hosts.
+# --repeat N searches each level N more times from scratch and checks every
+# prior in the tree against a single-threaded evaluation (a race between the
+# search threads shows up as wrong priors or a crash).
+#
+# Usage: python3 mcts.py models/sokoban_final_curriculum.zip sokoban_cache/boxoban-levels-master/hard/000.txt --limit 5
+#        python3 mcts.py models/sokoban_final_curriculum.zip sokoban_cache/boxoban-levels-master/hard/000.txt --limit 2 --repeat 10
+
+import argparse
+import math
+import os
+import threading
+import time
+import numpy as np
+import deadlock
+import sokoban_core
+import policy_search
+
+DEFAULT_SIMULATIONS = 400
+DEFAULT_THREADS = 16
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_C_PUCT = 1.5
+DEFAULT_VIRTUAL_LOSS = 1
+DEFAULT_VALUE_SCALE = 10.0
+
+
+class BatchedEvaluator:
+    """
+    Thread-safe front of a policy_search.PolicyEvaluator. Requests wait until
+    batch_size of them are pending, or at most timeout seconds, and are then
+    evaluated together.
+    """
+    def __init__(self, evaluator, batch_size=DEFAULT_BATCH_SIZE, timeout=0.002):
+        self.evaluator = evaluator
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pending = []
+        self.batches = 0
+        self.evaluated = 0
+
+    def __call__(self, observation):
+        """(action probabilities, value) of one observation."""
+        request = [observation, threading.Event(), None]
+        batch = None
+        with self.lock:
+            self.pending.append(request)
+            if len(self.pending) >= self.batch_size:
+                batch, self.pending = self.pending, []
+        if batch is None and not request[1].wait(self.timeout):
+            # Not enough company: flush whatever is pending (unless another thread just did)
+            with self.lock:
+                if any(pending is request for pending in self.pending):
+                    batch, self.pending = self.pending, []
+        if batch is not None:
+            self._run(batch)
+        request[1].wait()
+        if isinstance(request[2], Exception):
+            raise request[2]
+        return request[2]
+
+    def _run(self, batch):
+        try:
+            probs, values = self.evaluator.evaluate([request[0] for request in batch])
+        except Exception as e:
+            # Wake the other threads of the batch with the error instead of leaving them waiting
+            for request in batch:
+                request[2] = e
+                request[1].set()
+            raise
+        with self.lock:
+            self.batches += 1
+            self.evaluated += len(batch)
+        for request, p, v in zip(batch, probs, values):
+            request[2] = (p, float(v))
+            request[1].set()
+
+
+class Node:
+    __slots__ = ("player", "boxes", "solved", "prior", "visits", "value_sum", "children", "expanded",
+                 "terminal_value")
+
+    def __init__(self, player, boxes, solved, prior):
+        self.player = player
+        self.boxes = boxes
+        self.solved = solved
+        self.prior = prior
+        self.visits = 0
+        self.value_sum = 0.0
+        self.children = None  # action -> Node, once evaluated
+        self.expanded = False
+        self.terminal_value = 1.0 if solved else None
+
+    def q(self):
+        return self.value_sum / self.visits if self.visits else 0.0
+
+
+class MCTSPlanner:
+    """MCTS over one level; reuse it for the successive moves of a game."""
+    def __init__(self, level, evaluator, simulations=DEFAULT_SIMULATIONS, threads=DEFAULT_THREADS,
+                 batch_size=DEFAULT_BATCH_SIZE, c_puct=DEFAULT_C_PUCT, virtual_loss=DEFAULT_VIRTUAL_LOSS,
+                 value_scale=DEFAULT_VALUE_SCALE):
+        if not evaluator.fits((level.height, level.width)):
+            raise ValueError(f"The policy cannot read a {level.height}x{level.width} map "
+                             f"(its buckets are {evaluator.batcher.buckets})")
+        self.level = level
+        self.evaluator = BatchedEvaluator(evaluator, min(batch_size, threads))
+        self.simulations = simulations
+        self.threads = threads
+        self.c_puct = c_puct
+        self.virtual_loss = virtual_loss
+        self.value_scale = value_scale
+        self.deadlocks = deadlock.detector_for(level)
+        self.lock = threading.Lock()
+        self.root = None
+        self.total_simulations = 0
+        self.search_time = 0.0
+        self.reused = 0
+
+    # ---- tree ----
+
+    def _child(self, node, action, prior):
+        state = sokoban_core.SokobanState(self.level, node.player, node.boxes)
+        source = state.level.neighbours[node.player][action]
+        moved, pushed = state.step(action)
+        if not moved:
+            return None
+        child = Node(state.player, frozenset(state.boxes), state.is_solved(), prior)
+        if pushed and not child.solved:
+            dest = self.level.neighbours[source][action]
+            if self.deadlocks.check_push(state.player, child.boxes, source, dest, corral=False) is not None:
+                child.terminal_value = -1.0
+        return child
+
+    def _select(self, node):
+        sqrt_visits = math.sqrt(max(node.visits, 1))
+        best, best_score = None, -math.inf
+        for child in node.children.values():
+            score = child.q() + self.c_puct * child.prior * sqrt_visits / (1 + child.visits)
+            if score > best_score:
+                best, best_score = child, score
+        return best
+
+    def _simulate(self):
+        # Selection, with a virtual loss on the path so concurrent simulations diverge
+        with self.lock:
+            node = self.root
+            path = [node]
+            while node.expanded and node.children and node.terminal_value is None:
+                node = self._select(node)
+                path.append(node)
+            for n in path:
+                n.visits += self.virtual_loss
+                n.value_sum -= self.virtual_loss
+            leaf_value = node.terminal_value
+            needs_eval = leaf_value is None and not node.expanded
+            if needs_eval:
+                node.expanded = True  # claimed: no other thread evaluates it
+        if leaf_value is None and not needs_eval:
+            # Another thread is still evaluating this leaf: take the virtual loss back and retry later
+            with self.lock:
+                for n in path:
+                    n.visits -= self.virtual_loss
+                    n.value_sum += self.virtual_loss
+            return False
+
+        children = None
+        if needs_eval:
+            observation = sokoban_core.SokobanState(self.level, node.player, node.boxes).observation()
+            probs, value = self.evaluator(observation)
+            leaf_value = math.tanh(value / self.value_scale)
+            children = {}
+            for action in range(4):
+                child = self._child(node, action, float(probs[action]))
+                if child is not None:
+                    children[action] = child
+            total = sum(child.prior for child in children.values()) or 1.0
+            for child in children.values():
+                child.prior /= total
+            if not children:
+                leaf_value = -1.0
+
+        with self.lock:
+            if children is not None:
+                node.children = children
+                if not children:
+                    node.terminal_value = -1.0
+            for n in path:
+                n.visits += 1 - self.virtual_loss
+                n.value_sum += leaf_value + self.virtual_loss
+        return True
+
+    def _worker(self, count, errors):
+        done = 0
+        try:
+            while done < count and not errors:
+                if self._simulate():
+                    done += 1
+                else:
+                    time.sleep(0)
+        except Exception as e:
+            errors.append(e)
+
+    # ---- public ----
+
+    def set_state(self, state):
+        """Make state the root, keeping the current tree if state is the root or one of its children."""
+        boxes = frozenset(state.boxes)
+        if self.root is not None:
+            if (self.root.player, self.root.boxes) == (state.player, boxes):
+                return
+            for child in (self.root.children or {}).values():
+                if (child.player, child.boxes) == (state.player, boxes):
+                    self.root = child
+                    self.reused += 1
+                    return
+        self.root = Node(state.player, boxes, state.is_solved(), 1.0)
+
+    def search(self, state=None, simulations=None):
+        """Run simulations from state (or the current root). Returns {action: visits} of the root."""
+        if state is not None:
+            self.set_state(state)
+        simulations = simulations or self.simulations
+        start = time.perf_counter()
+        share, extra = divmod(simulations, self.threads)
+        errors = []
+        workers = [threading.Thread(target=self._worker, args=(share + (i < extra), errors), daemon=True)
+                   for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise errors[0]
+        self.search_time += time.perf_counter() - start
+        self.total_simulations += simulations
+        return {action: child.visits for action, child in (self.root.children or {}).items()}
+
+    def best_action(self):
+        """Most visited root action (UDLR index), or None if the root has no moves."""
+        if not self.root.children:
+            return None
+        return max(self.root.children.items(), key=lambda item: (item[1].visits, item[1].q()))[0]
+
+    def advance(self, action):
+        """Play action: its child becomes the root and keeps its statistics."""
+        child = (self.root.children or {}).get(action)
+        if child is None:
+            state = sokoban_core.SokobanState(self.level, self.root.player, self.root.boxes)
+            state.step(action)
+            child = Node(state.player, frozenset(state.boxes), state.is_solved(), 1.0)
+        else:
+            self.reused += 1
+        self.root = child
+
+    def play(self, state, max_moves=300):
+        """Search and move until solved, stuck or max_moves. Returns the UDLR string played."""
+        self.set_state(state)
+        moves = []
+        while not self.root.solved and len(moves) < max_moves:
+            self.search()
+            action = self.best_action()
+            if action is None or self.root.terminal_value == -1.0:
+                break
+            moves.append(sokoban_core.ACTIONS[action])
+            self.advance(action)
+        return "".join(moves)
+
+    def check_priors(self, evaluator):
+        """
+        Number of expanded nodes whose child priors differ from a fresh
+        single-threaded evaluation of the node by evaluator.
+        """
+        nodes, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            if node.children:
+                nodes.append(node)
+                stack.extend(node.children.values())
+        if not nodes:
+            return 0
+        observations = [sokoban_core.SokobanState(self.level, node.player, node.boxes).observation() for node in nodes]
+        probs, _ = evaluator.evaluate(observations)
+        wrong = 0
+        for node, p in zip(nodes, probs):
+            actions = list(node.children)
+            expected = p[actions] / (p[actions].sum() or 1.0)
+            wrong += not np.allclose([node.children[a].prior for a in actions], expected, atol=1e-4)
+        return wrong
+
+    def stats(self):
+        evaluator = self.evaluator
+        return {
+            "simulations": self.total_simulations,
+            "simulations_per_second": self.total_simulations / max(self.search_time, 1e-9),
+            "batches": evaluator.batches,
+            "mean_batch": evaluator.evaluated / max(evaluator.batches, 1),
+            "batch_occupancy": evaluator.evaluated / max(evaluator.batches * evaluator.batch_size, 1),
+            "reused_subtrees": self.reused,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play Boxoban levels with batched MCTS.")
+    parser.add_argument("model_path")
+    parser.add_argument("level_file")
+    parser.add_argument("--quantize", choices=("dynamic", "static"), default=None)
+    parser.add_argument("--simulations", type=int, default=DEFAULT_SIMULATIONS, help="simulations per move")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--c-puct", type=float, default=DEFAULT_C_PUCT)
+    parser.add_argument("--max-moves", type=int, default=300)
+    parser.add_argument("--limit", type=int, default=None, help="only play the first N levels")
+    parser.add_argument("--repeat", type=int, default=0,
+                        help="also search each level this many times from scratch and check the priors")
+    args = parser.parse_args()
+
+    for path in (args.model_path, args.level_file):
+        if not os.path.exists(path):
+            raise SystemExit(f"The file {path} does not exist.")
+    evaluator = policy_search.PolicyEvaluator.from_path(args.model_path, args.quantize)
+
+    solved = 0
+    levels = sokoban_core.read_level_file(args.level_file)[:args.limit]
+    for i, map_lines in enumerate(levels):
+        level, state = sokoban_core.parse_ascii(map_lines)
+        planner = MCTSPlanner(level, evaluator, args.simulations, args.threads, args.batch_size, args.c_puct)
+        start = time.time()
+        moves = planner.play(state, args.max_moves)
+        check = state.copy()
+        sokoban_core.replay(check, moves)
+        solved += int(check.is_solved())
+        stats = planner.stats()
+        print(f"level {i:4d}: {'solved' if check.is_solved() else 'failed':7s} moves={len(moves):4d} "
+              f"time={time.time() - start:6.1f}s sims/s={stats['simulations_per_second']:7.0f} "
+              f"batch={stats['mean_batch']:5.1f} ({stats['batch_occupancy']:.0%})")
+        for repeat in range(args.repeat):
+            planner = MCTSPlanner(level, evaluator, args.simulations, args.threads, args.batch_size, args.c_puct)
+            planner.search(state)
+            wrong = planner.check_priors(evaluator)
+            assert wrong == 0, f"level {i}, repeat {repeat}: {wrong} nodes with the priors of another batch"
+        if args.repeat:
+            print(f"level {i:4d}: {args.repeat} searches with {args.threads} threads, priors checked")
+    print("=" * 50)
+    print(f"Solved {solved}/{len(levels)} levels")
@@ -17,6 +17,9 @@ from stable_baselines3.common.callbacks import BaseCallback
 from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
 import copy
 import time
+import deadlock
+import heuristics
+import sokoban_core
 
 # Create directories
 os.makedirs("logs", exist_ok=True)
@@ -1127,12 +1130,21 @@ class SokobanEnv(gym.Env):
     """Enhanced Sokoban environment with improved rewards and curriculum learning."""
     metadata = {"render_modes": ["rgb_array"], "render_fps": 10}
 
-    def __init__(self, maps_type='train', render_mode="rgb_array", difficulty='curriculum'):
+    def __init__(self, maps_type='train', render_mode="rgb_array", difficulty='curriculum', terminate_on_deadlock=False,
+                 distance_reward='manhattan'):
         super().__init__()
         self.maps = create_maps()[maps_type]
         self.render_mode = render_mode
         self.difficulty = difficulty  # Store the difficulty parameter
 
+        # End the episode as soon as a push makes the level unsolvable (see deadlock.py)
+        self.terminate_on_deadlock = terminate_on_deadlock
+        # Distance used for reward shaping: 'manhattan' (nearest target) or
+        # 'matching' (minimum box-target assignment over push distances, see heuristics.py)
+        self.distance_reward = distance_reward
+        self._levels = {}
+        self._assignment = None
+
         # Curriculum learning parameters
         self.curriculum_phases = 5  # 0=very_easy, 1=easy, 2=easy_medium, 3=medium, 4=hard
         self.curriculum_phase = 0
@@ -1257,6 +1269,10 @@ class SokobanEnv(gym.Env):
 
     def _calculate_distances(self):
         """Calculate the sum of Manhattan distances from each box to its nearest target."""
+        if self.distance_reward == 'matching':
+            distance = self._matching_distance()
+            return 0 if distance == heuristics.INF else distance
+
         total_distances = 0
 
         # For each box, find the Manhattan distance to the closest target
@@ -1489,7 +1505,12 @@ class SokobanEnv(gym.Env):
 
         # 2. Distance-based reward shaping
         if box_moved:
-            current_distances = self._calculate_distances()
+            if self.distance_reward == 'matching':
+                # A deadlocked box has no finite distance: give no shaping signal for it
+                distance = self._matching_distance(box_pos, box_new_pos)
+                current_distances = self.prev_distances if distance == heuristics.INF else distance
+            else:
+                current_distances = self._calculate_distances()
             distance_improvement = self.prev_distances - current_distances
             self.prev_distances = current_distances
 
@@ -1579,12 +1600,6 @@ class SokobanEnv(gym.Env):
                 if is_corner and box_pos not in self.target_positions:
                     reward -= 0.4  # Reduced penalty for pushing box into corner (from 0.5)
 
-        # Check win condition
-        if self.boxes_on_target == len(self.box_positions):
-            reward = 10.0
-            terminated = True
-            self.success_buffer.append(1)  # Record success for curriculum
-
         # Max steps - adaptive based on curriculum phase
         max_steps = 100
         if self.curriculum_phase in [2, 3]:  # easy-medium or medium
@@ -1592,9 +1607,27 @@ class SokobanEnv(gym.Env):
         elif self.curriculum_phase == 4:  # hard
             max_steps = 200
 
+        # 6. Optional early termination on deadlock
+        deadlock_kind = None
+        if box_moved and self.terminate_on_deadlock and self.boxes_on_target < len(self.box_positions):
+            deadlock_kind = self._deadlock_after_push(box_pos, box_new_pos)
+            if deadlock_kind is not None:
+                terminated = True
+                # Terminal penalty of at least the blocked-move penalties of the steps left,
+                # so that deadlocking to end the episode early never pays off
+                reward -= 1.0 + 0.1 * max(max_steps - self.steps, 0)
+
+        # Check win condition
+        if self.boxes_on_target == len(self.box_positions):
+            reward = 10.0
+            terminated = True
+
         if self.steps >= max_steps:
             truncated = True
-            self.success_buffer.append(0)  # Record failure for curriculum
+
+        if terminated or truncated:
+            # Record the episode once for curriculum: success or failure
+            self.success_buffer.append(1 if self.boxes_on_target == len(self.box_positions) else 0)
 
         observation = self._get_observation()
 
@@ -1603,11 +1636,45 @@ class SokobanEnv(gym.Env):
             'total_boxes': len(self.box_positions),
             'all_boxes_on_target': self.boxes_on_target == len(self.box_positions),
             'steps': self.steps,
-            'curriculum_phase': self.curriculum_phase
+            'curriculum_phase': self.curriculum_phase,
+            'deadlock': deadlock_kind
         }
 
         return observation, reward, terminated, truncated, info
 
+    def _core_level(self):
+        """sokoban_core.Level of the current map (walls and targets), cached per map."""
+        height, width = self.room_state.shape
+        walls = np.flatnonzero(self.room_state.reshape(-1) == 1)
+        # Targets come from target_positions: room_state loses them under the player
+        goals = tuple(sorted(int(r) * width + int(c) for r, c in self.target_positions))
+        key = (height, width, walls.tobytes(), goals)
+        level = self._levels.get(key)
+        if level is None:
+            level = self._levels[key] = sokoban_core.Level(height, width, walls.tolist(), goals)
+        return level
+
+    def _cell(self, pos):
+        return int(pos[0]) * self.room_state.shape[1] + int(pos[1])
+
+    def _deadlock_after_push(self, box_pos, box_new_pos):
+        """Kind of deadlock created by pushing the box at box_pos to box_new_pos, or None."""
+        boxes = frozenset(self._cell(pos) for pos in self.box_positions)
+        detector = deadlock.detector_for(self._core_level())
+        return detector.check_push(self._cell(self.player_position), boxes, self._cell(box_pos), self._cell(box_new_pos))
+
+    def _matching_distance(self, box_pos=None, box_new_pos=None):
+        """
+        Minimum-matching push distance of the boxes. Without a push it is solved
+        from scratch; after a push the previous assignment is updated incrementally.
+        """
+        heuristic = heuristics.heuristic_for(self._core_level())
+        if box_pos is None or self._assignment is None:
+            self._assignment = heuristic.initial([self._cell(pos) for pos in self.box_positions])
+        else:
+            self._assignment = heuristic.after_push(self._assignment, self._cell(box_pos), self._cell(box_new_pos))
+        return self._assignment.value
+
     def _move_player(self, new_pos):
         # Update player position state
         if self.room_state[self.player_position] == 5:
@@ -1710,10 +1777,45 @@ class SokobanEnv(gym.Env):
 
 
 # 3. Improved CNN Feature Extractor
+class GlobalPool(nn.Module):
+    """Concatenates global average and max pooling, giving 2*C features for any HxW."""
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return torch.cat([x.mean(dim=(2, 3)), x.amax(dim=(2, 3))], dim=1)
+
+
+class SpatialSoftmax(nn.Module):
+    """Spatial softmax head: expected (row, col) of every channel in [-1, 1], 2*C features for any HxW."""
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        n, c, h, w = x.shape
+        attention = torch.softmax(x.reshape(n, c, h * w), dim=-1).reshape(n, c, h, w)
+        rows = torch.linspace(-1.0, 1.0, h, device=x.device, dtype=x.dtype)
+        cols = torch.linspace(-1.0, 1.0, w, device=x.device, dtype=x.dtype)
+        expected_row = (attention.sum(dim=3) * rows).sum(dim=2)
+        expected_col = (attention.sum(dim=2) * cols).sum(dim=2)
+        return torch.cat([expected_row, expected_col], dim=1)
+
+
+FEATURE_HEADS = {
+    'flatten': nn.Flatten,          # original head, tied to the training map size
+    'global_pool': GlobalPool,      # size-agnostic
+    'spatial_softmax': SpatialSoftmax,  # size-agnostic
+}
+
+
 class EnhancedSokobanCNN(BaseFeaturesExtractor):
-    """CNN feature extractor for DeepMind-style Sokoban observations."""
-    def __init__(self, observation_space: gym.spaces.Box, features_dim: int = 256):
+    """CNN feature extractor for DeepMind-style Sokoban observations.
+
+    head='flatten' (default) sizes the first linear layer from the observation
+    shape, so the model only works on one map size. 'global_pool' and
+    'spatial_softmax' give a size-agnostic extractor that can serve maps of
+    any size (see ShapeBucketBatcher).
+    """
+    def __init__(self, observation_space: gym.spaces.Box, features_dim: int = 256, head: str = 'flatten'):
         super().__init__(observation_space, features_dim)
+        if head not in FEATURE_HEADS:
+            raise ValueError(f"Unknown head {head!r}, expected one of {list(FEATURE_HEADS)}")
+        self.head = head
+        self.size_agnostic = head != 'flatten'
 
         # Get dimensions (channels, height, width)
         n_input_channels = observation_space.shape[0]
@@ -1740,7 +1842,7 @@ class EnhancedSokobanCNN(BaseFeaturesExtractor):
             nn.Conv2d(64, 32, kernel_size=3, stride=1, padding=1),
             nn.ReLU(),
 
-            nn.Flatten(),
+            FEATURE_HEADS[head](),
         )
 
         # Calculate output size
@@ -1759,6 +1861,93 @@ class EnhancedSokobanCNN(BaseFeaturesExtractor):
     def forward(self, observations: torch.Tensor) -> torch.Tensor:
         return self.linear(self.cnn(observations))
 
+
+class ShapeBucketBatcher:
+    """
+    Groups (7, H, W) observations of mixed map sizes into padded shape buckets.
+
+    Observations are padded bottom/right with walls (channel 0) up to the
+    smallest bucket that fits, so e.g. 8x8 curriculum maps and 10x10 Boxoban
+    maps share one batch and one forward pass of a size-agnostic policy.
+    A policy with the 'flatten' head only has one bucket: its training shape.
+    """
+    DEFAULT_BUCKETS = ((8, 8), (10, 10), (13, 13), (16, 16), (24, 24), (32, 32))
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = sorted(buckets, key=lambda b: b[0] * b[1])
+
+    @classmethod
+    def for_policy(cls, policy):
+        """Buckets that the given SB3 policy can actually consume."""
+        extractor = policy.features_extractor
+        if getattr(extractor, 'size_agnostic', False):
+            return cls()
+        return cls(buckets=(tuple(policy.observation_space.shape[1:]),))
+
+    def fits(self, shape):
+        """True if a (height, width) map fits one of the buckets."""
+        height, width = shape
+        return any(height <= bucket[0] and width <= bucket[1] for bucket in self.buckets)
+
+    def bucket_for(self, shape):
+        height, width = shape
+        for bucket in self.buckets:
+            if height <= bucket[0] and width <= bucket[1]:
+                return bucket
+        raise ValueError(f"Map of size {height}x{width} does not fit any bucket {self.buckets}")
+
+    @staticmethod
+    def pad(obs, bucket):
+        """Pad one (7, h, w) observation to (7, *bucket), filling the border with walls."""
+        channels, height, width = obs.shape
+        padded = np.zeros((channels,) + tuple(bucket), dtype=obs.dtype)
+        padded[0] = 1
+        padded[:, :height, :width] = obs
+        return padded
+
+    def collate(self, observations, single_bucket=False):
+        """
+        Returns a list of (indices, batch) pairs, one per bucket used.
+
+        With single_bucket=True everything is padded to the largest bucket needed,
+        giving exactly one batch.
+        """
+        buckets = [self.bucket_for(obs.shape[1:]) for obs in observations]
+        if single_bucket:
+            largest = max(buckets, key=lambda b: b[0] * b[1])
+            buckets = [largest] * len(observations)
+
+        groups = {}
+        for i, bucket in enumerate(buckets):
+            groups.setdefault(bucket, []).append(i)
+
+        batches = []
+        for bucket, indices in groups.items():
+            batch = np.stack([self.pad(observations[i], bucket) for i in indices])
+            batches.append((indices, batch))
+        return batches
+
+
+def predict_mixed_shapes(policy, observations, deterministic=True, batcher=None, single_bucket=False):
+    """
+    Predict actions and values for observations of mixed map sizes.
+
+    Returns (actions, values) numpy arrays aligned with observations.
+    """
+    batcher = batcher or ShapeBucketBatcher.for_policy(policy)
+    actions = np.zeros(len(observations), dtype=np.int64)
+    values = np.zeros(len(observations), dtype=np.float32)
+
+    policy.set_training_mode(False)
+    with torch.no_grad():
+        for indices, batch in batcher.collate(observations, single_bucket):
+            obs_tensor = torch.as_tensor(batch, device=policy.device).float()
+            distribution = policy.get_distribution(obs_tensor)
+            actions[indices] = distribution.get_actions(deterministic=deterministic).cpu().numpy()
+            values[indices] = policy.predict_values(obs_tensor).cpu().numpy().reshape(-1)
+
+    return actions, values
+
 # 4. Enhanced Training Callback
 class EnhancedTrainingCallback(BaseCallback):
     """Enhanced callback with more detailed tracking."""
@@ -1853,18 +2042,26 @@ class EnhancedTrainingCallback(BaseCallback):
         return True
 
 # 5. Function to create environment
-def make_env(maps_type='train', rank=0, difficulty='curriculum'):
+def make_env(maps_type='train', rank=0, difficulty='curriculum', terminate_on_deadlock=False, distance_reward='manhattan'):
     """Create a Sokoban environment with specified difficulty."""
     def _init():
-        env = SokobanEnv(maps_type=maps_type, render_mode="rgb_array", difficulty=difficulty)
+        env = SokobanEnv(maps_type=maps_type, render_mode="rgb_array", difficulty=difficulty,
+                         terminate_on_deadlock=terminate_on_deadlock, distance_reward=distance_reward)
         env = Monitor(env, f"logs/sokoban_{maps_type}_{difficulty}_{rank}")
         return env
     return _init
 
 # 6. Enhanced Training function
 # Updated train function to accept difficulty parameter
-def train(total_timesteps=700000, save_path="models/", maps_type='train', difficulty='curriculum'):
-    """Train a Sokoban agent with improved exploration and return visualization data."""
+def train(total_timesteps=700000, save_path="models/", maps_type='train', difficulty='curriculum', feature_head='flatten',
+          compact_buffer=None, terminate_on_deadlock=False, distance_reward='manhattan'):
+    """Train a Sokoban agent with improved exploration and return visualization data.
+
+    compact_buffer: None keeps SB3's one-hot rollout buffer; "codes" or "packed"
+    stores observations with obs_codec and decodes them per mini-batch.
+    terminate_on_deadlock: end training episodes at the first deadlocking push.
+    distance_reward: 'manhattan' or 'matching' distance for the reward shaping (see SokobanEnv).
+    """
 
     # Create environment with epsilon-greedy wrapper
     class EpsilonGreedyEnvWrapper(gym.Wrapper):
@@ -1881,7 +2078,7 @@ def train(total_timesteps=700000, save_path="models/", maps_type='train', diffic
             return self.env.step(action)
 
     # Create base environment
-    base_env = make_env(maps_type, 0, difficulty)()
+    base_env = make_env(maps_type, 0, difficulty, terminate_on_deadlock, distance_reward)()
 
     # Wrap with epsilon-greedy
     epsilon_env = EpsilonGreedyEnvWrapper(base_env, epsilon=0.2)
@@ -1892,10 +2089,16 @@ def train(total_timesteps=700000, save_path="models/", maps_type='train', diffic
     # Enhanced policy settings
     policy_kwargs = dict(
         features_extractor_class=EnhancedSokobanCNN,
-        features_extractor_kwargs=dict(features_dim=256),
+        features_extractor_kwargs=dict(features_dim=256, head=feature_head),
         net_arch=[128, 64]
     )
 
+    rollout_buffer_options = {}
+    if compact_buffer is not None:
+        import obs_codec
+        rollout_buffer_options = dict(rollout_buffer_class=obs_codec.CompactRolloutBuffer,
+                                      rollout_buffer_kwargs=dict(encoding=compact_buffer))
+
     # Create model with improved hyperparameters
     model = PPO(
         "CnnPolicy",  # Changed from "MlpPolicy" to work with the CNN feature extractor
@@ -1912,7 +2115,8 @@ def train(total_timesteps=700000, save_path="models/", maps_type='train', diffic
         vf_coef=0.7,
         max_grad_norm=0.7,
         verbose=1,
-        policy_kwargs=policy_kwargs
+        policy_kwargs=policy_kwargs,
+        **rollout_buffer_options
     )
 
     # Set model in epsilon-greedy wrapper
@@ -1950,11 +2154,22 @@ def train(total_timesteps=700000, save_path="models/", maps_type='train', diffic
             pass
         return None, None, None
 
+def load_model(model_path, quantize=None):
+    """Load a trained PPO model, optionally as the int8 quantized variant for CPU-only hosts."""
+    if quantize is None:
+        return PPO.load(model_path)
+
+    import policy_quantization
+    return policy_quantization.load_quantized_model(model_path, quantize)
+
 # 7. Enhanced Evaluation function
-def evaluate(model_path, num_episodes=5, render=True, difficulty='hard'):
-    """Evaluate a trained agent on maps of specified difficulty."""
+def evaluate(model_path, num_episodes=5, render=True, difficulty='hard', quantize=None):
+    """Evaluate a trained agent on maps of specified difficulty.
+
+    quantize: None for the float policy, or "dynamic"/"static" for the int8 variant.
+    """
     # Load model
-    model = PPO.load(model_path)
+    model = load_model(model_path, quantize)
 
     # Create environment with specified difficulty
     env = SokobanEnv(maps_type='eval', render_mode="rgb_array", difficulty=difficulty)
@@ -2082,9 +2297,66 @@ def numerical_to_chars(num_map, player_on_target_positions=None):
         char_map.append(line)
 
     return '\n'.join(char_map)
+
+
+class CustomMapEnv(SokobanEnv):
+    """SokobanEnv that always resets to the same custom map (no curriculum)."""
+    def __init__(self, custom_map, render_mode="rgb_array", terminate_on_deadlock=False, distance_reward='manhattan'):
+        self.custom_map = custom_map
+        super().__init__(render_mode=render_mode, terminate_on_deadlock=terminate_on_deadlock,
+                         distance_reward=distance_reward)
+
+    def reset(self, seed=None, options=None):
+        # Skip curriculum handling
+        if seed is not None:
+            super(SokobanEnv, self).reset(seed=seed)
+
+        # Always use the custom map
+        self.room_state = np.copy(self.custom_map)
+        self.height, self.width = self.room_state.shape
+        self.observation_space = spaces.Box(low=0, high=1, shape=(7, self.height, self.width), dtype=np.uint8)
+
+        # Find player position (6: player on a target, from ai_assistant.convert_to_ai_map)
+        player_pos = np.argwhere((self.room_state == 5) | (self.room_state == 6))
+        self.player_position = tuple(player_pos[0])
+
+        # Find box positions
+        self.box_positions = []
+        for pos in np.argwhere((self.room_state == 2) | (self.room_state == 4)):
+            self.box_positions.append(tuple(pos))
+
+        # Find target positions
+        self.target_positions = []
+        for pos in np.argwhere((self.room_state == 3) | (self.room_state == 4) | (self.room_state == 6)):
+            self.target_positions.append(tuple(pos))
+        self.room_state[self.room_state == 6] = 5
+
+        # Count boxes on targets
+        self.boxes_on_target = np.sum(self.room_state == 4)
+
+        # Calculate distances for reward shaping
+        self.prev_distances = self._calculate_distances()
+
+        # Reset step counter
+        self.steps = 0
+
+        # Initialize last_direction
+        self.last_direction = 0
+
+        # Create observation
+        observation = self._get_observation()
+
+        info = {
+            'boxes_on_target': self.boxes_on_target,
+            'total_boxes': len(self.box_positions)
+        }
+
+        return observation, info
+
+
 # 8. Test model on custom map
 # Fixed test_on_custom_map function
-def test_on_custom_map(model_path, custom_map, render=True, max_steps=200, epsilon=0.1):
+def test_on_custom_map(model_path, custom_map, render=True, max_steps=200, epsilon=0.1, quantize=None):
     """
     Test a trained model on a custom Sokoban map with epsilon-greedy exploration.
 
@@ -2094,59 +2366,14 @@ def test_on_custom_map(model_path, custom_map, render=True, max_steps=200, epsil
         render: Whether to display the environment
         max_steps: Maximum steps allowed
         epsilon: Probability of taking a random action (exploration)
+        quantize: None for the float policy, or "dynamic"/"static" for the int8 variant
     """
     # Load the model
-    model = PPO.load(model_path)
+    model = load_model(model_path, quantize)
 
     print("model loading finish.")
-    # Create a temporary environment
-    class CustomTestEnv(SokobanEnv):
-        def reset(self, seed=None, options=None):
-            # Skip curriculum handling
-            if seed is not None:
-                super(SokobanEnv, self).reset(seed=seed)
-
-            # Always use the custom map
-            self.room_state = np.copy(custom_map)
-
-            # Find player position
-            player_pos = np.argwhere(self.room_state == 5)
-            self.player_position = tuple(player_pos[0])
-
-            # Find box positions
-            self.box_positions = []
-            for pos in np.argwhere((self.room_state == 2) | (self.room_state == 4)):
-                self.box_positions.append(tuple(pos))
-
-            # Find target positions
-            self.target_positions = []
-            for pos in np.argwhere((self.room_state == 3) | (self.room_state == 4)):
-                self.target_positions.append(tuple(pos))
-
-            # Count boxes on targets
-            self.boxes_on_target = np.sum(self.room_state == 4)
-
-            # Calculate distances for reward shaping
-            self.prev_distances = self._calculate_distances()
-
-            # Reset step counter
-            self.steps = 0
-
-            # Initialize last_direction
-            self.last_direction = 0
-
-            # Create observation
-            observation = self._get_observation()
-
-            info = {
-                'boxes_on_target': self.boxes_on_target,
-                'total_boxes': len(self.box_positions)
-            }
-
-            return observation, info
-
     # Create the test environment
-    env = CustomTestEnv(render_mode="rgb_array")
+    env = CustomMapEnv(custom_map, render_mode="rgb_array")
 
     # Run the test
     obs, info = env.reset()
@@ -2171,7 +2398,12 @@ def test_on_custom_map(model_path, custom_map, render=True, max_steps=200, epsil
             action = env.action_space.sample()  # Random action
             action_types.append("random")
         else:
-            action, _ = model.predict(obs, deterministic=False)  # Non-deterministic for more diversity
+            if obs.shape == model.observation_space.shape:
+                action, _ = model.predict(obs, deterministic=False)  # Non-deterministic for more diversity
+            else:
+                # Map size differs from training: pad into a shape bucket
+                actions, _ = predict_mixed_shapes(model.policy, [obs], deterministic=False)
+                action = actions[0]
             action_types.append("policy")
 
         # Take step
@@ -2486,7 +2718,7 @@ def plot_action_distribution(action_history, save_path="action_distribution.png"
 def test_on_custom_map_with_visualization(model_path, custom_map, max_steps=200, epsilon=0.1):
     """Enhanced test function with data collection for visualization."""
     model = PPO.load(model_path)
-    env = CustomTestEnv(render_mode="rgb_array")
+    env = CustomMapEnv(custom_map, render_mode="rgb_array")
 
     # Run the test
     obs, info = env.reset()
@@ -2519,8 +2751,11 @@ def test_on_custom_map_with_visualization(model_path, custom_map, max_steps=200,
         # Predict action
         if np.random.random() < epsilon:
             action = env.action_space.sample()
-        else:
+        elif obs.shape == model.observation_space.shape:
             action, _ = model.predict(obs, deterministic=False)
+        else:
+            actions, _ = predict_mixed_shapes(model.policy, [obs], deterministic=False)
+            action = actions[0]
 
         # Record action
         action_history.append(int(action))
@@ -0,0 +1,99 @@
+# Compact storage for the 7-channel one-hot Sokoban observations.
+#
+# Every cell of a (7, H, W) observation has exactly one channel set, so the
+# whole observation is described by one channel index per cell:
+#   "codes":  (H, W) uint8 channel indices                 -> 7x smaller
+#   "packed": the 3 bit-planes of the codes, np.packbits   -> ~18x smaller
+# (both against uint8 one-hot; 4x more against float32 buffers).
+#
+# Observations are decoded in batch right before the forward pass.
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from stable_baselines3.common.buffers import BaseBuffer, RolloutBuffer
+import sokoban_core
+
+ENCODINGS = ("codes", "packed")
+CODE_BITS = 3  # channel indices 0..6
+
+
+def encode(observations):
+    """(..., 7, H, W) one-hot -> (..., H, W) uint8 channel indices."""
+    return np.argmax(np.asarray(observations), axis=-3).astype(np.uint8)
+
+
+def decode(codes):
+    """(..., H, W) channel indices -> (..., 7, H, W) uint8 one-hot."""
+    return sokoban_core.codes_to_observation(np.asarray(codes))
+
+
+def pack(codes):
+    """(..., H, W) codes -> (..., 3, ceil(H*W/8)) uint8 bit-planes."""
+    codes = np.asarray(codes, dtype=np.uint8)
+    flat = codes.reshape(codes.shape[:-2] + (-1,))
+    planes = np.stack([(flat >> bit) & 1 for bit in range(CODE_BITS)], axis=-2)
+    return np.packbits(planes, axis=-1)
+
+
+def unpack(packed, shape):
+    """Inverse of pack; shape is the (H, W) of the map."""
+    height, width = shape
+    planes = np.unpackbits(np.asarray(packed), axis=-1, count=height * width)
+    codes = np.zeros(planes.shape[:-2] + (height * width,), dtype=np.uint8)
+    for bit in range(CODE_BITS):
+        codes |= planes[..., bit, :] << bit
+    return codes.reshape(codes.shape[:-1] + (height, width))
+
+
+def decode_torch(codes, dtype=torch.float32):
+    """(..., H, W) integer tensor -> (..., 7, H, W) one-hot tensor on the same device."""
+    one_hot = F.one_hot(codes.long(), sokoban_core.NUM_CHANNELS).to(dtype)
+    return one_hot.movedim(-1, -3)
+
+
+class CompactRolloutBuffer(RolloutBuffer):
+    """
+    RolloutBuffer that keeps observations as channel codes (or packed bit-planes)
+    and decodes each mini-batch to the 7-channel tensor in _get_samples.
+
+    Use with PPO(..., rollout_buffer_class=CompactRolloutBuffer) or
+    rollout_buffer_kwargs=dict(encoding="packed").
+    """
+    def __init__(self, *args, encoding="codes", **kwargs):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding!r}, expected one of {ENCODINGS}")
+        self.encoding = encoding
+        super().__init__(*args, **kwargs)
+
+    def _stored_shape(self):
+        map_shape = self.obs_shape[1:]
+        if self.encoding == "codes":
+            return map_shape
+        return (CODE_BITS, (map_shape[0] * map_shape[1] + 7) // 8)
+
+    def reset(self):
+        # Same as RolloutBuffer.reset, without allocating the full one-hot observation array
+        self.observations = np.zeros((self.buffer_size, self.n_envs, *self._stored_shape()), dtype=np.uint8)
+        self.actions = np.zeros((self.buffer_size, self.n_envs, self.action_dim), dtype=self.action_space.dtype)
+        self.rewards = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.returns = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.episode_starts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.values = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.log_probs = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.advantages = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.generator_ready = False
+        BaseBuffer.reset(self)
+
+    def add(self, obs, *args, **kwargs):
+        codes = encode(obs)
+        if self.encoding == "packed":
+            codes = pack(codes)
+        super().add(codes, *args, **kwargs)
+
+    def _get_samples(self, batch_inds, env=None):
+        samples = super()._get_samples(batch_inds, env)
+        stored = samples.observations
+        if self.encoding == "packed":
+            stored = self.to_torch(unpack(stored.cpu().numpy(), self.obs_shape[1:]))
+        return samples._replace(observations=decode_torch(stored))
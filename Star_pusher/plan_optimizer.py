@@ -0,0 +1,208 @@
+# Shorten a UDLR plan without changing where it takes the boxes.
+#
+# PPO rollouts and human demos wander: blocked moves, detours between pushes
+# and pushes that are later undone. optimize() rebuilds the plan from its
+# pushes:
+#   1. the pushes are re-derived by replaying the plan (blocked moves drop out)
+#   2. push loops are cut: when a state (boxes and player region) comes back,
+#      the pushes in between are removed
+#   3. every walk is replaced by a BFS shortest walk (macro_moves.expand)
+#   4. optionally, a bounded local search moves single pushes up to `window`
+#      places earlier or later, keeping a move when it leaves the same boxes
+#      behind and shortens the walks around it
+# The result is replayed and must end in the same box positions as the
+# original plan (so a solving plan stays solving) and be no longer than it.
+#
+# Usage: python3 plan_optimizer.py ../human_demos sokoban_cache/human_training [--no-reorder]
+
+import argparse
+import os
+import time
+from collections import namedtuple
+import macro_moves
+import sokoban_core
+
+DEFAULT_WINDOW = 4
+DEFAULT_MAX_ROUNDS = 10
+
+OptimizedPlan = namedtuple("OptimizedPlan", "plan moves pushes original_moves original_pushes")
+
+
+def extract_pushes(state, plan):
+    """
+    Replay plan from state. Returns the (box, action) pushes it makes and the
+    (player, boxes) state before each of them, plus the final state.
+    """
+    state = state.copy()
+    pushes, states = [], []
+    for char in plan:
+        action = sokoban_core.ACTION_INDEX[char]
+        before = (state.player, frozenset(state.boxes))
+        box = state.level.neighbours[state.player][action]
+        _, pushed = state.step(action)
+        if pushed:
+            pushes.append((box, action))
+            states.append(before)
+    states.append((state.player, frozenset(state.boxes)))
+    return pushes, states
+
+
+def remove_loops(level, pushes, states):
+    """Drop the pushes between two visits of the same state (same boxes, same player region)."""
+    keys = [(macro_moves.normalized_player(level, player, boxes), boxes) for player, boxes in states]
+    kept = []        # indices of the pushes kept
+    seen = {keys[0]: 0}  # state key -> number of kept pushes when it was reached
+    for i, push in enumerate(pushes):
+        kept.append(i)
+        key = keys[i + 1]
+        if key in seen:
+            # Back in a state reached before: forget everything since
+            del kept[seen[key]:]
+            seen = {k: n for k, n in seen.items() if n <= len(kept)}
+        else:
+            seen[key] = len(kept)
+    return [pushes[i] for i in kept]
+
+
+def _apply(level, player, boxes, pushes):
+    """(moves, player, boxes) after pushes, with shortest walks; None if a push is not possible."""
+    try:
+        moves = macro_moves.expand(level, player, boxes, pushes)
+    except ValueError:
+        return None
+    boxes = set(boxes)
+    for box, action in pushes:
+        boxes.remove(box)
+        boxes.add(level.neighbours[box][action])
+        player = box
+    return len(moves), player, frozenset(boxes)
+
+
+def _walk_length(level, player, boxes, push):
+    if push is None:
+        return 0
+    box, action = push
+    walk = macro_moves.flood_fill(level, player, boxes).path_to(level.neighbours[box][macro_moves.OPPOSITE[action]])
+    return None if walk is None else len(walk)
+
+
+def reorder(level, player, boxes, pushes, window=DEFAULT_WINDOW, max_rounds=DEFAULT_MAX_ROUNDS, deadline=None):
+    """
+    Local search over the push order: move single pushes up to window places,
+    keeping every change that shortens the plan. Returns the new push list.
+    """
+    pushes = list(pushes)
+    for _ in range(max_rounds):
+        improved = False
+        # state before each push, recomputed after every accepted change
+        states = [(player, frozenset(boxes))]
+        for box, action in pushes:
+            boxes_after = set(states[-1][1])
+            boxes_after.remove(box)
+            boxes_after.add(level.neighbours[box][action])
+            states.append((box, frozenset(boxes_after)))
+
+        i = 0
+        while i < len(pushes):
+            if deadline is not None and time.perf_counter() > deadline:
+                return pushes
+            for j in range(max(0, i - window), min(len(pushes), i + window + 1)):
+                if j == i:
+                    continue
+                lo, hi = min(i, j), max(i, j) + 1
+                candidate = pushes[:]
+                candidate.insert(j, candidate.pop(i))
+                start_player, start_boxes = states[lo]
+                old = _apply(level, start_player, start_boxes, pushes[lo:hi])
+                new = _apply(level, start_player, start_boxes, candidate[lo:hi])
+                if new is None or new[2] != old[2]:
+                    continue
+                following = pushes[hi] if hi < len(pushes) else None
+                new_tail = _walk_length(level, new[1], new[2], following)
+                if new_tail is None:
+                    continue
+                old_cost = old[0] + _walk_length(level, old[1], old[2], following)
+                if new[0] + new_tail < old_cost:
+                    pushes = candidate
+                    improved = True
+                    break
+            if improved:
+                break
+            i += 1
+        if not improved:
+            break
+    return pushes
+
+
+def optimize(state, plan, reorder_pushes=True, window=DEFAULT_WINDOW, max_rounds=DEFAULT_MAX_ROUNDS, time_limit=None):
+    """
+    Shortened version of plan (a UDLR string) from state, as an OptimizedPlan.
+    The new plan ends with the boxes where plan leaves them and is never longer.
+    """
+    level = state.level
+    pushes, states = extract_pushes(state, plan)
+    pushes = remove_loops(level, pushes, states)
+    if reorder_pushes:
+        deadline = time.perf_counter() + time_limit if time_limit else None
+        pushes = reorder(level, state.player, state.boxes, pushes, window, max_rounds, deadline)
+    new_plan = macro_moves.expand(level, state.player, state.boxes, pushes)
+
+    check = state.copy()
+    blocked = sokoban_core.replay(check, new_plan)
+    if blocked or frozenset(check.boxes) != states[-1][1]:
+        raise AssertionError("optimized plan does not reach the boxes of the original plan")
+    if len(new_plan) > len(plan):
+        new_plan = plan
+    return OptimizedPlan(new_plan, len(new_plan), len(extract_pushes(state, new_plan)[0]),
+                         len(plan), len(states) - 1)
+
+
+def optimize_map(ai_map, plan, **kwargs):
+    """optimize() for a convert_to_ai_map grid; returns the plan string."""
+    _, state = sokoban_core.parse_numeric(ai_map)
+    return optimize(state, plan, **kwargs).plan
+
+
+def demo_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".txt"):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shorten the plans of demo files (map, blank line, UDLR actions).")
+    parser.add_argument("paths", nargs="+", help="demo files or folders of demo files")
+    parser.add_argument("--no-reorder", action="store_true", help="skip the push reordering search")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    parser.add_argument("--time-limit", type=float, default=None, help="seconds of reordering per plan")
+    parser.add_argument("--write", action="store_true", help="overwrite the demo files with the optimized plans")
+    args = parser.parse_args()
+
+    total_before = total_after = pushes_before = pushes_after = 0
+    for file_path in demo_files(args.paths):
+        if not os.path.exists(file_path):
+            raise SystemExit(f"The file {file_path} does not exist.")
+        map_lines, plan = sokoban_core.read_demo_file(file_path)
+        try:
+            level, state = sokoban_core.parse_ascii(map_lines)
+        except ValueError as e:
+            print(f"{file_path}: skipped ({e})")
+            continue
+        start = time.perf_counter()
+        result = optimize(state, plan, not args.no_reorder, args.window, time_limit=args.time_limit)
+        total_before += result.original_moves
+        total_after += result.moves
+        pushes_before += result.original_pushes
+        pushes_after += result.pushes
+        print(f"{file_path}: moves {result.original_moves} -> {result.moves}, "
+              f"pushes {result.original_pushes} -> {result.pushes} ({time.perf_counter() - start:.3f}s)")
+        if args.write and result.moves < result.original_moves:
+            with open(file_path, "w") as f:
+                f.write("\n".join(map_lines) + "\n\n" + result.plan)
+
+    print("=" * 50)
+    print(f"moves {total_before} -> {total_after}, pushes {pushes_before} -> {pushes_after}")
@@ -0,0 +1,234 @@
+# Per-level search sessions that survive between AI requests.
+#
+# Handing control back and forth between human and AI used to start a cold
+# solve every time. A SearchSession keeps, for one level:
+#   expansions  key -> legal, deadlock-free children with their estimates.
+#               They only depend on the state, not on where the search
+#               started, so a search from any new root replays them instead
+#               of generating them again. Only the max_expansions most
+#               recently used are kept
+#   solved      key -> next push on a known solution. A search stops as soon
+#               as it reaches such a state and follows the chain from there
+#   unfinished  open list, parents and closed set of a search that ran out
+#               of budget; a request for the same root resumes it
+# The search itself is A* on pushes, as solver.PushSolver.astar.
+#
+# SessionCache keeps the most recently used sessions in memory. The AI
+# worker process of starpusher (ai_assistant.serve) lives as long as the
+# game, so repeated assistance on a level reuses its session; the game
+# tells the worker when a level is left, and its session is dropped.
+#
+# Usage: python3 planner_session.py sokoban_cache/boxoban-levels-master/hard/000.txt --limit 20
+
+import argparse
+import heapq
+import os
+import random
+from collections import OrderedDict
+import macro_moves
+import sokoban_core
+import solver
+
+INF = float("inf")
+MAX_SESSIONS = 8
+MAX_EXPANSIONS = solver.DEFAULT_MAX_NODES  # per session: one full search
+
+
+class SearchSession(solver.PushSolver):
+    """PushSolver whose "astar" keeps its tables between calls."""
+    def __init__(self, level, max_nodes=solver.DEFAULT_MAX_NODES, time_limit=solver.DEFAULT_TIME_LIMIT,
+                 max_expansions=MAX_EXPANSIONS, **kwargs):
+        super().__init__(level, max_nodes, time_limit, **kwargs)
+        self.expansions = OrderedDict()  # least recently used first
+        self.max_expansions = max_expansions
+        self.solved = {}
+        self.unfinished = None
+        self.generated = 0  # expansions computed (not replayed) by the last search
+
+    def key_of(self, player, boxes, box_hash=None):
+        if box_hash is None:
+            box_hash = self.hash_boxes(boxes)
+        return box_hash ^ self.player_keys[macro_moves.normalized_player(self.level, player, boxes)]
+
+    def state_from_map(self, ai_map):
+        """SokobanState of a convert_to_ai_map grid on this session's level (same size, walls and goals)."""
+        _, state = sokoban_core.parse_numeric(ai_map, [self.level.position(goal) for goal in self.level.goals])
+        return sokoban_core.SokobanState(self.level, state.player, state.boxes)
+
+    def _children(self, key, player, boxes, box_hash, data):
+        children = self.expansions.get(key)
+        if children is not None:
+            self.expansions.move_to_end(key)
+            return children
+        self.generated += 1
+        children = []
+        moves, _ = self.pushes(player, boxes)
+        for move in moves:
+            box, action, dest = move.box, move.action, move.dest
+            new_boxes = move.apply(boxes)
+            new_hash = box_hash ^ self.box_keys[box] ^ self.box_keys[dest]
+            region = macro_moves.flood_fill(self.level, box, new_boxes)
+            if self.is_deadlock(box, new_boxes, box, dest, region):
+                continue
+            new_h, new_data = self.child_estimate(data, new_boxes, box, dest)
+            if new_h == INF:
+                continue
+            children.append((new_hash ^ self.player_keys[region.smallest], (box, action), box, new_boxes,
+                             new_hash, new_h, new_data))
+        self.expansions[key] = children
+        if len(self.expansions) > self.max_expansions:
+            self.expansions.popitem(last=False)
+        return children
+
+    def _known_solution(self, key):
+        pushes = []
+        while self.solved[key] is not None:
+            push, key = self.solved[key]
+            pushes.append(push)
+        return pushes
+
+    def _record(self, parents, key):
+        """Remember the solution found through key, and every state on it."""
+        chain = [key]
+        while parents[chain[-1]][1] is not None:
+            chain.append(parents[chain[-1]][1])
+        for child, parent in zip(chain, chain[1:]):
+            self.solved[parent] = (parents[child][2], child)
+
+    def astar(self, state, greedy=False):
+        """A* on pushes reusing the session tables. Returns the list of (box, action) pushes, or None."""
+        self.generated = 0
+        boxes = frozenset(state.boxes)
+        box_hash = self.hash_boxes(boxes)
+        start_key = self.key_of(state.player, boxes, box_hash)
+        if start_key in self.solved:
+            return self._known_solution(start_key)
+
+        if self.unfinished is not None and self.unfinished[0] == (start_key, greedy):
+            _, parents, closed, open_list, counter = self.unfinished
+        else:
+            h, data = self.estimate(boxes)
+            if h == INF:
+                return None
+            parents = {start_key: (0, None, None)}
+            closed = set()
+            counter = 0
+            open_list = [(h, h, counter, start_key, state.player, boxes, box_hash, data)]
+        self.unfinished = None
+
+        try:
+            while open_list:
+                _, h, _, key, player, boxes, box_hash, data = open_list[0]
+                if key in closed:
+                    heapq.heappop(open_list)
+                    continue
+                if self.is_goal(boxes):
+                    self.solved.setdefault(key, None)
+                if key in self.solved:
+                    self._record(parents, key)
+                    return self._pushes_to(parents, key) + self._known_solution(key)
+                # Counted before popping, so a budget stop leaves the node in the open list
+                self._tick()
+                heapq.heappop(open_list)
+                closed.add(key)
+
+                g = parents[key][0] + 1
+                for new_key, push, player, new_boxes, new_hash, new_h, new_data in \
+                        self._children(key, player, boxes, box_hash, data):
+                    if new_key in closed:
+                        continue
+                    known = parents.get(new_key)
+                    if known is not None and known[0] <= g:
+                        continue
+                    parents[new_key] = (g, key, push)
+                    counter += 1
+                    priority = new_h if greedy else g + new_h
+                    heapq.heappush(open_list, (priority, new_h, counter, new_key, player, new_boxes, new_hash,
+                                               new_data))
+        except solver.BudgetExceeded:
+            self.unfinished = ((start_key, greedy), parents, closed, open_list, counter)
+            raise
+        return None
+
+
+class SessionCache:
+    """The MAX_SESSIONS most recently used SearchSessions, keyed by level layout."""
+    def __init__(self, max_sessions=MAX_SESSIONS, **solver_kwargs):
+        self.sessions = OrderedDict()
+        self.max_sessions = max_sessions
+        self.solver_kwargs = solver_kwargs
+
+    @staticmethod
+    def layout_key(level):
+        return level.height, level.width, bytes(level.walls), level.goals
+
+    def session_for(self, level):
+        key = self.layout_key(level)
+        session = self.sessions.pop(key, None)
+        if session is None:
+            session = SearchSession(level, **self.solver_kwargs)
+        self.sessions[key] = session
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        return session
+
+    def discard(self, level):
+        """Drop the session of level's layout, if any (the game left that level)."""
+        self.sessions.pop(self.layout_key(level), None)
+
+    def discard_map(self, ai_map):
+        """discard() for a convert_to_ai_map grid of the level."""
+        level, _ = sokoban_core.parse_numeric(ai_map)
+        self.discard(level)
+
+    def session_for_map(self, ai_map):
+        """(SearchSession, SokobanState) for a convert_to_ai_map grid."""
+        level, _ = sokoban_core.parse_numeric(ai_map)
+        session = self.session_for(level)
+        return session, session.state_from_map(ai_map)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare repeated mid-game requests with and without a session.")
+    parser.add_argument("level_file")
+    parser.add_argument("--requests", type=int, default=4, help="requests per level, spread along the solution")
+    parser.add_argument("--detour", type=int, default=3, help="random walking moves before each later request")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N levels")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.level_file):
+        raise SystemExit(f"The file {args.level_file} does not exist.")
+
+    rng = random.Random(0)
+    cold_nodes = cold_time = warm_nodes = warm_time = 0
+    first_nodes = 0
+    levels = sokoban_core.read_level_file(args.level_file)[:args.limit]
+    for i, map_lines in enumerate(levels):
+        level, state = sokoban_core.parse_ascii(map_lines)
+        session = SearchSession(level)
+        first = session.solve_state(state)
+        if not first.solved:
+            continue
+        first_nodes += first.nodes
+        # Later requests: partway along the plan, after a few human moves
+        for r in range(1, args.requests):
+            current = state.copy()
+            sokoban_core.replay(current, first.plan[:len(first.plan) * r // args.requests])
+            for _ in range(args.detour):
+                current.step(rng.randrange(4))
+            cold = solver.PushSolver(level).solve_state(current)
+            warm = session.solve_state(current)
+            if warm.solved:
+                check = current.copy()
+                sokoban_core.replay(check, warm.plan)
+                assert check.is_solved(), f"level {i}: session plan does not solve the level"
+            cold_nodes += cold.nodes
+            cold_time += cold.elapsed
+            warm_nodes += session.generated
+            warm_time += warm.elapsed
+        print(f"level {i:4d}: first solve {first.nodes} nodes")
+
+    print("=" * 50)
+    print(f"first requests: {first_nodes} expansions")
+    print(f"later requests: cold {cold_nodes} expansions {cold_time:.2f}s, "
+          f"session {warm_nodes} new expansions {warm_time:.2f}s")
@@ -0,0 +1,216 @@
+# Post-training int8 quantization of the PPO Sokoban policy.
+#
+# Our assistant and evaluation hosts are CPU-only, so the float32
+# EnhancedSokobanCNN + 256-wide linear layers can be swapped for an
+# int8 variant. Two modes are supported:
+#   "dynamic": Linear layers are quantized, activations are quantized on the fly
+#              (Conv2d stays float: PyTorch has no dynamic int8 conv kernel)
+#   "static":  Conv2d and Linear layers are quantized with activation ranges
+#              calibrated on observations collected from the eval maps
+#
+# Usage: python3 policy_quantization.py models/sokoban_final_curriculum.zip --mode static
+
+import argparse
+import copy
+import os
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao import quantization as tq
+from stable_baselines3 import PPO
+import model_related
+
+QUANTIZE_MODES = ("dynamic", "static")
+
+
+def _select_engine():
+    """Pick the best available int8 backend for this CPU."""
+    supported = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("No int8 quantization engine available in this torch build.")
+
+
+class _StaticQuantizedExtractor(nn.Module):
+    """Wraps EnhancedSokobanCNN so the conv and linear stacks run in int8.
+
+    The head between them (Flatten, GlobalPool or SpatialSoftmax) runs in float.
+    """
+    def __init__(self, features_extractor):
+        super().__init__()
+        layers = list(copy.deepcopy(features_extractor.cnn))
+        self.quant = tq.QuantStub()
+        self.cnn = nn.Sequential(*layers[:-1])
+        self.dequant = tq.DeQuantStub()
+        self.head = layers[-1]
+        self.quant_head = tq.QuantStub()
+        self.linear = copy.deepcopy(features_extractor.linear)
+        self.dequant_out = tq.DeQuantStub()
+        self.features_dim = features_extractor.features_dim
+
+    def forward(self, observations):
+        x = self.dequant(self.cnn(self.quant(observations)))
+        x = self.quant_head(self.head(x))
+        return self.dequant_out(self.linear(x))
+
+
+def _fuse_pairs(sequential):
+    """Return [[i, i+1], ...] for every Conv2d/Linear directly followed by ReLU."""
+    pairs = []
+    modules = list(sequential)
+    for i in range(len(modules) - 1):
+        if isinstance(modules[i], (nn.Conv2d, nn.Linear)) and isinstance(modules[i + 1], nn.ReLU):
+            pairs.append([str(i), str(i + 1)])
+    return pairs
+
+
+def _replace_features_extractor(policy, extractor):
+    policy.features_extractor = extractor
+    if policy.share_features_extractor:
+        policy.pi_features_extractor = extractor
+        policy.vf_features_extractor = extractor
+
+
+def quantize_policy(policy, mode="dynamic", calibration_obs=None):
+    """
+    Return an int8 copy of an SB3 ActorCriticPolicy. The original policy is not modified.
+
+    Args:
+        policy: model.policy of a PPO model using EnhancedSokobanCNN
+        mode: "dynamic" or "static"
+        calibration_obs: (N, 7, H, W) array of observations, required for "static"
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"Unknown quantization mode {mode!r}, expected one of {QUANTIZE_MODES}")
+
+    _select_engine()
+    policy = copy.deepcopy(policy).cpu().eval()
+
+    if mode == "static":
+        if calibration_obs is None or len(calibration_obs) == 0:
+            raise ValueError("Static quantization needs calibration observations.")
+
+        extractor = _StaticQuantizedExtractor(policy.features_extractor).eval()
+        tq.fuse_modules(extractor.cnn, _fuse_pairs(extractor.cnn), inplace=True)
+        tq.fuse_modules(extractor.linear, _fuse_pairs(extractor.linear), inplace=True)
+        extractor.qconfig = tq.get_default_qconfig(torch.backends.quantized.engine)
+        tq.prepare(extractor, inplace=True)
+
+        # Calibrate activation ranges
+        with torch.no_grad():
+            obs = torch.as_tensor(np.asarray(calibration_obs), dtype=torch.float32)
+            for batch in torch.split(obs, 256):
+                extractor(batch)
+
+        tq.convert(extractor, inplace=True)
+        _replace_features_extractor(policy, extractor)
+
+    # The MLP heads are small and cheap to quantize dynamically in both modes
+    return tq.quantize_dynamic(policy, {nn.Linear}, dtype=torch.qint8)
+
+
+def _rollout(model, env, max_steps):
+    """Greedy rollout; returns (observations seen, actions taken, solved)."""
+    obs, info = env.reset()
+    observations = []
+    actions = []
+    for _ in range(max_steps):
+        action, _ = model.predict(obs, deterministic=True)
+        observations.append(obs)
+        actions.append(int(action))
+        obs, reward, terminated, truncated, info = env.step(action)
+        if terminated or truncated:
+            break
+    return observations, actions, bool(info.get('all_boxes_on_target', False))
+
+
+def collect_calibration_observations(model, maps_type='eval', max_steps=200):
+    """Roll the float model out on every map of maps_type and collect the observations."""
+    observations = []
+    for custom_map in model_related.create_maps()[maps_type]:
+        env = model_related.CustomMapEnv(custom_map)
+        obs, _, _ = _rollout(model, env, max_steps)
+        observations.extend(obs)
+    return np.array(observations, dtype=np.uint8)
+
+
+def load_quantized_model(model_path, mode="dynamic", calibration_maps='eval'):
+    """Load a PPO model and swap its policy for the int8 variant."""
+    model = PPO.load(model_path, device="cpu")
+    calibration_obs = None
+    if mode == "static":
+        calibration_obs = collect_calibration_observations(model, calibration_maps)
+    model.policy = quantize_policy(model.policy, mode, calibration_obs)
+    return model
+
+
+def check_quantized_accuracy(model_path, mode="dynamic", maps_type='eval', max_steps=200):
+    """
+    Compare the quantized policy with the float policy on the eval maps.
+
+    Reports action agreement (on the states visited by the float policy),
+    solve rate of both policies and mean forward latency.
+    """
+    float_model = PPO.load(model_path, device="cpu")
+    quant_model = load_quantized_model(model_path, mode)
+
+    agree = 0
+    total = 0
+    float_solved = 0
+    quant_solved = 0
+    maps = model_related.create_maps()[maps_type]
+
+    for custom_map in maps:
+        observations, float_actions, solved = _rollout(float_model, model_related.CustomMapEnv(custom_map), max_steps)
+        float_solved += int(solved)
+
+        quant_actions, _ = quant_model.predict(np.array(observations), deterministic=True)
+        agree += int(np.sum(np.asarray(quant_actions) == np.asarray(float_actions)))
+        total += len(float_actions)
+
+        _, _, solved = _rollout(quant_model, model_related.CustomMapEnv(custom_map), max_steps)
+        quant_solved += int(solved)
+
+    # Latency of a single-observation forward pass, which is what the assistant does
+    sample = np.array(observations[:1])
+    timings = {}
+    for name, model in (("float", float_model), ("int8", quant_model)):
+        model.predict(sample, deterministic=True)
+        start = time.perf_counter()
+        for _ in range(100):
+            model.predict(sample, deterministic=True)
+        timings[name] = (time.perf_counter() - start) / 100 * 1000
+
+    result = {
+        'mode': mode,
+        'action_agreement': agree / max(total, 1),
+        'float_solve_rate': float_solved / len(maps),
+        'quantized_solve_rate': quant_solved / len(maps),
+        'float_latency_ms': timings["float"],
+        'quantized_latency_ms': timings["int8"],
+    }
+
+    print("=" * 50)
+    print(f"Quantization mode: {mode}")
+    print(f"Action agreement: {result['action_agreement']*100:.2f}% over {total} states")
+    print(f"Solve rate: float {result['float_solve_rate']*100:.1f}% / int8 {result['quantized_solve_rate']*100:.1f}%")
+    print(f"Latency per predict: float {timings['float']:.3f} ms / int8 {timings['int8']:.3f} ms")
+    print("=" * 50)
+
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize the PPO policy and check its accuracy against float.")
+    parser.add_argument("model_path")
+    parser.add_argument("--mode", choices=QUANTIZE_MODES, default="dynamic")
+    parser.add_argument("--maps", default="eval", help="create_maps() split used for the comparison")
+    parser.add_argument("--max-steps", type=int, default=200)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model_path):
+        raise SystemExit(f"The file {args.model_path} does not exist.")
+    check_quantized_accuracy(args.model_path, args.mode, args.maps, args.max_steps)
@@ -0,0 +1,253 @@
+# Policy-guided best-first search (PHS-style) on pushes.
+#
+# The search space is the push graph of solver.PushSolver (same Zobrist keys,
+# deadlock pruning and matching bound), but nodes are ordered with the
+# trained PPO policy:
+#   pi(n)     product, along the path, of the policy probability of each push.
+#             A push is scored by the probability of its first primitive move
+#             (the first step of the walk to the box, or the push itself)
+#             in the parent state, shared among the pushes that start with
+#             that move and normalized over the legal pushes
+#   priority  log(g + h) - log pi(n) - value_weight * V(n)
+# with h the matching lower bound and V the critic's value estimate.
+#
+# The network runs in batches: up to expand_batch nodes are taken from the
+# open list and expanded together, until their children fill max_batch, and
+# all the children are evaluated in one forward pass (mixed map sizes go
+# through model_related.ShapeBucketBatcher).
+#
+# A policy with the 'flatten' head only reads maps up to its training shape;
+# larger maps are searched with FALLBACK_METHOD, without the policy.
+#
+# Usage: python3 policy_search.py models/sokoban_final_curriculum.zip sokoban_cache/boxoban-levels-master/hard/000.txt --limit 20
+
+import argparse
+import heapq
+import math
+import os
+import threading
+import time
+import numpy as np
+import torch
+import macro_moves
+import model_related
+import sokoban_core
+import solver
+
+METHOD = "policy"
+INF = float("inf")
+DEFAULT_EXPAND_BATCH = 64
+DEFAULT_MAX_BATCH = 256
+DEFAULT_VALUE_WEIGHT = 0.1
+FALLBACK_METHOD = "astar"  # for maps the policy cannot read
+
+
+class PolicyEvaluator:
+    """
+    Batched action probabilities and values of an SB3 ActorCriticPolicy.
+    evaluate() may be called from several threads: the forward passes take
+    turns, since get_distribution() fills the policy's shared action_dist.
+    """
+    def __init__(self, policy, max_batch=DEFAULT_MAX_BATCH):
+        self.policy = policy
+        self.max_batch = max_batch
+        self.batcher = model_related.ShapeBucketBatcher.for_policy(policy)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.states = 0
+
+    def fits(self, shape):
+        """True if the policy can read (height, width) maps (a 'flatten' head only reads its training shape)."""
+        return self.batcher.fits(shape)
+
+    @classmethod
+    def from_path(cls, model_path, quantize=None, max_batch=DEFAULT_MAX_BATCH):
+        """Load a saved PPO model (quantize: None, "dynamic" or "static", see model_related.load_model)."""
+        return cls(model_related.load_model(model_path, quantize).policy, max_batch)
+
+    def evaluate(self, observations):
+        """(N, 4) action probabilities and (N,) values for a list of (7, H, W) observations."""
+        probs = np.zeros((len(observations), 4), dtype=np.float32)
+        values = np.zeros(len(observations), dtype=np.float32)
+        with self.lock, torch.no_grad():
+            self.policy.set_training_mode(False)
+            for start in range(0, len(observations), self.max_batch):
+                chunk = observations[start:start + self.max_batch]
+                for indices, batch in self.batcher.collate(chunk):
+                    indices = [start + i for i in indices]
+                    obs_tensor = torch.as_tensor(batch, device=self.policy.device).float()
+                    distribution = self.policy.get_distribution(obs_tensor)
+                    probs[indices] = distribution.distribution.probs.cpu().numpy()
+                    values[indices] = self.policy.predict_values(obs_tensor).cpu().numpy().reshape(-1)
+                    self.calls += 1
+            self.states += len(observations)
+        return probs, values
+
+
+def push_log_priors(moves, probs):
+    """log p(push | parent) for each PushMove, from the parent's primitive action probabilities."""
+    first = [sokoban_core.ACTION_INDEX[move.walk[0]] if move.walk else move.action for move in moves]
+    counts = np.bincount(first, minlength=4)
+    weights = np.array([probs[a] / counts[a] for a in first], dtype=np.float64) + 1e-12
+    return np.log(weights / weights.sum())
+
+
+class PolicySearch(solver.PushSolver):
+    """PushSolver with an extra "policy" method; the other methods are unchanged."""
+    def __init__(self, level, evaluator, max_nodes=solver.DEFAULT_MAX_NODES, time_limit=solver.DEFAULT_TIME_LIMIT,
+                 expand_batch=DEFAULT_EXPAND_BATCH, value_weight=DEFAULT_VALUE_WEIGHT, **kwargs):
+        super().__init__(level, max_nodes, time_limit, **kwargs)
+        self.evaluator = evaluator
+        self.expand_batch = expand_batch
+        self.value_weight = value_weight
+
+    def _observation(self, player, boxes):
+        return sokoban_core.SokobanState(self.level, player, boxes).observation()
+
+    def policy_search(self, state):
+        """Best-first search ordered by the policy. Returns the list of (box, action) pushes, or None."""
+        boxes = frozenset(state.boxes)
+        h, data = self.estimate(boxes)
+        if h == INF:
+            return None
+        box_hash = self.hash_boxes(boxes)
+        start_key = box_hash ^ self.player_keys[macro_moves.normalized_player(self.level, state.player, boxes)]
+        probs, _ = self.evaluator.evaluate([self._observation(state.player, boxes)])
+
+        parents = {start_key: (0, None, None)}
+        closed = set()
+        counter = 0
+        open_list = [(0.0, counter, start_key, state.player, boxes, box_hash, data, 0.0, probs[0])]
+
+        while open_list:
+            # Expand a batch of the best nodes, then evaluate all their children at once
+            children = []
+            expanded = 0
+            while open_list and expanded < self.expand_batch and len(children) < self.evaluator.max_batch:
+                _, _, key, player, boxes, box_hash, data, log_pi, probs = heapq.heappop(open_list)
+                if key in closed:
+                    continue
+                closed.add(key)
+                if self.is_goal(boxes):
+                    return self._pushes_to(parents, key)
+                self._tick()
+                expanded += 1
+                children.extend(self._expand(key, player, boxes, box_hash, data, log_pi, probs, parents, closed))
+            if not children:
+                continue
+
+            child_probs, values = self.evaluator.evaluate([self._observation(c[1], c[2]) for c in children])
+            for (key, player, boxes, box_hash, data, g, h, log_pi), probs, value in zip(children, child_probs, values):
+                counter += 1
+                priority = math.log(g + h) - log_pi - self.value_weight * float(value)
+                heapq.heappush(open_list, (priority, counter, key, player, boxes, box_hash, data, log_pi, probs))
+        return None
+
+    def _expand(self, key, player, boxes, box_hash, data, log_pi, probs, parents, closed):
+        g = parents[key][0] + 1
+        moves, _ = self.pushes(player, boxes)
+        if not moves:
+            return []
+        children = []
+        for move, log_prior in zip(moves, push_log_priors(moves, probs)):
+            box, action, dest = move.box, move.action, move.dest
+            new_boxes = move.apply(boxes)
+            new_hash = box_hash ^ self.box_keys[box] ^ self.box_keys[dest]
+            region = macro_moves.flood_fill(self.level, box, new_boxes)
+            new_key = new_hash ^ self.player_keys[region.smallest]
+            if new_key in closed:
+                continue
+            known = parents.get(new_key)
+            if known is not None and known[0] <= g:
+                continue
+            if self.is_deadlock(box, new_boxes, box, dest, region):
+                continue
+            new_h, new_data = self.child_estimate(data, new_boxes, box, dest)
+            if new_h == INF:
+                continue
+            parents[new_key] = (g, key, (box, action))
+            children.append((new_key, box, new_boxes, new_hash, new_data, g, new_h, log_pi + log_prior))
+        return children
+
+    def solve_state(self, state, method=METHOD):
+        """
+        Like PushSolver.solve_state, with the extra "policy" method. A map the
+        policy cannot read is searched with FALLBACK_METHOD instead.
+        """
+        if method == METHOD and not self.evaluator.fits((self.level.height, self.level.width)):
+            print(f"policy search: the policy cannot read a {self.level.height}x{self.level.width} map, "
+                  f"using {FALLBACK_METHOD}")
+            method = FALLBACK_METHOD
+        if method != METHOD:
+            return super().solve_state(state, method)
+        start = time.perf_counter()
+        self.nodes = 0
+        self._deadline = start + self.time_limit if self.time_limit else None
+        try:
+            pushes = self.policy_search(state)
+        except solver.BudgetExceeded:
+            return solver.SolveResult(None, False, "budget", self.nodes, time.perf_counter() - start)
+        elapsed = time.perf_counter() - start
+        if pushes is None:
+            return solver.SolveResult(None, False, "unsolvable", self.nodes, elapsed)
+        return solver.SolveResult(self.pushes_to_plan(state, pushes), True, "solved", self.nodes, elapsed)
+
+
+_evaluators = {}
+
+
+def evaluator_for(model_path, quantize=None):
+    """PolicyEvaluator of a saved model, loaded once per process."""
+    key = (model_path, quantize)
+    if key not in _evaluators:
+        _evaluators[key] = PolicyEvaluator.from_path(model_path, quantize)
+    return _evaluators[key]
+
+
+def solve(ai_map, model_path, quantize=None, max_nodes=solver.DEFAULT_MAX_NODES,
+          time_limit=solver.DEFAULT_TIME_LIMIT):
+    """Policy-guided version of solver.solve for a convert_to_ai_map grid."""
+    level, state = sokoban_core.parse_numeric(ai_map)
+    return PolicySearch(level, evaluator_for(model_path, quantize), max_nodes, time_limit).solve_state(state)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the policy-guided search on a Boxoban level file.")
+    parser.add_argument("model_path")
+    parser.add_argument("level_file")
+    parser.add_argument("--quantize", choices=("dynamic", "static"), default=None)
+    parser.add_argument("--max-nodes", type=int, default=solver.DEFAULT_MAX_NODES)
+    parser.add_argument("--time-limit", type=float, default=solver.DEFAULT_TIME_LIMIT)
+    parser.add_argument("--expand-batch", type=int, default=DEFAULT_EXPAND_BATCH)
+    parser.add_argument("--value-weight", type=float, default=DEFAULT_VALUE_WEIGHT)
+    parser.add_argument("--limit", type=int, default=None, help="only solve the first N levels")
+    parser.add_argument("--compare", default=None, choices=solver.METHODS,
+                        help="also run this blind search with the same budget")
+    args = parser.parse_args()
+
+    for path in (args.model_path, args.level_file):
+        if not os.path.exists(path):
+            raise SystemExit(f"The file {path} does not exist.")
+    evaluator = PolicyEvaluator.from_path(args.model_path, args.quantize)
+
+    levels = sokoban_core.read_level_file(args.level_file)[:args.limit]
+    solved = {METHOD: 0, args.compare: 0}
+    for i, map_lines in enumerate(levels):
+        level, state = sokoban_core.parse_ascii(map_lines)
+        search = PolicySearch(level, evaluator, args.max_nodes, args.time_limit, args.expand_batch, args.value_weight)
+        line = f"level {i:4d}:"
+        for method in [METHOD] + ([args.compare] if args.compare else []):
+            result = search.solve_state(state, method)
+            if result.solved:
+                check = state.copy()
+                sokoban_core.replay(check, result.plan)
+                assert check.is_solved(), f"level {i}: {method} plan does not solve the level"
+            solved[method] += int(result.solved)
+            line += f" {method} {result.status:10s} nodes={result.nodes:7d} time={result.elapsed:6.3f}s"
+        print(line)
+
+    print("=" * 50)
+    print(f"{evaluator.calls} forward passes, {evaluator.states / max(evaluator.calls, 1):.1f} states per pass")
+    for method, count in solved.items():
+        if method is not None:
+            print(f"{method:8s} solved {count}/{len(levels)}")
@@ -0,0 +1,182 @@
+# Portfolio solver: several solver configurations race on the same level.
+#
+# No single search strategy wins on every Boxoban level, so each
+# configuration runs in its own process against a shared deadline. The
+# first valid plan wins and the other processes are terminated. A proof
+# that the level is unsolvable also ends the race.
+#
+# Used by ai_assistant.get_ai_actions (use_portfolio = True) for latency and
+# from the command line for throughput over a level file.
+#
+# POLICY_CONFIG runs the policy-guided search (policy_search); it is not in
+# DEFAULT_PORTFOLIO as it needs a model (model_path, optionally quantized).
+#
+# Usage: python3 portfolio.py sokoban_cache/boxoban-levels-master/hard/000.txt --limit 50
+#        python3 portfolio.py sokoban_cache/boxoban-levels-master/hard/000.txt --configs astar-matching,policy-matching --model models/sokoban_final_curriculum.zip --quantize dynamic
+
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+from collections import Counter, namedtuple
+import bidirectional
+import sokoban_core
+import solver
+
+PortfolioConfig = namedtuple("PortfolioConfig", ["name", "method", "heuristic", "corral_checks"])
+
+DEFAULT_PORTFOLIO = [
+    PortfolioConfig("astar-matching", "astar", "matching", False),
+    PortfolioConfig("gbfs-matching", "gbfs", "matching", False),
+    PortfolioConfig("idastar-matching", "idastar", "matching", False),
+    PortfolioConfig("astar-greedy-corral", "astar", "greedy", True),
+    PortfolioConfig("bidirectional-matching", bidirectional.METHOD, "matching", False),
+]
+POLICY_METHOD = "policy"  # policy_search.METHOD; policy_search (torch) is only imported by its process
+POLICY_CONFIG = PortfolioConfig("policy-matching", POLICY_METHOD, "matching", False)
+CONFIGS = {config.name: config for config in DEFAULT_PORTFOLIO + [POLICY_CONFIG]}
+
+# winner: name of the configuration whose result was used (None if none finished)
+PortfolioResult = namedtuple("PortfolioResult", ["plan", "solved", "status", "winner", "elapsed", "results"])
+
+
+def _parse(level_spec):
+    kind, data = level_spec
+    if kind == "ascii":
+        return sokoban_core.parse_ascii(data)
+    return sokoban_core.parse_numeric(data)
+
+
+def _run_config(config, level_spec, max_nodes, deadline, result_queue, model_path=None, quantize=None):
+    """Worker process: run one configuration and report (name, SolveResult)."""
+    level, state = _parse(level_spec)
+    if config.method == POLICY_METHOD:
+        import policy_search
+        evaluator = policy_search.evaluator_for(model_path, quantize)
+        search = policy_search.PolicySearch(level, evaluator, max_nodes, max(deadline - time.time(), 0.001),
+                                            corral_checks=config.corral_checks, heuristic=config.heuristic)
+    else:
+        time_limit = max(deadline - time.time(), 0.001)
+        solver_class = bidirectional.BidirectionalSolver if config.method == bidirectional.METHOD else solver.PushSolver
+        search = solver_class(level, max_nodes, time_limit, corral_checks=config.corral_checks,
+                              heuristic=config.heuristic)
+    result_queue.put((config.name, search.solve_state(state, config.method)))
+
+
+def _is_valid(level_spec, plan):
+    _, state = _parse(level_spec)
+    sokoban_core.replay(state, plan)
+    return state.is_solved()
+
+
+def run_portfolio(level_spec, configs=None, max_nodes=solver.DEFAULT_MAX_NODES, time_limit=solver.DEFAULT_TIME_LIMIT,
+                  model_path=None, quantize=None):
+    """
+    Race the configurations on one level. level_spec is ("ascii", map lines)
+    or ("numeric", convert_to_ai_map grid). model_path and quantize (None,
+    "dynamic" or "static") are used by POLICY_CONFIG. Returns a PortfolioResult.
+    """
+    configs = configs or DEFAULT_PORTFOLIO
+    if model_path is None and any(config.method == POLICY_METHOD for config in configs):
+        raise ValueError("The policy configuration needs a model_path")
+    start = time.time()
+    deadline = start + time_limit
+    result_queue = multiprocessing.Queue()
+    processes = {}
+    for config in configs:
+        process = multiprocessing.Process(target=_run_config,
+                                          args=(config, level_spec, max_nodes, deadline, result_queue, model_path,
+                                                quantize), daemon=True)
+        process.start()
+        processes[config.name] = process
+
+    results = {}
+    winner = None
+    status = "budget"
+    try:
+        while len(results) < len(configs):
+            try:
+                # Small grace period past the deadline for workers to report their budget failure
+                name, result = result_queue.get(timeout=max(deadline - time.time(), 0) + 1.0)
+            except queue.Empty:
+                break
+            results[name] = result
+            if result.solved and _is_valid(level_spec, result.plan):
+                winner, status = name, "solved"
+                break
+            if result.status == "unsolvable":
+                winner, status = name, "unsolvable"
+                break
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            process.join()
+        result_queue.close()
+
+    plan = results[winner].plan if status == "solved" else None
+    return PortfolioResult(plan, status == "solved", status, winner, time.time() - start, results)
+
+
+def solve(ai_map, configs=None, max_nodes=solver.DEFAULT_MAX_NODES, time_limit=solver.DEFAULT_TIME_LIMIT,
+          model_path=None, quantize=None):
+    """Portfolio version of solver.solve for a convert_to_ai_map grid."""
+    return run_portfolio(("numeric", ai_map), configs, max_nodes, time_limit, model_path, quantize)
+
+
+def solve_ascii(map_lines, configs=None, max_nodes=solver.DEFAULT_MAX_NODES, time_limit=solver.DEFAULT_TIME_LIMIT,
+                model_path=None, quantize=None):
+    """Portfolio version of solver.solve_ascii."""
+    return run_portfolio(("ascii", list(map_lines)), configs, max_nodes, time_limit, model_path, quantize)
+
+
+def configs_from_names(names):
+    """Look up a comma-separated list of configuration names."""
+    if not names:
+        return None
+    unknown = [name for name in names.split(",") if name not in CONFIGS]
+    if unknown:
+        raise ValueError(f"Unknown portfolio configurations {unknown}, expected some of {list(CONFIGS)}")
+    return [CONFIGS[name] for name in names.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Race several solver configurations on every level of a file.")
+    parser.add_argument("level_file")
+    parser.add_argument("--configs", default=None, help=f"comma-separated subset of {','.join(CONFIGS)}")
+    parser.add_argument("--max-nodes", type=int, default=solver.DEFAULT_MAX_NODES)
+    parser.add_argument("--time-limit", type=float, default=solver.DEFAULT_TIME_LIMIT)
+    parser.add_argument("--limit", type=int, default=None, help="only solve the first N levels")
+    parser.add_argument("--model", default=None, help=f"PPO model of the {POLICY_CONFIG.name} configuration")
+    parser.add_argument("--quantize", choices=("dynamic", "static"), default=None,
+                        help="run the int8 variant of the model (CPU-only hosts)")
+    args = parser.parse_args()
+
+    for path in [args.level_file] + ([args.model] if args.model else []):
+        if not os.path.exists(path):
+            raise SystemExit(f"The file {path} does not exist.")
+    configs = configs_from_names(args.configs)
+    if args.model and configs is None:
+        configs = DEFAULT_PORTFOLIO + [POLICY_CONFIG]
+    if POLICY_CONFIG in (configs or []) and not args.model:
+        raise SystemExit(f"{POLICY_CONFIG.name} needs --model")
+
+    levels = sokoban_core.read_level_file(args.level_file)[:args.limit]
+    wins = Counter()
+    solved = 0
+    start = time.time()
+    for i, map_lines in enumerate(levels):
+        result = solve_ascii(map_lines, configs, args.max_nodes, args.time_limit, args.model, args.quantize)
+        solved += int(result.solved)
+        if result.winner is not None:
+            wins[result.winner] += 1
+        print(f"level {i:4d}: {result.status:10s} winner={result.winner or '-':20s} time={result.elapsed:6.3f}s "
+              f"moves={len(result.plan) if result.plan else '-'}")
+    elapsed = time.time() - start
+
+    print("=" * 50)
+    print(f"Solved {solved}/{len(levels)} levels in {elapsed:.1f}s ({len(levels)/max(elapsed, 1e-9):.2f} levels/s)")
+    for name, count in wins.most_common():
+        print(f"  {name:20s} won {count}")
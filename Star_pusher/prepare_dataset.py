@@ -63,9 +63,13 @@ def select_maps(data_dir):
 
     generated_files = [f for f in os.listdir(data_dir) if isfile(join(data_dir, f))]
     source_file = join(data_dir, random.choice(generated_files))
+    return read_maps(source_file), source_file
+
+
+def read_maps(source_file):
+    # all maps of one level file, each as a list of lines
     maps = []
     current_map = []
-    
 
     with open(source_file, 'r') as sf:
         for line in sf.readlines():
@@ -78,7 +82,7 @@ def select_maps(data_dir):
     
     maps.append(current_map)
 
-    return maps, source_file
+    return maps
 
 def export_to_txt_file(file_path, mapObj, human_actions):
     print(file_path)
@@ -0,0 +1,247 @@
+# Compact Sokoban level/state representation and a fast step function.
+#
+# Cells are addressed by a flat index (row * width + col), so a move is a
+# single integer add. The rules are the same as starpusher.makeMove /
+# isLevelFinished (positions outside the map count as walls), and
+# observations use the SokobanEnv channel layout. Nothing here depends on
+# pygame or torch.
+
+import numpy as np
+
+# Same order as model_related.SokobanEnv: 0 up, 1 down, 2 left, 3 right
+ACTIONS = "UDLR"
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+ACTION_INDEX = {char: i for i, char in enumerate(ACTIONS)}
+
+# Observation channels, as in SokobanEnv._get_observation
+CH_WALL, CH_PLAYER, CH_PLAYER_ON_TARGET, CH_BOX, CH_BOX_ON_TARGET, CH_TARGET, CH_EMPTY = range(7)
+NUM_CHANNELS = 7
+
+
+class Level:
+    """Static part of a level: size, walls and goals. Cells are flat indices."""
+    def __init__(self, height, width, walls, goals):
+        self.height = height
+        self.width = width
+        self.size = height * width
+        self.walls = bytearray(self.size)
+        for cell in walls:
+            self.walls[cell] = 1
+        self.goals = frozenset(goals)
+        # Flat offsets for U, D, L, R
+        self.offsets = [dr * width + dc for dr, dc in DIRECTIONS]
+
+        # Neighbour table: neighbours[cell][action] is the target cell, or -1 if off the map
+        self.neighbours = []
+        for cell in range(self.size):
+            row, col = divmod(cell, width)
+            cell_neighbours = []
+            for dr, dc in DIRECTIONS:
+                r, c = row + dr, col + dc
+                if 0 <= r < height and 0 <= c < width:
+                    cell_neighbours.append(r * width + c)
+                else:
+                    cell_neighbours.append(-1)
+            self.neighbours.append(cell_neighbours)
+
+    def cell(self, row, col):
+        return row * self.width + col
+
+    def position(self, cell):
+        return divmod(cell, self.width)
+
+    def is_free(self, cell):
+        """True if cell is on the map and not a wall."""
+        return cell >= 0 and not self.walls[cell]
+
+
+class SokobanState:
+    """Dynamic part: player cell and set of box cells. Tracks boxes on goals incrementally."""
+    __slots__ = ("level", "player", "boxes", "boxes_on_goal")
+
+    def __init__(self, level, player, boxes):
+        self.level = level
+        self.player = player
+        self.boxes = set(boxes)
+        self.boxes_on_goal = len(self.boxes & level.goals)
+
+    def copy(self):
+        return SokobanState(self.level, self.player, self.boxes)
+
+    def key(self):
+        """Hashable key of the exact state."""
+        return self.player, frozenset(self.boxes)
+
+    def step(self, action):
+        """
+        Apply one of "UDLR" (or its index). Returns (moved, pushed).
+        A blocked move leaves the state untouched, as in starpusher.makeMove.
+        """
+        if isinstance(action, str):
+            action = ACTION_INDEX[action]
+        level = self.level
+        target = level.neighbours[self.player][action]
+        if not level.is_free(target):
+            return False, False
+
+        if target in self.boxes:
+            beyond = level.neighbours[target][action]
+            if not level.is_free(beyond) or beyond in self.boxes:
+                return False, False
+            self.boxes.remove(target)
+            self.boxes.add(beyond)
+            self.boxes_on_goal += (beyond in level.goals) - (target in level.goals)
+            self.player = target
+            return True, True
+
+        self.player = target
+        return True, False
+
+    def is_solved(self):
+        """All goals covered, as in starpusher.isLevelFinished."""
+        return self.boxes_on_goal == len(self.level.goals)
+
+    def code_grid(self):
+        """(H, W) uint8 grid of observation channel indices (one channel per cell)."""
+        level = self.level
+        grid = np.full(level.size, CH_EMPTY, dtype=np.uint8)
+        grid[np.frombuffer(bytes(level.walls), dtype=np.uint8).astype(bool)] = CH_WALL
+        for goal in level.goals:
+            grid[goal] = CH_TARGET
+        for box in self.boxes:
+            grid[box] = CH_BOX_ON_TARGET if box in level.goals else CH_BOX
+        grid[self.player] = CH_PLAYER_ON_TARGET if self.player in level.goals else CH_PLAYER
+        return grid.reshape(level.height, level.width)
+
+    def observation(self):
+        """7-channel one-hot observation, identical to SokobanEnv._get_observation."""
+        return codes_to_observation(self.code_grid())
+
+
+def codes_to_observation(code_grid):
+    """(..., H, W) channel-index grid -> (..., 7, H, W) uint8 one-hot."""
+    one_hot = np.eye(NUM_CHANNELS, dtype=np.uint8)[code_grid]
+    return np.moveaxis(one_hot, -1, -3)
+
+
+def parse_ascii(map_lines):
+    """
+    Parse a map in standard Sokoban characters ('#', '@', '+', '$', '*', '.', ' ').
+    Short rows are padded with floor. Returns (Level, SokobanState).
+    """
+    map_lines = [line.rstrip("\n") for line in map_lines]
+    height = len(map_lines)
+    width = max(len(line) for line in map_lines)
+    walls, goals, boxes = [], [], []
+    player = None
+    for row, line in enumerate(map_lines):
+        for col, char in enumerate(line):
+            cell = row * width + col
+            if char == '#':
+                walls.append(cell)
+            if char in '.+*':
+                goals.append(cell)
+            if char in '$*':
+                boxes.append(cell)
+            if char in '@+':
+                player = cell
+    if player is None:
+        raise ValueError('Level missing a "@" or "+" to mark the start point.')
+    level = Level(height, width, walls, goals)
+    return level, SokobanState(level, player, boxes)
+
+
+def parse_numeric(num_map, goals=None):
+    """
+    Parse a model_related / ai_assistant numeric map
+    (0 floor, 1 wall, 2 box, 3 target, 4 box on target, 5 player, 6 player on target).
+
+    goals: optional iterable of (row, col) goals, for maps that lost the goal under the player.
+    """
+    num_map = np.asarray(num_map).astype(int)
+    height, width = num_map.shape
+    flat = num_map.reshape(-1)
+    walls = np.flatnonzero(flat == 1).tolist()
+    boxes = np.flatnonzero((flat == 2) | (flat == 4)).tolist()
+    goal_cells = set(np.flatnonzero((flat == 3) | (flat == 4) | (flat == 6)).tolist())
+    if goals is not None:
+        goal_cells |= {row * width + col for row, col in goals}
+    players = np.flatnonzero((flat == 5) | (flat == 6))
+    if len(players) == 0:
+        raise ValueError("Map has no player.")
+    level = Level(height, width, walls, goal_cells)
+    return level, SokobanState(level, int(players[0]), boxes)
+
+
+def to_ascii(state):
+    """Inverse of parse_ascii."""
+    level = state.level
+    lines = []
+    for row in range(level.height):
+        line = []
+        for col in range(level.width):
+            cell = row * level.width + col
+            if level.walls[cell]:
+                line.append('#')
+            elif cell == state.player:
+                line.append('+' if cell in level.goals else '@')
+            elif cell in state.boxes:
+                line.append('*' if cell in level.goals else '$')
+            elif cell in level.goals:
+                line.append('.')
+            else:
+                line.append(' ')
+        lines.append("".join(line))
+    return lines
+
+
+def read_demo_file(file_path):
+    """
+    Read a demo written by prepare_dataset.export_to_txt_file:
+    map lines, a blank line, then the UDLR action string.
+    Returns (map_lines, actions).
+    """
+    with open(file_path, 'r') as f:
+        lines = f.read().split("\n")
+
+    map_lines = []
+    i = 0
+    while i < len(lines) and lines[i].strip() != "":
+        map_lines.append(lines[i])
+        i += 1
+    actions = "".join(char for char in "".join(lines[i:]) if char in ACTIONS)
+    return map_lines, actions
+
+
+def replay(state, actions):
+    """
+    Apply an action string to state (in place).
+    Returns the number of actions that did not move the player.
+    """
+    blocked = 0
+    for action in actions:
+        moved, _ = state.step(action)
+        if not moved:
+            blocked += 1
+    return blocked
+
+
+def read_level_file(file_path):
+    """
+    Read a level collection in the Boxoban format: each level starts after a
+    "; <n>" line. Returns a list of map line lists.
+    """
+    levels = []
+    current = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith(';'):
+                if current:
+                    levels.append(current)
+                current = []
+            elif line.strip():
+                current.append(line)
+    if current:
+        levels.append(current)
+    return levels
@@ -0,0 +1,238 @@
+# Persistent store of solved positions (SQLite).
+#
+# Every state along a stored plan is indexed, after each push, by a canonical
+# hash of (walls, goals, boxes, normalized player region). The map is cropped
+# to the area the player can ever reach, so the same level hashes the same
+# whatever padding surrounds it (Boxoban files, starpusher maps, ai_map
+# grids), and any player cell of the same region gives the same key. A lookup
+# walks the player to where the stored plan continues and returns the rest of
+# the plan, so positions reached mid-game by a human are answered too, as long
+# as they lie on a stored solution.
+#
+# Only the best-known plan (fewest pushes, then fewest moves) is kept per
+# state. The database runs in WAL mode: any number of processes can read
+# while one writes.
+#
+# Usage: python3 solution_cache.py fill sokoban_cache/boxoban-levels-master/medium/valid/000.txt --limit 50
+#        python3 solution_cache.py stats
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+import macro_moves
+import sokoban_core
+import solver
+
+parent_dir = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_PATH = parent_dir + "/sokoban_cache/solutions.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS solutions (
+    id INTEGER PRIMARY KEY,
+    level_key TEXT NOT NULL,
+    plan TEXT NOT NULL,
+    pushes INTEGER NOT NULL,
+    moves INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS states (
+    state_key TEXT PRIMARY KEY,
+    solution_id INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    player INTEGER NOT NULL,
+    pushes_left INTEGER NOT NULL,
+    moves_left INTEGER NOT NULL
+);
+"""
+
+
+class CanonicalView:
+    """
+    A state's map cropped to the bounding box of everything the player can
+    reach when boxes are ignored; cells outside that area count as walls.
+    """
+    def __init__(self, state):
+        level = state.level
+        interior = macro_moves.flood_fill(level, state.player, ()).visited
+        cells = [cell for cell in range(level.size) if interior[cell]] + list(state.boxes) + list(level.goals)
+        rows = [cell // level.width for cell in cells]
+        cols = [cell % level.width for cell in cells]
+        self.level = level
+        self.top, self.left = min(rows), min(cols)
+        self.height = max(rows) - self.top + 1
+        self.width = max(cols) - self.left + 1
+        self.interior = interior
+        self.text = self._level_text()
+
+    def to_canonical(self, cell):
+        row, col = divmod(cell, self.level.width)
+        return (row - self.top) * self.width + (col - self.left)
+
+    def from_canonical(self, cell):
+        row, col = divmod(cell, self.width)
+        return (row + self.top) * self.level.width + (col + self.left)
+
+    def _level_text(self):
+        """Walls and goals only."""
+        level = self.level
+        lines = []
+        for row in range(self.top, self.top + self.height):
+            line = []
+            for col in range(self.left, self.left + self.width):
+                cell = row * level.width + col
+                if not self.interior[cell] or level.walls[cell]:
+                    line.append('#')
+                else:
+                    line.append('.' if cell in level.goals else ' ')
+            lines.append("".join(line))
+        return "\n".join(lines)
+
+    def level_key(self):
+        return hashlib.sha1(self.text.encode()).hexdigest()
+
+    def state_key(self, player, boxes):
+        """Key of (boxes, player region) on this map."""
+        normalized = self.to_canonical(macro_moves.normalized_player(self.level, player, boxes))
+        boxes = ",".join(str(box) for box in sorted(self.to_canonical(box) for box in boxes))
+        text = f"{self.text}\n{boxes}\n{normalized}"
+        return hashlib.sha1(text.encode()).hexdigest()
+
+
+def plan_states(state, plan):
+    """
+    (offset, player, boxes, pushes so far) for the start and for the state
+    after every push of plan. offset is the index in plan where the rest begins.
+    """
+    state = state.copy()
+    states = [(0, state.player, frozenset(state.boxes), 0)]
+    pushes = 0
+    for i, action in enumerate(plan):
+        moved, pushed = state.step(action)
+        if not moved:
+            raise ValueError(f"Move {i} ({action}) of the plan is blocked")
+        if pushed:
+            pushes += 1
+            states.append((i + 1, state.player, frozenset(state.boxes), pushes))
+    return states, pushes
+
+
+class SolutionCache:
+    """Connection to one solution database. Open one per process."""
+    def __init__(self, path=DEFAULT_PATH, timeout=30.0):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup(self, state):
+        """UDLR plan that solves state from here, or None if it is not on a stored solution."""
+        if state.is_solved():
+            return ""
+        view = CanonicalView(state)
+        row = self.connection.execute(
+            "SELECT solutions.plan, states.offset, states.player FROM states "
+            "JOIN solutions ON solutions.id = states.solution_id WHERE states.state_key = ?",
+            (view.state_key(state.player, state.boxes),)).fetchone()
+        if row is None:
+            return None
+        plan, offset, player = row
+        walk = macro_moves.flood_fill(state.level, state.player, state.boxes).path_to(view.from_canonical(player))
+        if walk is None:
+            return None
+        return walk + plan[offset:]
+
+    def store(self, state, plan):
+        """
+        Record a plan that solves state, and every state after each of its
+        pushes. Returns the number of states whose best-known plan improved.
+        """
+        states, pushes = plan_states(state, plan)
+        view = CanonicalView(state)
+        improved = 0
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO solutions (level_key, plan, pushes, moves) VALUES (?, ?, ?, ?)",
+                (view.level_key(), plan, pushes, len(plan)))
+            solution_id = cursor.lastrowid
+            for offset, player, boxes, pushes_done in states:
+                cursor = self.connection.execute(
+                    "INSERT INTO states (state_key, solution_id, offset, player, pushes_left, moves_left) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(state_key) DO UPDATE SET solution_id = excluded.solution_id, "
+                    "offset = excluded.offset, player = excluded.player, "
+                    "pushes_left = excluded.pushes_left, moves_left = excluded.moves_left "
+                    "WHERE excluded.pushes_left < states.pushes_left OR "
+                    "(excluded.pushes_left = states.pushes_left AND excluded.moves_left < states.moves_left)",
+                    (view.state_key(player, boxes), solution_id, offset, view.to_canonical(player),
+                     pushes - pushes_done, len(plan) - offset))
+                improved += cursor.rowcount
+            if not improved:
+                # Nothing points to this solution
+                self.connection.execute("DELETE FROM solutions WHERE id = ?", (solution_id,))
+        return improved
+
+    def lookup_map(self, ai_map):
+        """lookup for a convert_to_ai_map grid."""
+        _, state = sokoban_core.parse_numeric(ai_map)
+        return self.lookup(state)
+
+    def store_map(self, ai_map, plan):
+        """store for a convert_to_ai_map grid."""
+        _, state = sokoban_core.parse_numeric(ai_map)
+        return self.store(state, plan)
+
+    def stats(self):
+        """(levels, solutions, states) counts."""
+        levels, solutions = self.connection.execute(
+            "SELECT COUNT(DISTINCT level_key), COUNT(*) FROM solutions").fetchone()
+        states = self.connection.execute("SELECT COUNT(*) FROM states").fetchone()[0]
+        return levels, solutions, states
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill or inspect the solution cache.")
+    parser.add_argument("--db", default=DEFAULT_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    fill = commands.add_parser("fill", help="solve the levels of a Boxoban file that are not cached yet")
+    fill.add_argument("level_file")
+    fill.add_argument("--method", choices=solver.METHODS, default="astar")
+    fill.add_argument("--max-nodes", type=int, default=solver.DEFAULT_MAX_NODES)
+    fill.add_argument("--time-limit", type=float, default=solver.DEFAULT_TIME_LIMIT)
+    fill.add_argument("--limit", type=int, default=None, help="only the first N levels")
+    commands.add_parser("stats", help="print the number of stored levels, solutions and states")
+    args = parser.parse_args()
+
+    with SolutionCache(args.db) as cache:
+        if args.command == "fill":
+            if not os.path.exists(args.level_file):
+                raise SystemExit(f"The file {args.level_file} does not exist.")
+            hits = solved = 0
+            start = time.time()
+            levels = sokoban_core.read_level_file(args.level_file)[:args.limit]
+            for i, map_lines in enumerate(levels):
+                level, state = sokoban_core.parse_ascii(map_lines)
+                if cache.lookup(state) is not None:
+                    hits += 1
+                    continue
+                result = solver.PushSolver(level, args.max_nodes, args.time_limit).solve_state(state, args.method)
+                if result.solved:
+                    cache.store(state, result.plan)
+                    solved += 1
+                print(f"level {i:4d}: {result.status:10s} time={result.elapsed:6.3f}s")
+            print(f"{hits} cached, {solved} newly solved out of {len(levels)} in {time.time() - start:.1f}s")
+        levels, solutions, states = cache.stats()
+        print(f"{args.db}: {levels} levels, {solutions} solutions, {states} states")
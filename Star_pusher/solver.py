@@ -0,0 +1,301 @@
+# Search-based Sokoban solver used by the AI assistant.
+#
+# The search runs at the push level (see macro_moves): a node is a box
+# configuration plus the area the player can reach without pushing,
+# normalized to the smallest reachable cell. Walking between pushes is
+# reconstructed only once a plan has been found.
+#   "astar":   A* on the number of pushes
+#   "idastar": IDA* with a per-iteration transposition table (low memory)
+#   "gbfs":    greedy best-first on the estimate alone (fast, plans not push-optimal)
+# States are keyed by a Zobrist hash of the box cells and the normalized
+# player cell, pushes into dead squares, freeze or bipartite deadlocks are
+# pruned (see deadlock) and the estimate is the minimum-matching lower
+# bound, updated incrementally along each push (see heuristics). Corral checks are optional: on Boxoban they
+# cost more time than the nodes they save. Both searches stop when the node
+# or time budget runs out.
+#
+# Usage: python3 solver.py sokoban_cache/boxoban-levels-master/medium/valid/000.txt --limit 50
+
+import argparse
+import heapq
+import os
+import random
+import time
+from collections import namedtuple
+import deadlock
+import heuristics
+import macro_moves
+import sokoban_core
+
+METHODS = ("astar", "idastar", "gbfs")
+DEFAULT_MAX_NODES = 200000
+DEFAULT_TIME_LIMIT = 10.0
+
+OPPOSITE = macro_moves.OPPOSITE
+INF = float("inf")
+
+# plan: UDLR string (None unless solved); status: "solved", "unsolvable" or "budget"
+SolveResult = namedtuple("SolveResult", ["plan", "solved", "status", "nodes", "elapsed"])
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class PushSolver:
+    """
+    Push-level search on one level. Its tables (push distances, dead squares,
+    Zobrist keys) only depend on walls and goals, so a solver can be reused
+    for several states of the same level.
+    """
+    def __init__(self, level, max_nodes=DEFAULT_MAX_NODES, time_limit=DEFAULT_TIME_LIMIT, seed=0, corral_checks=False,
+                 heuristic="matching"):
+        self.level = level
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        self.goals = sorted(level.goals)
+
+        rng = random.Random(seed)
+        self.box_keys = [rng.getrandbits(64) for _ in range(level.size)]
+        self.player_keys = [rng.getrandbits(64) for _ in range(level.size)]
+
+        # Push distances and dead squares come from the level's deadlock tables
+        self.deadlocks = deadlock.detector_for(level)
+        self.dead = self.deadlocks.dead
+        self.corral_checks = corral_checks
+        if heuristic not in heuristics.HEURISTICS:
+            raise ValueError(f"Unknown heuristic {heuristic!r}, expected one of {heuristics.HEURISTICS}")
+        self.heuristic = heuristic
+        self.matching = heuristics.heuristic_for(level)
+
+        self.nodes = 0
+        self._deadline = None
+
+    # ---- state helpers ----
+
+    def hash_boxes(self, boxes):
+        h = 0
+        for box in boxes:
+            h ^= self.box_keys[box]
+        return h
+
+    def estimate(self, boxes):
+        """Lower bound on the remaining pushes, plus what child_estimate needs to update it."""
+        if self.heuristic == "matching":
+            assignment = self.matching.initial(boxes)
+            return assignment.value, assignment
+        return self.matching.greedy(boxes), None
+
+    def child_estimate(self, data, boxes, source, dest):
+        """estimate() after the box at source was pushed to dest, updated from the parent's data."""
+        if self.heuristic == "matching":
+            assignment = self.matching.after_push(data, source, dest)
+            return assignment.value, assignment
+        return self.matching.greedy(boxes), None
+
+    def is_goal(self, boxes):
+        return all(goal in boxes for goal in self.goals)
+
+    def pushes(self, player, boxes):
+        """Legal pushes (macro_moves.PushMove) that do not leave a box on a dead square, and the player Region."""
+        dead = self.dead if len(boxes) == len(self.goals) else None
+        return macro_moves.push_successors(self.level, player, boxes, dead)
+
+    def is_deadlock(self, player, boxes, source, dest, region=None):
+        """Deadlock check of the state reached by pushing the box at source to dest."""
+        return self.deadlocks.check_push(player, boxes, source, dest, self.corral_checks, region) is not None
+
+    def _tick(self):
+        self.nodes += 1
+        if self.nodes > self.max_nodes:
+            raise BudgetExceeded()
+        if self._deadline is not None and not self.nodes & 255 and time.perf_counter() > self._deadline:
+            raise BudgetExceeded()
+
+    # ---- searches ----
+
+    def astar(self, state, greedy=False):
+        """
+        A* on pushes. Returns the list of (box, action) pushes, or None if the level is unsolvable.
+        greedy orders the open list by the estimate alone (greedy best-first search).
+        """
+        boxes = frozenset(state.boxes)
+        h, data = self.estimate(boxes)
+        if h == INF:
+            return None
+        box_hash = self.hash_boxes(boxes)
+        norm = macro_moves.normalized_player(self.level, state.player, boxes)
+        start_key = box_hash ^ self.player_keys[norm]
+
+        # key -> (g, parent key, push that led here)
+        parents = {start_key: (0, None, None)}
+        closed = set()
+        counter = 0
+        open_list = [(h, h, counter, start_key, state.player, boxes, box_hash, data)]
+
+        while open_list:
+            _, h, _, key, player, boxes, box_hash, data = heapq.heappop(open_list)
+            if key in closed:
+                continue
+            closed.add(key)
+            if self.is_goal(boxes):
+                return self._pushes_to(parents, key)
+            self._tick()
+
+            g = parents[key][0] + 1
+            moves, _ = self.pushes(player, boxes)
+            for move in moves:
+                box, action, dest = move.box, move.action, move.dest
+                new_boxes = move.apply(boxes)
+                new_hash = box_hash ^ self.box_keys[box] ^ self.box_keys[dest]
+                region = macro_moves.flood_fill(self.level, box, new_boxes)
+                new_key = new_hash ^ self.player_keys[region.smallest]
+                if new_key in closed:
+                    continue
+                known = parents.get(new_key)
+                if known is not None and known[0] <= g:
+                    continue
+                if self.is_deadlock(box, new_boxes, box, dest, region):
+                    continue
+                new_h, new_data = self.child_estimate(data, new_boxes, box, dest)
+                if new_h == INF:
+                    continue
+                parents[new_key] = (g, key, (box, action))
+                counter += 1
+                priority = new_h if greedy else g + new_h
+                heapq.heappush(open_list, (priority, new_h, counter, new_key, box, new_boxes, new_hash, new_data))
+        return None
+
+    @staticmethod
+    def _pushes_to(parents, key):
+        pushes = []
+        while parents[key][1] is not None:
+            _, key, push = parents[key]
+            pushes.append(push)
+        pushes.reverse()
+        return pushes
+
+    def idastar(self, state):
+        """IDA* on pushes. Returns the list of (box, action) pushes, or None if the level is unsolvable."""
+        boxes = frozenset(state.boxes)
+        threshold, start_data = self.estimate(boxes)
+        if threshold == INF:
+            return None
+        box_hash = self.hash_boxes(boxes)
+        path = []
+
+        def search(player, boxes, box_hash, data, g, h, table):
+            f = g + h
+            if f > threshold:
+                return f
+            if self.is_goal(boxes):
+                return True
+            self._tick()
+            moves, region = self.pushes(player, boxes)
+            key = box_hash ^ self.player_keys[region.smallest]
+            if table.get(key, INF) <= g:
+                return INF
+            table[key] = g
+
+            # Try the pushes that lower the heuristic first
+            children = []
+            for move in moves:
+                new_boxes = move.apply(boxes)
+                if self.is_deadlock(move.box, new_boxes, move.box, move.dest):
+                    continue
+                new_h, new_data = self.child_estimate(data, new_boxes, move.box, move.dest)
+                if new_h != INF:
+                    children.append((new_h, move.box, move.action, move.dest, new_boxes, new_data))
+            children.sort(key=lambda child: child[0])
+
+            minimum = INF
+            for new_h, box, action, dest, new_boxes, new_data in children:
+                path.append((box, action))
+                result = search(box, new_boxes, box_hash ^ self.box_keys[box] ^ self.box_keys[dest], new_data,
+                                g + 1, new_h, table)
+                if result is True:
+                    return True
+                path.pop()
+                minimum = min(minimum, result)
+            return minimum
+
+        while True:
+            result = search(state.player, boxes, box_hash, start_data, 0, threshold, {})
+            if result is True:
+                return list(path)
+            if result == INF:
+                return None
+            threshold = result
+
+    def pushes_to_plan(self, state, pushes):
+        """Expand (box, action) pushes into the full UDLR move string starting from state."""
+        return macro_moves.expand(self.level, state.player, state.boxes, pushes)
+
+    def solve_state(self, state, method="astar"):
+        """Search from a SokobanState. Returns a SolveResult."""
+        if method not in METHODS:
+            raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+        start = time.perf_counter()
+        self.nodes = 0
+        self._deadline = start + self.time_limit if self.time_limit else None
+        try:
+            if method == "idastar":
+                pushes = self.idastar(state)
+            else:
+                pushes = self.astar(state, greedy=method == "gbfs")
+        except BudgetExceeded:
+            return SolveResult(None, False, "budget", self.nodes, time.perf_counter() - start)
+        elapsed = time.perf_counter() - start
+        if pushes is None:
+            return SolveResult(None, False, "unsolvable", self.nodes, elapsed)
+        return SolveResult(self.pushes_to_plan(state, pushes), True, "solved", self.nodes, elapsed)
+
+
+def solve(ai_map, method="astar", max_nodes=DEFAULT_MAX_NODES, time_limit=DEFAULT_TIME_LIMIT):
+    """
+    Solve a convert_to_ai_map grid (see ai_assistant). Returns a SolveResult
+    whose plan is a UDLR string in (row, col) directions: U = row - 1.
+    """
+    level, state = sokoban_core.parse_numeric(ai_map)
+    return PushSolver(level, max_nodes, time_limit).solve_state(state, method)
+
+
+def solve_ascii(map_lines, method="astar", max_nodes=DEFAULT_MAX_NODES, time_limit=DEFAULT_TIME_LIMIT):
+    """Same as solve, for a map in Sokoban characters."""
+    level, state = sokoban_core.parse_ascii(map_lines)
+    return PushSolver(level, max_nodes, time_limit).solve_state(state, method)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the search solver on a Boxoban level file.")
+    parser.add_argument("level_file")
+    parser.add_argument("--method", choices=METHODS, default="astar")
+    parser.add_argument("--max-nodes", type=int, default=DEFAULT_MAX_NODES)
+    parser.add_argument("--time-limit", type=float, default=DEFAULT_TIME_LIMIT)
+    parser.add_argument("--limit", type=int, default=None, help="only solve the first N levels")
+    parser.add_argument("--corral", action="store_true", help="also run the corral deadlock search on every push")
+    parser.add_argument("--heuristic", choices=heuristics.HEURISTICS, default="matching")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.level_file):
+        raise SystemExit(f"The file {args.level_file} does not exist.")
+
+    levels = sokoban_core.read_level_file(args.level_file)[:args.limit]
+    solved = 0
+    times = []
+    for i, map_lines in enumerate(levels):
+        level, state = sokoban_core.parse_ascii(map_lines)
+        result = PushSolver(level, args.max_nodes, args.time_limit,
+                            corral_checks=args.corral, heuristic=args.heuristic).solve_state(state, args.method)
+        if result.solved:
+            check = state.copy()
+            sokoban_core.replay(check, result.plan)
+            assert check.is_solved(), f"level {i}: plan does not solve the level"
+            solved += 1
+        times.append(result.elapsed)
+        print(f"level {i:4d}: {result.status:10s} nodes={result.nodes:7d} time={result.elapsed:6.3f}s "
+              f"moves={len(result.plan) if result.plan else '-'}")
+
+    print("=" * 50)
+    print(f"Solved {solved}/{len(levels)} levels, mean time {sum(times)/max(len(times), 1):.3f}s, "
+          f"max {max(times, default=0):.3f}s")
@@ -3,13 +3,18 @@
 import random, sys, copy, os, pygame
 from pygame.locals import *
 import prepare_dataset
+import level_cache
+import demo_log
 import ai_assistant
 import multiprocessing
+import atexit
 import math
 
 
 mode = "training"
 FPS = 30 # frames per second to update the screen
+AI_MOVES_PER_SECOND = 4 # how fast the robot replays the AI plan
+AI_POLL_INTERVAL = 50 # milliseconds between checks for planner messages while waiting for them
 WINWIDTH = 1000 # width of the program's window, in pixels
 WINHEIGHT = 600 # height in pixels
 HALF_WINWIDTH = int(WINWIDTH / 2)
@@ -22,6 +27,7 @@ TILEHEIGHT = 50
 # The percentage of outdoor tiles that have additional
 # decoration on them, such as a tree or rock.
 OUTSIDE_DECORATION_PCT = 35
+OUTSIDE_DECORATIONS = ['1', '2', '3', '4'] # the map characters of OUTSIDEDECOMAPPING
 
 BRIGHTBLUE = (  0, 170, 255)
 WHITE      = (255, 255, 255)
@@ -32,17 +38,55 @@ UP = 'up'
 DOWN = 'down'
 LEFT = 'left'
 RIGHT = 'right'
+DIRECTION_INDEX = {UP: 0, DOWN: 1, LEFT: 2, RIGHT: 3} # action numbers of demo_log and the models
 
 current_difficulty = "learning"
 parent_dir = os.path.dirname(os.path.realpath(__file__))
 cache_path = parent_dir + "/sokoban_cache"
-human_training_path = cache_path + "/human_training"
-human_training_actions = ""
+LEVEL_FOLDERS = {"learning": cache_path + '/Curriculum-levels',
+                 "medium": cache_path + '/boxoban-levels-master/medium/train',
+                 "hard": cache_path + '/boxoban-levels-master/hard'}
+demo_recorder = None # demo_log.DemoRecorder of the session in training mode
 ai_action_process = None
-
-def process_ai_inference(data, queue):
-    result = ai_assistant.get_ai_actions(data)
-    queue.put(result)
+ai_requests = None
+ai_results = None
+ai_request_id = 0
+
+def start_ai_worker():
+    # One AI process for the whole game (see ai_assistant.serve): it keeps the search
+    # of each level, so asking for help again on a level continues from the earlier search.
+    # It is not a daemon, since the portfolio solver starts processes of its own:
+    # stop_ai_worker() ends it, at the latest when the game exits.
+    global ai_action_process, ai_requests, ai_results
+    if ai_action_process is None or not ai_action_process.is_alive():
+        ai_requests = multiprocessing.Queue()
+        ai_results = multiprocessing.Queue()
+        ai_action_process = multiprocessing.Process(target=ai_assistant.serve, args=(ai_requests, ai_results))
+        ai_action_process.start()
+        # registered after multiprocessing's own exit handler, so it runs before that one waits for the worker
+        atexit.unregister(stop_ai_worker)
+        atexit.register(stop_ai_worker)
+
+def stop_ai_worker(timeout=2):
+    # Sends the worker the None request and waits for it; a worker still busy
+    # with a search after timeout seconds is terminated
+    global ai_action_process
+    if ai_action_process is None:
+        return
+    if ai_action_process.is_alive():
+        ai_requests.put((None, None))
+        ai_action_process.join(timeout)
+    if ai_action_process.is_alive():
+        ai_action_process.terminate()
+        ai_action_process.join()
+    ai_action_process = None
+
+def leave_ai_level(levelObj):
+    # Tells a running AI worker that the game left this level, so it drops the level's search session
+    if ai_action_process is not None and ai_action_process.is_alive():
+        startState = levelObj['startState']
+        ai_map = ai_assistant.convert_to_ai_map(levelObj, startState.stars, startState.player)
+        ai_requests.put((ai_assistant.LEAVE_LEVEL, ai_map))
  
 # def draw_spinner(surface, center, radius, angle, color=(255, 255, 255), width=4):
 #     x = center[0] + radius * math.cos(angle)
@@ -51,35 +95,49 @@ def process_ai_inference(data, queue):
 
 # when mode == "play", will call this function to read 5 maps
 def read_maps_from_file(data_folder):
-    
+    # Returns (levels, file names). levels is a level_cache.Prefetcher: the first
+    # level is parsed right away and the others in a background thread. Parsed
+    # levels are also cached on disk, so the next launch with unchanged level
+    # files does not parse them again.
     if mode == "training" and current_difficulty == "learning":
+        source_files = [os.path.join(data_folder, f) for f in os.listdir(data_folder)
+                        if os.path.isfile(os.path.join(data_folder, f))]
+        cached = level_cache.load(source_files)
+        if cached is not None:
+            maps_file_name, records = cached
+            return level_cache.Prefetcher(records, levelFromRecord), maps_file_name
+
+        # Reading the files is cheap (the names and the number of levels are needed
+        # before the first frame); parsing them is left to the Prefetcher
         selected_maps, maps_file_name = prepare_dataset.choose_all_maps(data_folder)
+        def store(levels):
+            level_cache.store(source_files, (maps_file_name, [recordFromLevel(level) for level in levels]))
     else:
         maps, source_file = prepare_dataset.select_maps(data_folder)
         partial_path = source_file[len(cache_path)+1:].replace("/", "_")[:-4] 
         print("source_file:", source_file)
         map_num = min(len(maps), 20)
-        selected_maps = random.sample(maps, map_num)
-        
-        maps_file_name = []
-        for map in selected_maps:
-            maps_file_name.append(partial_path + "_" + str(maps.index(map)) + ".txt")
-                
-    levels = []
-    for mapTextLines in selected_maps:
-        level = read_map(mapTextLines)
-        levels.append(level)
-         
-        ### delete later. now for debugging
-        # print("just test if the conversion matches: this one from Sarjunes!")
-        # custom_map = model_related.chars_to_numerical("\n".join(mapTextLines))       
-        # print(custom_map)
-                     
-    return levels, maps_file_name
+        selected = random.sample(range(len(maps)), map_num)
+        maps_file_name = [partial_path + "_" + str(i) + ".txt" for i in selected]
+        cached = level_cache.load([source_file])
+        if cached is not None:
+            return level_cache.Prefetcher([cached[i] for i in selected], levelFromRecord), maps_file_name
+
+        selected_maps = [maps[i] for i in selected]
+        def store(levels):
+            # the whole file, so a later launch can pick any of its maps; the selected ones are already parsed
+            records = {i: recordFromLevel(level) for i, level in zip(selected, levels)}
+            level_cache.store([source_file], [records[i] if i in records else parseMap(map)
+                                              for i, map in enumerate(maps)])
+
+    return level_cache.Prefetcher(selected_maps, read_map, on_done=store), maps_file_name
     
     
-def main():
-    global FPSCLOCK, DISPLAYSURF, IMAGESDICT, TILEMAPPING, OUTSIDEDECOMAPPING, BASICFONT, PLAYERIMAGES, currentImage, ROBOTIMAGE, ai_mode, human_training_actions
+def initGame():
+    """Creates the window and loads the fonts and images into the global
+    variables that the drawing functions use. batch_play calls it too, to
+    draw without a real display."""
+    global FPSCLOCK, DISPLAYSURF, IMAGESDICT, TILEMAPPING, OUTSIDEDECOMAPPING, BASICFONT, PLAYERIMAGES, currentImage, ROBOTIMAGE
 
     # Pygame initialization and basic set up of the global variables.
     pygame.init()
@@ -124,7 +182,7 @@ def main():
                   'medium_highlight': pygame.image.load('images/'+ 'medium_highlight.png'),
                   'hard': pygame.image.load('images/'+ 'hard.png'),
                   'hard_highlight': pygame.image.load('images/'+ 'hard_highlight.png'),
-                  "robot": pygame.transform.scale(pygame.image.load('images/'+ 'robot-9.png'), (50, 50))}
+                  "robot": pygame.transform.scale(pygame.image.load('images/'+ 'robot-9.png'), (40, 45))}
 
     # These dict values are global, and map the character that appears
     # in the level file to the Surface object it represents.
@@ -146,20 +204,19 @@ def main():
                     IMAGESDICT['pinkgirl']]
     ROBOTIMAGE = IMAGESDICT['robot']
 
-    startScreen() # show the title screen until the user presses a key
 
-    # when the mode is training, we need to read all maps from the folder to train continuously
-    if current_difficulty == "learning":
-        levels, maps_file_name = read_maps_from_file(cache_path + '/Curriculum-levels')
+def main():
+    global ai_mode, demo_recorder
 
-    elif current_difficulty == "medium":
-        levels, maps_file_name = read_maps_from_file(cache_path + '/boxoban-levels-master/medium/train')
+    initGame()
+    startScreen() # show the title screen until the user presses a key
 
-    elif current_difficulty == "hard":
-        levels, maps_file_name = read_maps_from_file(cache_path + '/boxoban-levels-master/hard')
+    # when the mode is training, we need to read all maps from the folder to train continuously
+    levels, maps_file_name = read_maps_from_file(LEVEL_FOLDERS[current_difficulty])
             
     if mode == "training":
-        os.makedirs(human_training_path, exist_ok=True)
+        demo_recorder = demo_log.DemoRecorder()
+        print("recording to:", demo_recorder.path)
         
     currentLevelIndex = 0
     ai_mode = False
@@ -168,17 +225,16 @@ def main():
     # finishes that level, the next/previous level is loaded.
     while True: # main game loop
         # Run the level to actually start playing the game:
+        if demo_recorder is not None:
+            demo_recorder.start_level(currentLevelIndex, maps_file_name[currentLevelIndex],
+                                      levels[currentLevelIndex]['mapObj'], pygame.time.get_ticks())
         result = runLevel(levels, currentLevelIndex, ai_mode)
+        if result != 'reset':
+            leave_ai_level(levels[currentLevelIndex])
 
         if result in ('solved', 'next'):
             # Go to the next level.
 
-            if result == "solved" and mode == "training":
-                saved_to_file = human_training_path + "/" + maps_file_name[currentLevelIndex]
-                prepare_dataset.export_to_txt_file(saved_to_file, levels[currentLevelIndex]['mapObj'], human_training_actions)
-                print("training result is saved to:", saved_to_file)
-                human_training_actions = ""
-                
             currentLevelIndex += 1
             if currentLevelIndex >= len(levels):
                 # If there are no more levels, go back to the first one.
@@ -197,12 +253,16 @@ def main():
 
 
 def runLevel(levels, levelNum, ai_mode=False):
-    global currentImage, human_training_actions, ai_action_process
+    global currentImage, ai_action_process, ai_request_id
     
     levelObj = levels[levelNum]
     mapObj = decorateMap(levelObj['mapObj'], levelObj['startState']['player'])
     gameStateObj = copy.deepcopy(levelObj['startState'])
+    mapBackground = drawMapBackground(mapObj)
     mapNeedsRedraw = True # set to True to call drawMap()
+    screenNeedsRedraw = True # set to True to redraw the whole window, not only the changed spaces
+    changedTiles = set() # (x, y) spaces changed by the last move
+    changedRects = []
     levelSurf = BASICFONT.render('Level %s of %s' % (levelNum + 1, len(levels)), 1, TEXTCOLOR)
     levelRect = levelSurf.get_rect()
     levelRect.bottomleft = (86, WINHEIGHT - 20)
@@ -228,49 +288,81 @@ def runLevel(levels, levelNum, ai_mode=False):
     # ai_actions = [LEFT, RIGHT, RIGHT, LEFT, UP, DOWN, DOWN]
     ai_actions = []
     ai_step = 0
-    ai_speed_interval = 500
+    nextAiMoveTime = 0 # pygame.time.get_ticks() at which the robot makes its next move
     human_playRect = None
     ai_assistantRect = None
     ai_action_loading = False 
+    result_queue = None
+    # ai_snapshots[i]: game state after the first i AI moves, to rewind when the planner retracts moves
+    ai_snapshots = []
 
     while True: # main game loop
         # Reset these variables:
         playerMoveTo = None
         keyPressed = False
+        aiMoved = False
+
+        # Sleep until something can change: an input event, the robot's next
+        # move, or (polled, a Queue cannot wake pygame up) a planner message.
+        if ai_mode and ai_step < len(ai_actions) and not levelIsComplete:
+            timeout = nextAiMoveTime - pygame.time.get_ticks()
+        elif ai_mode and result_queue is not None:
+            timeout = AI_POLL_INTERVAL
+        else:
+            timeout = None
+        events = waitForEvents(timeout)
+        for event in events:
+            if event.type == VIDEOEXPOSE:
+                screenNeedsRedraw = True
 
         if ai_mode:
-            # when ai_action is loading, wait for the result_queue
-            if ai_action_loading:
-                if not result_queue.empty():
-                    ai_actions = result_queue.get()
+            # the planner streams its moves: start as soon as the first prefix arrives
+            while result_queue is not None and not result_queue.empty():
+                request_id, kind, value = result_queue.get()
+                if request_id != ai_request_id:
+                    continue  # left over from an earlier request
+                if kind == "prefix":
+                    ai_actions.extend(value)
                     ai_action_loading = False
-                    ai_step = 0
-                    
+                elif kind == "retract":
+                    # the planner took back moves after the first `value`: rewind if they were already played
+                    del ai_actions[value:]
+                    if ai_step > value:
+                        gameStateObj = copy.deepcopy(ai_snapshots[value])
+                        ai_step = value
+                        mapNeedsRedraw = True
+                    del ai_snapshots[value + 1:]
+                elif kind == "done":
+                    ai_action_loading = False
+                    result_queue = None
                     print("retrive action from ai:", ai_actions)
-            else: 
-                for event in pygame.event.get(): # event handling loop
-                    if event.type == QUIT:
-                        # Player clicked the "X" at the corner of the window.
-                        
-                        terminate(ai_action_process)
-                        
-                    elif event.type == pygame.MOUSEBUTTONDOWN:
-                        if human_playRect is not None and human_playRect.collidepoint(event.pos):
-                            ai_mode = False  # Change variable if image1 is clicked
-                            mapNeedsRedraw = True
-                
-                if ai_actions is not None and len(ai_actions) > 0: 
-                    if ai_speed_interval < 0 and ai_step < len(ai_actions):
-                        playerMoveTo = ai_actions[ai_step]
-                        ai_speed_interval = 1000
-                        ai_step += 1
-                        
-                    else:
-                        playerMoveTo = None
-                    ai_speed_interval -= 1
+            if result_queue is not None and not ai_action_process.is_alive():
+                # The worker died before answering: stop waiting (the next click starts a new one)
+                print("AI worker stopped unexpectedly")
+                ai_action_loading = False
+                result_queue = None
+
+            for event in events: # event handling loop
+                if event.type == QUIT:
+                    # Player clicked the "X" at the corner of the window.
+                    
+                    terminate(ai_action_process)
+                    
+                elif event.type == pygame.MOUSEBUTTONDOWN and not ai_action_loading:
+                    if human_playRect is not None and human_playRect.collidepoint(event.pos):
+                        ai_mode = False  # Change variable if image1 is clicked
+                        mapNeedsRedraw = True
+
+            # The robot moves on the clock, AI_MOVES_PER_SECOND times a second
+            now = pygame.time.get_ticks()
+            if ai_mode and not ai_action_loading and ai_step < len(ai_actions) and now >= nextAiMoveTime:
+                playerMoveTo = ai_actions[ai_step]
+                nextAiMoveTime = now + 1000 // AI_MOVES_PER_SECOND
+                ai_step += 1
+                aiMoved = True
                 
         elif not ai_mode:
-            for event in pygame.event.get(): # event handling loop
+            for event in events: # event handling loop
                 if event.type == QUIT:
                     # Player clicked the "X" at the corner of the window.
                     terminate(ai_action_process)
@@ -278,13 +370,17 @@ def runLevel(levels, levelNum, ai_mode=False):
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if mode != "training":
                         if ai_assistantRect is not None and ai_assistantRect.collidepoint(event.pos):
-                            ai_map = ai_assistant.convert_to_ai_map(levelObj, gameStateObj['stars'], gameStateObj['player'])
+                            ai_map = ai_assistant.convert_to_ai_map(levelObj, gameStateObj.stars, gameStateObj.player)
                             
-                            result_queue = multiprocessing.Queue()
-                            ai_action_process = multiprocessing.Process(target=process_ai_inference, args=(ai_map, result_queue))
-                            ai_action_process.start()
+                            start_ai_worker()
+                            ai_request_id += 1
+                            ai_requests.put((ai_request_id, ai_map))
+                            result_queue = ai_results
                             ai_action_loading = True
-                            ai_actions = None
+                            ai_actions = []
+                            ai_step = 0
+                            nextAiMoveTime = pygame.time.get_ticks() + 1000 // AI_MOVES_PER_SECOND
+                            ai_snapshots = [copy.deepcopy(gameStateObj)]
                             ai_mode = True  # Change variable if image2 is clicked
                             mapNeedsRedraw = True
                         
@@ -302,16 +398,13 @@ def runLevel(levels, levelNum, ai_mode=False):
                         playerMoveTo = DOWN
 
                     elif event.key == K_n:
-                        human_training_actions = ""
                         return 'next'
                     elif event.key == K_b:
-                        human_training_actions = ""
                         return 'back'
 
                     elif event.key == K_ESCAPE:
                         terminate(ai_action_process) # Esc key quits.
                     elif event.key == K_r:
-                        human_training_actions = ""
                         return 'reset' # Reset the level.
                     elif event.key == K_p:
                         # Change the player image to the next one.
@@ -324,53 +417,88 @@ def runLevel(levels, levelNum, ai_mode=False):
         if playerMoveTo is not None and not levelIsComplete:
             # If the player pushed a key to move, make the move
             # (if possible) and push any stars that are pushable.
-            moved = makeMove(mapObj, gameStateObj, playerMoveTo)
-
-            if moved:
-                # increment the step counter.
-                gameStateObj['stepCounter'] += 1
-                mapNeedsRedraw = True
+            moved, pushed, spaces = playMove(mapObj, gameStateObj, playerMoveTo)
+            changedTiles |= spaces
+            if demo_recorder is not None and not aiMoved:
+                demo_recorder.move(DIRECTION_INDEX[playerMoveTo], moved, pushed, pygame.time.get_ticks())
+            if aiMoved:
+                ai_snapshots.append(copy.deepcopy(gameStateObj))
 
             if isLevelFinished(levelObj, gameStateObj):
                 # level is solved, we should show the "Solved!" image.
                 levelIsComplete = True
                 keyPressed = False
-
-        DISPLAYSURF.fill(BGCOLOR)
+                screenNeedsRedraw = True
+                if demo_recorder is not None and not ai_mode:
+                    demo_recorder.solved(pygame.time.get_ticks())
 
         if mapNeedsRedraw:
-            mapSurf = drawMap(mapObj, gameStateObj, levelObj['goals'], ai_mode)
+            mapSurf = drawMap(mapObj, gameStateObj, gameStateObj.goals, ai_mode, mapBackground)
             mapNeedsRedraw = False
+            screenNeedsRedraw = True
+        elif changedTiles:
+            changedRects = updateMap(mapSurf, mapBackground, changedTiles, gameStateObj, gameStateObj.goals, ai_mode)
+        changedTiles = set()
 
         mapSurfRect = mapSurf.get_rect()
         mapSurfRect.center = (2 * HALF_WINWIDTH // 3, HALF_WINHEIGHT)
 
-        # Draw mapSurf to the DISPLAYSURF Surface object.
-        DISPLAYSURF.blit(mapSurf, mapSurfRect)
-        DISPLAYSURF.blit(levelSurf, levelRect)
-        ai_assistantRect, human_playRect = draw_button_option(ai_mode)
-        draw_spec()
-        
-        stepSurf = BASICFONT.render('Steps: %s' % (gameStateObj['stepCounter']), 1, TEXTCOLOR)
+        stepSurf = BASICFONT.render('Steps: %s' % (gameStateObj.stepCounter), 1, TEXTCOLOR)
         stepRect = stepSurf.get_rect()
         stepRect.bottomleft = (220, WINHEIGHT - 20)
-        DISPLAYSURF.blit(stepSurf, stepRect)
-        
-        DISPLAYSURF.blit(difficulty_surf, difficulty_rect)
-        
-        if levelIsComplete:
-            # is solved, show the "Solved!" image until the player
-            # has pressed a key.
-            solvedRect = IMAGESDICT['solved'].get_rect()
-            solvedRect.center = (HALF_WINWIDTH, HALF_WINHEIGHT)
-            DISPLAYSURF.blit(IMAGESDICT['solved'], solvedRect)
-
-            if keyPressed:
-                return 'solved'
-            
-        
-        pygame.display.update() # draw DISPLAYSURF to the screen.
-        FPSCLOCK.tick()
+
+        if screenNeedsRedraw or (changedRects and mapCoversHud):
+            DISPLAYSURF.fill(BGCOLOR)
+
+            # Draw mapSurf to the DISPLAYSURF Surface object.
+            DISPLAYSURF.blit(mapSurf, mapSurfRect)
+            DISPLAYSURF.blit(levelSurf, levelRect)
+            ai_assistantRect, human_playRect = draw_button_option(ai_mode)
+            draw_spec()
+            DISPLAYSURF.blit(stepSurf, stepRect)
+            DISPLAYSURF.blit(difficulty_surf, difficulty_rect)
+
+            if levelIsComplete:
+                # is solved, show the "Solved!" image until the player
+                # has pressed a key.
+                solvedRect = IMAGESDICT['solved'].get_rect()
+                solvedRect.center = (HALF_WINWIDTH, HALF_WINHEIGHT)
+                DISPLAYSURF.blit(IMAGESDICT['solved'], solvedRect)
+
+            pygame.display.update() # draw DISPLAYSURF to the screen.
+            screenNeedsRedraw = False
+            drawnStepRect = stepRect
+            # Large maps run under the text and buttons: then every change redraws the window
+            specRect = pygame.Rect(WINWIDTH - 300, 3 * WINHEIGHT // 4, 300, WINHEIGHT // 4)
+            mapCoversHud = mapSurfRect.collidelist([levelRect, stepRect, difficulty_rect, specRect,
+                                                    ai_assistantRect, human_playRect]) != -1
+        elif changedRects:
+            # Only copy the changed spaces and the step counter to the screen.
+            dirtyRects = []
+            for tileRect in changedRects:
+                screenRect = tileRect.move(mapSurfRect.topleft)
+                DISPLAYSURF.blit(mapSurf, screenRect, tileRect)
+                dirtyRects.append(screenRect)
+            DISPLAYSURF.fill(BGCOLOR, drawnStepRect)
+            DISPLAYSURF.blit(stepSurf, stepRect)
+            dirtyRects += [drawnStepRect, stepRect]
+            drawnStepRect = stepRect
+            pygame.display.update(dirtyRects)
+        changedRects = []
+
+        if levelIsComplete and keyPressed:
+            return 'solved'
+
+
+
+def waitForEvents(timeout=None):
+    """Blocks until there is an event or timeout milliseconds have passed
+    (None waits for an event). Returns the list of pending events."""
+    if timeout is not None and timeout <= 0:
+        return pygame.event.get()
+    event = pygame.event.wait() if timeout is None else pygame.event.wait(int(timeout))
+    events = [] if event.type == NOEVENT else [event]
+    return events + pygame.event.get()
 
 
 def isWall(mapObj, x, y):
@@ -452,7 +580,7 @@ def decorateMap(mapObj, startxy):
         for y in range(col_num):     
             if mapObjCopy[x][y] == ' ': 
                 if  random.randint(0, 99) < OUTSIDE_DECORATION_PCT:
-                    mapObjCopy[x][y] = random.choice(list(OUTSIDEDECOMAPPING.keys()))
+                    mapObjCopy[x][y] = random.choice(OUTSIDE_DECORATIONS)
                     
                 if (isWall(mapObjCopy, x, y-1) and isWall(mapObjCopy, x+1, y)) or \
                     (isWall(mapObjCopy, x+1, y) and isWall(mapObjCopy, x, y+1)) or \
@@ -473,7 +601,7 @@ def isBlocked(mapObj, gameStateObj, x, y):
     elif x < 0 or x >= len(mapObj) or y < 0 or y >= len(mapObj[x]):
         return True # x and y aren't actually on the map.
 
-    elif (x, y) in gameStateObj['stars']:
+    elif (x, y) in gameStateObj.stars:
         return True # a star is blocking
 
     return False
@@ -485,14 +613,13 @@ def makeMove(mapObj, gameStateObj, playerMoveTo):
     position (and the position of any pushed star). If not, do nothing.
 
     Returns True if the player moved, otherwise False."""
-    global human_training_actions
 
     # Make sure the player can move in the direction they want.
-    playerx, playery = gameStateObj['player']
+    playerx, playery = gameStateObj.player
 
     # This variable is "syntactic sugar". Typing "stars" is more
-    # readable than typing "gameStateObj['stars']" in our code.
-    stars = gameStateObj['stars']
+    # readable than typing "gameStateObj.stars" in our code.
+    stars = gameStateObj.stars
 
     # The code for handling each of the directions is so similar aside
     # from adding or subtracting 1 to the x/y coordinates. We can
@@ -500,44 +627,52 @@ def makeMove(mapObj, gameStateObj, playerMoveTo):
     if playerMoveTo == UP:
         xOffset = -1
         yOffset = 0
-        if mode == "training":
-            human_training_actions += "U"
     elif playerMoveTo == RIGHT:
         xOffset = 0
         yOffset = 1
-        if mode == "training":
-            human_training_actions += "R"
     elif playerMoveTo == DOWN:
         xOffset = 1
         yOffset = 0
-        if mode == "training":
-            human_training_actions += "D"
     elif playerMoveTo == LEFT:
         xOffset = 0
         yOffset = -1
-        if mode == "training":
-            human_training_actions += "L"
 
     # See if the player can move in that direction.
     if isWall(mapObj, playerx + xOffset, playery + yOffset):
-        if mode == "training":
-            human_training_actions = human_training_actions[:-1]
         return False
     else:
         if (playerx + xOffset, playery + yOffset) in stars:
             # There is a star in the way, see if the player can push it.
             if not isBlocked(mapObj, gameStateObj, playerx + (xOffset*2), playery + (yOffset*2)):
                 # Move the star.
-                ind = stars.index((playerx + xOffset, playery + yOffset))
-                stars[ind] = (stars[ind][0] + xOffset, stars[ind][1] + yOffset)
+                gameStateObj.moveStar((playerx + xOffset, playery + yOffset),
+                                      (playerx + (xOffset*2), playery + (yOffset*2)))
             else:
-                if mode == "training":
-                    human_training_actions = human_training_actions[:-1]
                 return False
         # Move the player upwards.
-        gameStateObj['player'] = (playerx + xOffset, playery + yOffset)
+        gameStateObj.player = (playerx + xOffset, playery + yOffset)
         return True
 
+def playMove(mapObj, gameStateObj, playerMoveTo):
+    """makeMove() plus what playing a move updates: the step counter.
+    Returns (moved, pushed, changed spaces), where the changed spaces are
+    the ones the player left and entered, and the next one if a star was
+    pushed there. Needs no pygame set up, so batch_play uses it too."""
+    oldx, oldy = gameStateObj.player
+    oldPushCounter = gameStateObj.pushCounter
+    moved = makeMove(mapObj, gameStateObj, playerMoveTo)
+    pushed = gameStateObj.pushCounter != oldPushCounter
+    spaces = set()
+    if moved:
+        # increment the step counter.
+        gameStateObj.stepCounter += 1
+        playerx, playery = gameStateObj.player
+        spaces = {(oldx, oldy), (playerx, playery)}
+        if pushed:
+            spaces.add((2 * playerx - oldx, 2 * playery - oldy))
+    return moved, pushed, spaces
+
+
 def draw_button_option(ai_mode):
     """Display the start screen (which has the title and instructions)
     until the player presses a key. Returns None."""
@@ -704,14 +839,71 @@ def startScreen():
 
         # Display the DISPLAYSURF contents to the actual screen.
         pygame.display.update()
-        FPSCLOCK.tick()
+        FPSCLOCK.tick(FPS)
 
 
 import model_related
+
+
+class GameState:
+    """The changing part of a level: the player, the stars and the step count.
+
+    Stars are kept in a set and the goals in a frozenset, and moveStar()
+    keeps count of the stars on goals, so collision checks, moves and
+    isSolved() are O(1). gameStateObj['player'], ['stars'] and
+    ['stepCounter'] still work as with the former dict."""
+    KEYS = ('player', 'stepCounter', 'stars')
+
+    def __init__(self, player, stars, goals, stepCounter=0):
+        self.player = player
+        self.stepCounter = stepCounter
+        self.pushCounter = 0
+        self.goals = frozenset(goals)
+        self.stars = set(stars)
+        self.starsOnGoals = len(self.stars & self.goals)
+
+    def moveStar(self, source, dest):
+        """Moves the star at source to dest."""
+        self.stars.remove(source)
+        self.stars.add(dest)
+        self.pushCounter += 1
+        self.starsOnGoals += (dest in self.goals) - (source in self.goals)
+
+    def isSolved(self):
+        return self.starsOnGoals == len(self.goals)
+
+    # dict compatibility for code written against the former gameStateObj dict
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        if key == 'stars':
+            value = set(value)
+            self.starsOnGoals = len(value & self.goals)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def get(self, key, default=None):
+        return self[key] if key in self.KEYS else default
+
+
 # map_data is stored as list. Each item represents one line's layout
 def read_map(mapTextLines):
-    
-    mapObj = [list(mapline) for mapline in mapTextLines]     
+    return levelFromRecord(parseMap(mapTextLines))
+
+
+def parseMap(mapTextLines):
+    """Finds the player, goals and stars of a map. Returns them as the
+    plain (map lines, player, goals, stars) record kept by level_cache."""
 
     # Loop through the spaces in the map and find the @, ., and $
     # characters for the starting game state.
@@ -720,18 +912,18 @@ def read_map(mapTextLines):
     goals = [] # list of (x, y) tuples for each goal.
     stars = [] # list of (x, y) for each star's starting position.
 
-    for x in range(len(mapObj)):
-        for y in range(len(mapObj[0])):
+    for x in range(len(mapTextLines)):
+        for y in range(len(mapTextLines[0])):
 
-            if mapObj[x][y] == '@':
+            if mapTextLines[x][y] == '@':
                 startx = x
                 starty = y
 
-            if mapObj[x][y] == '.':
+            if mapTextLines[x][y] == '.':
                 goals.append((x, y))
-            if mapObj[x][y] == '$':
+            if mapTextLines[x][y] == '$':
                 stars.append((x, y))
-            if mapObj[x][y] == "*":
+            if mapTextLines[x][y] == "*":
                 goals.append((x, y))
                 stars.append((x, y))
 
@@ -740,10 +932,16 @@ def read_map(mapTextLines):
     assert len(goals) > 0, 'Levelmust have at least one goal.'
     assert len(stars) >= len(goals), 'Level is impossible to solve. It has %s goals but only %s stars.'
 
+    return list(mapTextLines), (startx, starty), goals, stars
+
+
+def levelFromRecord(record):
+    """Builds the level object of a parseMap() record."""
+    mapTextLines, player, goals, stars = record
+    mapObj = [list(mapline) for mapline in mapTextLines]
+
     # Create level object and starting game state object.
-    gameStateObj = {'player': (startx, starty),
-                    'stepCounter': 0,
-                    'stars': stars}
+    gameStateObj = GameState(player, stars, goals)
     levelObj = {'width': len(mapObj[0]),
                 'height': len(mapObj),
                 'mapObj': mapObj,
@@ -753,44 +951,44 @@ def read_map(mapTextLines):
     return levelObj
 
 
+def recordFromLevel(levelObj):
+    """The parseMap() record of a level object, for level_cache."""
+    startState = levelObj['startState']
+    return (["".join(row) for row in levelObj['mapObj']], startState.player, list(levelObj['goals']),
+            sorted(startState.stars))
+
+
 def floodFill(mapObj, x, y, oldCharacter, newCharacter):
     """Changes any values matching oldCharacter on the map object to
-    newCharacter at the (x, y) position, and does the same for the
-    positions to the left, right, down, and up of (x, y), recursively."""
+    newCharacter at the (x, y) position, and does the same for every
+    matching position connected to it to the left, right, down, and up."""
 
     # In this game, the flood fill algorithm creates the inside/outside
-    # floor distinction. This is a "recursive" function.
+    # floor distinction. It keeps its own stack of positions instead of
+    # recursing, so large open maps cannot hit the recursion limit.
     # For more info on the Flood Fill algorithm, see:
     #   http://en.wikipedia.org/wiki/Flood_fill
     if mapObj[x][y] == oldCharacter:
         mapObj[x][y] = newCharacter
 
-    if x < len(mapObj) - 1 and mapObj[x+1][y] == oldCharacter:
-        floodFill(mapObj, x+1, y, oldCharacter, newCharacter) # call right
-    if x > 0 and mapObj[x-1][y] == oldCharacter:
-        floodFill(mapObj, x-1, y, oldCharacter, newCharacter) # call left
-    if y < len(mapObj[x]) - 1 and mapObj[x][y+1] == oldCharacter:
-        floodFill(mapObj, x, y+1, oldCharacter, newCharacter) # call down
-    if y > 0 and mapObj[x][y-1] == oldCharacter:
-        floodFill(mapObj, x, y-1, oldCharacter, newCharacter) # call up
-
+    stack = [(x, y)]
+    while stack:
+        x, y = stack.pop()
+        for nextx, nexty in ((x+1, y), (x-1, y), (x, y+1), (x, y-1)): # right, left, down, up
+            if 0 <= nextx < len(mapObj) and 0 <= nexty < len(mapObj[nextx]) and mapObj[nextx][nexty] == oldCharacter:
+                mapObj[nextx][nexty] = newCharacter
+                stack.append((nextx, nexty))
 
-def drawMap(mapObj, gameStateObj, goals, ai_mode):
-    """Draws the map to a Surface object, including the player and
-    stars. This function does not call pygame.display.update(), nor
-    does it draw the "Level" and "Steps" text in the corner."""
 
-    # mapSurf will be the single Surface object that the tiles are drawn
-    # on, so that it is easy to position the entire map on the DISPLAYSURF
-    # Surface object. First, the width and height must be calculated.
+def drawMapBackground(mapObj):
+    """Draws the parts of the map that never change (floor, wall and
+    decoration tiles) to a Surface object. runLevel draws it once per level
+    and drawMap()/updateMap() copy from it."""
     col_num = len(mapObj[0])
     row_num = len(mapObj)
-    mapSurfWidth = col_num * TILEWIDTH  
-    mapSurfHeight = row_num * TILEHEIGHT 
-    mapSurf = pygame.Surface((mapSurfWidth, mapSurfHeight))
-    mapSurf.fill(BGCOLOR) # start with a blank color on the surface.
+    background = pygame.Surface((col_num * TILEWIDTH, row_num * TILEHEIGHT))
+    background.fill(BGCOLOR) # start with a blank color on the surface.
 
-    # Draw the tile sprites onto this surface.
     for x in range(row_num):
         for y in range(col_num):
             spaceRect = pygame.Rect((y * TILEWIDTH, x * TILEHEIGHT, TILEWIDTH, TILEHEIGHT))
@@ -800,51 +998,80 @@ def drawMap(mapObj, gameStateObj, goals, ai_mode):
                 baseTile = TILEMAPPING[' ']
 
             # First draw the base ground/wall tile.
-            mapSurf.blit(baseTile, spaceRect)
+            background.blit(baseTile, spaceRect)
 
             if mapObj[x][y] in OUTSIDEDECOMAPPING:
                 # Draw any tree/rock decorations that are on this tile.
-                mapSurf.blit(OUTSIDEDECOMAPPING[mapObj[x][y]], spaceRect)
-            elif (x, y) in gameStateObj['stars']:
-                if (x, y) in goals:
-                    # A goal AND star are on this space, draw goal first.
-                    mapSurf.blit(IMAGESDICT['covered goal'], spaceRect)
-                # Then draw the star sprite.
-                spaceRect = pygame.Rect((y * TILEWIDTH+5, x * TILEHEIGHT+5, TILEWIDTH, TILEHEIGHT))
-                mapSurf.blit(IMAGESDICT['star'], spaceRect)
-            elif (x, y) in goals:
-                
-                # Draw a goal without a star on it.
-                mapSurf.blit(IMAGESDICT['uncovered goal'], spaceRect)
-
-            # Last draw the player on the board.
-            if (x, y) == gameStateObj['player']:
-                # Note: The value "currentImage" refers to a key in "PLAYERIMAGES" which has the
-                # specific player image we want to show.
-                spaceRect = pygame.Rect((y * TILEWIDTH+5, x * TILEHEIGHT+5, TILEWIDTH, TILEHEIGHT))
-                if ai_mode:
-                    mapSurf.blit(ROBOTIMAGE, spaceRect)
-                else:
-                    mapSurf.blit(PLAYERIMAGES[currentImage], spaceRect)
+                background.blit(OUTSIDEDECOMAPPING[mapObj[x][y]], spaceRect)
+    return background
+
+
+def drawTile(mapSurf, x, y, gameStateObj, goals, ai_mode):
+    """Draws the goal, star and player sprites of the (x, y) space onto
+    mapSurf, which already has the background of that space."""
+    spaceRect = pygame.Rect((y * TILEWIDTH, x * TILEHEIGHT, TILEWIDTH, TILEHEIGHT))
+    spriteRect = pygame.Rect((y * TILEWIDTH+5, x * TILEHEIGHT+5, TILEWIDTH, TILEHEIGHT))
+    # Keep the sprites inside their space: updateMap() only redraws the changed spaces.
+    mapSurf.set_clip(spaceRect)
+    if (x, y) in gameStateObj.stars:
+        if (x, y) in goals:
+            # A goal AND star are on this space, draw goal first.
+            mapSurf.blit(IMAGESDICT['covered goal'], spaceRect)
+        # Then draw the star sprite.
+        mapSurf.blit(IMAGESDICT['star'], spriteRect)
+    elif (x, y) in goals:
+        # Draw a goal without a star on it.
+        mapSurf.blit(IMAGESDICT['uncovered goal'], spaceRect)
+
+    # Last draw the player on the board.
+    if (x, y) == gameStateObj.player:
+        # Note: The value "currentImage" refers to a key in "PLAYERIMAGES" which has the
+        # specific player image we want to show.
+        if ai_mode:
+            mapSurf.blit(ROBOTIMAGE, spriteRect)
+        else:
+            mapSurf.blit(PLAYERIMAGES[currentImage], spriteRect)
+    mapSurf.set_clip(None)
+
 
+def drawMap(mapObj, gameStateObj, goals, ai_mode, background=None):
+    """Draws the map to a Surface object, including the player and
+    stars. This function does not call pygame.display.update(), nor
+    does it draw the "Level" and "Steps" text in the corner.
+    background is the drawMapBackground() Surface of mapObj (drawn here if None)."""
+    if background is None:
+        background = drawMapBackground(mapObj)
+    # mapSurf will be the single Surface object that the tiles are drawn
+    # on, so that it is easy to position the entire map on the DISPLAYSURF
+    # Surface object.
+    mapSurf = background.copy()
+    for x, y in set(goals) | gameStateObj.stars | {gameStateObj.player}:
+        drawTile(mapSurf, x, y, gameStateObj, goals, ai_mode)
     return mapSurf
 
 
+def updateMap(mapSurf, background, spaces, gameStateObj, goals, ai_mode):
+    """Redraws only the given (x, y) spaces of a drawMap() Surface, e.g. the
+    ones a move changed. Returns their Rects on mapSurf."""
+    rects = []
+    for x, y in spaces:
+        spaceRect = pygame.Rect((y * TILEWIDTH, x * TILEHEIGHT, TILEWIDTH, TILEHEIGHT))
+        mapSurf.blit(background, spaceRect, spaceRect)
+        drawTile(mapSurf, x, y, gameStateObj, goals, ai_mode)
+        rects.append(spaceRect)
+    return rects
+
+
 def isLevelFinished(levelObj, gameStateObj):
     """Returns True if all the goals have stars in them."""
-    for goal in levelObj['goals']:
-        if goal not in gameStateObj['stars']:
-            # Found a space with a goal but no star on it.
-            return False
-    return True
+    return gameStateObj.isSolved()
 
 
 def terminate(process):
     # check if the ai_action_process is triggered or not
     if process is not None and process.is_alive():
-        print("Terminating background process...")
-        process.terminate()
-        process.join()
+        print("Stopping the AI worker...")
+    stop_ai_worker()
     
     pygame.quit()
     sys.exit()
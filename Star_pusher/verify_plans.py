@@ -0,0 +1,139 @@
+# Headless replay check of human demos and AI plans.
+#
+# starpusher_specify_map_ai_verify.py animates one plan in a pygame window.
+# This replays every plan with the rules of starpusher.makeMove /
+# isLevelFinished on sokoban_core states (no display, no pygame) and sorts
+# each one into:
+#   solved      the level is finished at some point of the plan
+#   incomplete  the level is not finished at the end of the plan
+#   invalid     the map cannot be read
+# As in the game, a blocked move leaves the state unchanged; blocked moves
+# are only counted.
+# Inputs are demo files (map lines, a blank line, UDLR actions), folders of
+# them, and batch_solve JSONL outputs, whose level ids are looked up below
+# sokoban_cache/boxoban-levels-master. Plans are checked in a process pool.
+#
+# Usage: python3 verify_plans.py [../human_demos sokoban_cache/human_training hard.jsonl] [--workers 8]
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+import batch_solve
+import sokoban_core
+
+SOLVED = "solved"
+INCOMPLETE = "incomplete"
+INVALID = "invalid"
+
+parent_dir = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_SOURCES = [os.path.join(os.path.dirname(parent_dir), "human_demos"),
+                   os.path.join(parent_dir, "sokoban_cache", "human_training")]
+
+_level_files = {}  # per process: level file path -> map line lists
+
+
+def verify(map_lines, plan):
+    """
+    Replay plan on the map. Returns (status, moves until finished or played,
+    blocked moves among them, reason).
+    """
+    try:
+        _, state = sokoban_core.parse_ascii(map_lines)
+    except ValueError as e:
+        return INVALID, 0, 0, str(e)
+    if state.is_solved():
+        return SOLVED, 0, 0, None
+    blocked = 0
+    for i, char in enumerate(plan):
+        moved, _ = state.step(char)
+        blocked += not moved
+        if state.is_solved():
+            return SOLVED, i + 1, blocked, None
+    return INCOMPLETE, len(plan), blocked, f"{len(state.level.goals) - state.boxes_on_goal} goals left"
+
+
+def _boxoban_level(identifier):
+    """Map lines of a batch_solve level id ("<file>:<index>")."""
+    file_path, index = identifier.rsplit(":", 1)
+    if not os.path.isabs(file_path):
+        file_path = os.path.join(batch_solve.BOXOBAN_ROOT, file_path)
+    if file_path not in _level_files:
+        _level_files[file_path] = sokoban_core.read_level_file(file_path)
+    return _level_files[file_path][int(index)]
+
+
+def check_task(task):
+    """Worker: (name, kind, payload) -> result record."""
+    name, kind, payload = task
+    try:
+        if kind == "demo":
+            map_lines, plan = sokoban_core.read_demo_file(payload)
+        else:
+            plan = payload
+            map_lines = _boxoban_level(name)
+    except (OSError, IndexError, ValueError) as e:
+        return {"name": name, "status": INVALID, "moves": 0, "blocked": 0, "reason": f"cannot read the level: {e}"}
+    status, moves, blocked, reason = verify(map_lines, plan)
+    return {"name": name, "status": status, "moves": moves, "blocked": blocked, "reason": reason}
+
+
+def iter_tasks(paths):
+    """(name, kind, payload) for every plan under paths. JSONL lines without a plan are skipped."""
+    for path in paths:
+        if path.endswith(".jsonl"):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        if record.get("plan") is not None:
+                            yield record["id"], "plan", record["plan"]
+        else:
+            for file_path in batch_solve.level_files([path]):
+                yield file_path, "demo", file_path
+
+
+def run(paths, workers=None, chunk_size=64):
+    """Check every plan under paths. Returns the list of result records."""
+    with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+        return list(pool.imap_unordered(check_task, iter_tasks(paths), chunksize=chunk_size))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay demos and AI plans without a display.")
+    parser.add_argument("paths", nargs="*", help="demo files or folders, or batch_solve .jsonl outputs "
+                                                 "(default: human_demos and human_training)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--all", action="store_true", help="also list the solved plans")
+    parser.add_argument("--out", default=None, help="write every result as a JSON line")
+    args = parser.parse_args()
+
+    paths = args.paths or [path for path in DEFAULT_SOURCES if os.path.exists(path)]
+    for path in paths:
+        if not os.path.exists(path):
+            raise SystemExit(f"The path {path} does not exist.")
+
+    start = time.time()
+    results = run(paths, args.workers, args.chunk_size)
+    elapsed = time.time() - start
+    results.sort(key=lambda record: record["name"])
+    for record in results:
+        if args.all or record["status"] != SOLVED:
+            reason = f" ({record['reason']})" if record["reason"] else ""
+            print(f"{record['name']}: {record['status']} after {record['moves']} moves "
+                  f"({record['blocked']} blocked){reason}")
+    if args.out:
+        with open(args.out, "w") as f:
+            for record in results:
+                f.write(json.dumps(record) + "\n")
+
+    counts = Counter(record["status"] for record in results)
+    print("=" * 50)
+    print(f"{len(results)} plans in {elapsed:.2f}s ({len(results) / max(elapsed, 1e-9):.0f} plans/s): "
+          + ", ".join(f"{status} {counts[status]}" for status in (SOLVED, INCOMPLETE, INVALID))
+          + f"; {sum(record['blocked'] for record in results)} blocked moves")
+    if counts[SOLVED] != len(results):
+        raise SystemExit(1)
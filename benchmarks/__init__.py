@@ -0,0 +1,20 @@
+"""
+Throughput benchmarks for the Sokoban environments.
+
+Measures steps/sec, resets/sec and render fps for every gym_sokoban env
+variation and observation mode, plus Star_pusher's model_related.SokobanEnv
+and the sokoban_core simulator, and compares a run against a stored baseline.
+
+Run time is dominated by the resets of the gym_sokoban envs that generate a
+new room on every reset (SokobanEnv*, FixedTargets*, PushAndPull*,
+TwoPlayer*): from a few seconds to several minutes per reset, so a full run
+takes hours even with --steps 50 --resets 2. The Boxoban envs, Star_pusher's
+env and sokoban_core run in seconds each. --skip-generated leaves the
+generated-room envs out; with --out the report is rewritten after every
+target, so an interrupted run keeps its results.
+
+Usage:
+    python -m benchmarks run --skip-generated --out bench.json
+    python -m benchmarks run --out bench.json
+    python -m benchmarks compare bench.json baseline.json --tolerance 0.2
+"""
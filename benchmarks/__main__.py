@@ -0,0 +1,70 @@
+import argparse
+import json
+import sys
+from benchmarks import env_throughput
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Sokoban environment throughput benchmarks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write a JSON report")
+    run_parser.add_argument("--targets", nargs="*", default=None,
+                            help="fnmatch patterns of '<env>/<mode>' targets, e.g. 'SokobanEnv1/*' '*/raw'")
+    run_parser.add_argument("--steps", type=int, default=1000)
+    run_parser.add_argument("--resets", type=int, default=5)
+    run_parser.add_argument("--warmup", type=int, default=100)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--skip-generated", action="store_true",
+                            help="skip the gym_sokoban envs that generate a room on every reset (minutes per reset)")
+    run_parser.add_argument("--out", default=None,
+                            help="JSON report path, rewritten after every target (default: stdout at the end)")
+    run_parser.add_argument("--list", action="store_true", help="only list the available targets")
+
+    compare_parser = subparsers.add_parser("compare", help="compare a report against a baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("--tolerance", type=float, default=0.2,
+                                help="allowed relative slowdown before a metric counts as a regression")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        if args.list:
+            print("\n".join(env_throughput.list_targets(args.skip_generated)))
+            return 0
+
+        def save(report):
+            with open(args.out, "w") as f:
+                json.dump(report, f, indent=2)
+
+        report = env_throughput.run(args.targets, args.steps, args.resets, args.warmup, args.seed,
+                                    verbose=args.out is not None, skip_generated=args.skip_generated,
+                                    on_result=save if args.out else None)
+        if args.out:
+            save(report)
+            print(f"Wrote {len(report['results'])} results to {args.out}")
+        else:
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        return 0
+
+    with open(args.current) as f:
+        current = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = env_throughput.compare(current, baseline, args.tolerance)
+    missing = sorted(set(baseline["results"]) - set(current["results"]))
+    if missing:
+        print(f"{len(missing)} baseline targets not in the current report: {', '.join(missing)}")
+    for target, metric, base, value, ratio in regressions:
+        print(f"REGRESSION {target} {metric}: {base:.1f} -> {value:.1f} ({(ratio - 1) * 100:+.1f}%)")
+    if regressions:
+        print(f"{len(regressions)} regressions beyond {args.tolerance * 100:.0f}% tolerance")
+        return 1
+    print(f"No regressions beyond {args.tolerance * 100:.0f}% tolerance")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""Step, reset and render throughput of the gym_sokoban and Star_pusher environments."""
+
+import contextlib
+import fnmatch
+import inspect
+import io
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+STAR_PUSHER_DIR = os.path.join(REPO_ROOT, "Star_pusher")
+
+GYM_OBSERVATION_MODES = ['rgb_array', 'tiny_rgb_array', 'raw']
+METRICS = ['steps_per_sec', 'resets_per_sec', 'render_fps']
+# sokoban_core has no episode end: restart from the next map after this many steps,
+# the max_steps of Star_pusher's SokobanEnv in its first curriculum phase
+CORE_EPISODE_STEPS = 100
+
+
+def _seed_everything(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+@contextlib.contextmanager
+def _boxoban_cache():
+    """BoxobanEnv reads levels from ./.sokoban_cache; point it at Star_pusher's copy instead of downloading."""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.symlink(os.path.join(STAR_PUSHER_DIR, "sokoban_cache"), os.path.join(tmp, ".sokoban_cache"))
+        os.chdir(tmp)
+        try:
+            yield
+        finally:
+            os.chdir(previous)
+
+
+def is_generated(cls):
+    """True for the gym_sokoban envs that generate a new room on every reset (all but the Boxoban ones)."""
+    from gym_sokoban.envs import BoxobanEnv
+    return not issubclass(cls, BoxobanEnv)
+
+
+def discover_gym_sokoban_envs():
+    """Every env class defined in gym_sokoban/envs/sokoban_env_variations.py, by name."""
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from gym_sokoban.envs import sokoban_env_variations, SokobanEnv
+
+    classes = {}
+    for name, cls in inspect.getmembers(sokoban_env_variations, inspect.isclass):
+        if issubclass(cls, SokobanEnv) and cls.__module__ == sokoban_env_variations.__name__:
+            classes[name] = cls
+    return classes
+
+
+def _time_loop(n, fn):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return time.perf_counter() - start
+
+
+def bench_gym_env(cls, mode, steps, resets, warmup, seed):
+    """Benchmark one gym_sokoban env class in one observation mode."""
+    from gym_sokoban.envs import BoxobanEnv
+
+    with _boxoban_cache() if issubclass(cls, BoxobanEnv) else contextlib.nullcontext():
+        _seed_everything(seed)
+        env = cls()
+        action_rng = np.random.RandomState(seed)
+        actions = action_rng.randint(1, env.action_space.n, size=warmup + steps)
+        reset_time = [0.0]
+
+        def do_step(i):
+            _, _, done, _ = env.step(int(actions[i]), observation_mode=mode)
+            if done:
+                start = time.perf_counter()
+                env.reset()
+                reset_time[0] += time.perf_counter() - start
+
+        for i in range(warmup):
+            do_step(i)
+        reset_time[0] = 0.0
+        step_time = _time_loop(steps, lambda i: do_step(warmup + i)) - reset_time[0]
+
+        reset_elapsed = _time_loop(resets, lambda i: env.reset())
+        render_elapsed = _time_loop(steps, lambda i: env.render(mode=mode))
+
+    return {
+        'steps_per_sec': steps / step_time,
+        'resets_per_sec': resets / reset_elapsed,
+        'render_fps': steps / render_elapsed,
+    }
+
+
+def bench_star_pusher_env(steps, resets, warmup, seed):
+    """Benchmark Star_pusher's model_related.SokobanEnv (7-channel symbolic observations)."""
+    if STAR_PUSHER_DIR not in sys.path:
+        sys.path.insert(0, STAR_PUSHER_DIR)
+    import model_related
+
+    _seed_everything(seed)
+    env = model_related.SokobanEnv(maps_type='train')
+    env.reset(seed=seed)
+    actions = np.random.RandomState(seed).randint(0, 4, size=warmup + steps)
+    reset_time = [0.0]
+
+    def do_step(i):
+        _, _, terminated, truncated, _ = env.step(int(actions[i]))
+        if terminated or truncated:
+            start = time.perf_counter()
+            env.reset()
+            reset_time[0] += time.perf_counter() - start
+
+    for i in range(warmup):
+        do_step(i)
+    reset_time[0] = 0.0
+    step_time = _time_loop(steps, lambda i: do_step(warmup + i)) - reset_time[0]
+    reset_elapsed = _time_loop(resets, lambda i: env.reset())
+    # render() prints the board; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        render_elapsed = _time_loop(steps, lambda i: env.render())
+
+    return {
+        'steps_per_sec': steps / step_time,
+        'resets_per_sec': resets / reset_elapsed,
+        'render_fps': steps / render_elapsed,
+    }
+
+
+def bench_sokoban_core(steps, resets, warmup, seed):
+    """
+    Benchmark the sokoban_core simulator on the curriculum maps (render = observation encoding).
+    Like the env targets, an episode ends when the map is solved or after
+    CORE_EPISODE_STEPS steps, and the next one starts from the next map.
+    """
+    if STAR_PUSHER_DIR not in sys.path:
+        sys.path.insert(0, STAR_PUSHER_DIR)
+    import model_related
+    import sokoban_core
+
+    maps = model_related.create_maps()['train']
+    rng = np.random.RandomState(seed)
+    actions = rng.randint(0, 4, size=warmup + steps)
+    starts = [sokoban_core.parse_numeric(num_map)[1] for num_map in maps]
+    env = {'state': starts[0].copy(), 'episode': 0, 'steps': 0}
+    reset_time = [0.0]
+
+    def reset(i):
+        env['state'] = starts[i % len(starts)].copy()
+        env['steps'] = 0
+
+    def do_step(i):
+        env['state'].step(int(actions[i]))
+        env['steps'] += 1
+        if env['steps'] >= CORE_EPISODE_STEPS or env['state'].is_solved():
+            start = time.perf_counter()
+            env['episode'] += 1
+            reset(env['episode'])
+            reset_time[0] += time.perf_counter() - start
+
+    for i in range(warmup):
+        do_step(i)
+    reset_time[0] = 0.0
+    step_time = _time_loop(steps, lambda i: do_step(warmup + i)) - reset_time[0]
+    reset_elapsed = _time_loop(resets, reset)
+    render_elapsed = _time_loop(steps, lambda i: env['state'].observation())
+
+    return {
+        'steps_per_sec': steps / step_time,
+        'resets_per_sec': resets / reset_elapsed,
+        'render_fps': steps / render_elapsed,
+    }
+
+
+def list_targets(skip_generated=False):
+    """All benchmark targets as '<env>/<mode>' names (skip_generated: without the generated-room envs)."""
+    targets = []
+    for name, cls in discover_gym_sokoban_envs().items():
+        if skip_generated and is_generated(cls):
+            continue
+        for mode in GYM_OBSERVATION_MODES:
+            targets.append(f"{name}/{mode}")
+    targets.append("StarPusher_SokobanEnv/symbolic")
+    targets.append("sokoban_core/symbolic")
+    return targets
+
+
+def run(patterns=None, steps=1000, resets=5, warmup=100, seed=0, verbose=True, skip_generated=False,
+        on_result=None):
+    """
+    Run every target matching one of the fnmatch patterns. Returns the JSON-ready report.
+    on_result(report) is called after each target with the results so far, e.g. to save partial results.
+    """
+    gym_envs = discover_gym_sokoban_envs()
+    results = {}
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'steps': steps,
+            'resets': resets,
+            'warmup': warmup,
+            'seed': seed,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    for target in list_targets(skip_generated):
+        if patterns and not any(fnmatch.fnmatch(target, p) for p in patterns):
+            continue
+        name, mode = target.split('/')
+        if name == "StarPusher_SokobanEnv":
+            result = bench_star_pusher_env(steps, resets, warmup, seed)
+        elif name == "sokoban_core":
+            result = bench_sokoban_core(steps, resets, warmup, seed)
+        else:
+            result = bench_gym_env(gym_envs[name], mode, steps, resets, warmup, seed)
+        results[target] = result
+        if verbose:
+            print(f"{target:45s} steps/s {result['steps_per_sec']:10.1f}   "
+                  f"resets/s {result['resets_per_sec']:8.2f}   render fps {result['render_fps']:10.1f}")
+        if on_result is not None:
+            on_result(report)
+
+    return report
+
+
+def compare(current, baseline, tolerance=0.2):
+    """
+    Compare two reports. A metric regresses when it drops below baseline * (1 - tolerance).
+    Returns a list of (target, metric, baseline value, current value, ratio) regressions.
+    """
+    regressions = []
+    for target, base_metrics in baseline['results'].items():
+        if target not in current['results']:
+            continue
+        for metric in METRICS:
+            base = base_metrics.get(metric)
+            value = current['results'][target].get(metric)
+            if base is None or value is None or base <= 0:
+                continue
+            ratio = value / base
+            if ratio < 1 - tolerance:
+                regressions.append((target, metric, base, value, ratio))
+    return regressions